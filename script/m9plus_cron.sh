@@ -61,8 +61,11 @@ else
         fi;
     done
     if [[ "$X" == *.gz ]]; then
-        Y="$HOMEDIR/com_temp/latest_com_zone"
-        gunzip -c $X > $Y
+        # compress the zone again in independent gzip members, so that
+        # the parser and the sampler can split it between processes
+        # without a decompressed copy.
+        Y="$HOMEDIR/com_temp/latest_com_zone.gz"
+        python zonescanner.py blocked $X $Y
         X=$Y
     fi
     echo "X: $X"
@@ -104,6 +107,12 @@ then
 echo "Adding $NBSAMPLES to the DNS processed list"
     #../script/central_million.sh $YYYYMM $NBSAMPLES
     TEMP=$HOMEDIR/tmp/dnslookup_
+    if [ -f ${TEMP}_run.txt ];
+    then
+        # complete the lookups of a previous run, which was interrupted
+        # since its run file is only removed when all its buckets are merged
+        python do_dnslookup.py $NBSAMPLES $IP2AS $IP2AS6 $PUB_S $MILLION $COM_SAMPLES $RESULT $TEMP resume
+    fi
     rm $TEMP*
     python do_dnslookup.py $NBSAMPLES $IP2AS $IP2AS6 $PUB_S $MILLION $COM_SAMPLES $RESULT $TEMP
 fi
@@ -123,8 +132,9 @@ then
     m9_day="$YEAR-$MM-$DAY"
     m9_file="$HOMEDIR/M9/M9-$m9_day.csv"
     ip_list="$HOMEDIR/ip_list_$m9_day"
+    m9_state="$HOMEDIR/dns_millions/m9_state_$YYYYMM.json"
     echo "Computing M9 in $m9_file from $com_stats and $mill_stats"
-    python compute_m9.py $PUB_S $DUP_S ../data/asnames.txt $RESULT $RESULT_NS $m9_file $m9_day $ip_list
+    python compute_m9.py $PUB_S $DUP_S ../data/asnames.txt $RESULT $RESULT_NS $m9_file $m9_day $ip_list $m9_state
 fi
 
 if [ -f $RESULT ]
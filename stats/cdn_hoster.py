@@ -66,7 +66,7 @@ def add_aggregated_asn(asn_dict, aggregator, raw_asn_list, million_range):
 
 # recompute the set of ASN to make sure bith IPv4 and IPv6 addresses
 def recompute_asn(dnslook_entry, i2a, i2a6):
-    if len(i2a.table) > 0 and len(i2a6.table) > 0:
+    if i2a.nb_ranges() > 0 and i2a6.nb_ranges() > 0:
         dnslook_entry.get_asn(i2a, i2a6)
 
 def add_dnslook_entry(net_dict, asn_dict, aggregator, dnslook_entry):
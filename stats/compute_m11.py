@@ -11,6 +11,7 @@
 
 import sys
 import dnslook
+import dnslook_store
 import json
 import pubsuffix
 import zoneparser
@@ -379,52 +380,53 @@ class m11_computer:
             str(len(self.cctld_algos)) + " cctld algos, ")
 
     def load(self, dns_json):
-        domainsFound = dict()
-        nb_domains_duplicate = 0
-        for line in open(dns_json, "rt"):
-            dns_look = dnslook.dnslook()
+        # Only the columns needed for the metrics are read from the store.
+        store = dnslook_store.open_dns_columns(dns_json)
+        domains = store.column("domain")
+        million_ranges = store.column("range").tolist()
+        ds_algos = store.row_lists("ds_algo")
+        ns_lists = store.row_lists("ns")
+        first_rows = store.first_rows()
+        nb_domains_duplicate = store.nb_rows - len(first_rows)
+        for i in first_rows:
+            domain = domains[i]
+            million_range = million_ranges[i]
+            ds_algo = ds_algos[i]
             try:
-                dns_look.from_json(line)
-                if dns_look.domain in domainsFound:
-                    domainsFound[dns_look.domain] += 1
-                    nb_domains_duplicate += 1
-                    continue
-                else:
-                    domainsFound[dns_look.domain] = 1
-                if dns_look.million_range >= 0 and dns_look.million_range <= 6:
-                    nb_algo = len(dns_look.ds_algo)
+                if million_range >= 0 and million_range <= 6:
+                    nb_algo = len(ds_algo)
                     if nb_algo > 0:
-                        for algo in dns_look.ds_algo:
-                            if not algo in self.tab[dns_look.million_range]:
-                                self.tab[dns_look.million_range][algo] = 0.0
-                            self.tab[dns_look.million_range][algo] += 1.0/nb_algo
-                    self.loaded[dns_look.million_range] += 1
+                        for algo in ds_algo:
+                            if not algo in self.tab[million_range]:
+                                self.tab[million_range][algo] = 0.0
+                            self.tab[million_range][algo] += 1.0/nb_algo
+                    self.loaded[million_range] += 1
                     self.total += 1
                 dns_sec = 0
-                if len(dns_look.ds_algo) > 0:
+                if len(ds_algo) > 0:
                     dns_sec = 1
                 ns_suffixes = set()
-                if dns_look.million_range >= 0 and dns_look.million_range < 5 :
+                if million_range >= 0 and million_range < 5 :
                     weight = 1.0
-                    for ns_name in dns_look.ns:
+                    for ns_name in ns_lists[i]:
                         ns_suffix = zoneparser.extract_server_suffix(ns_name, self.zp.ps, self.zp.dups)
                         if not ns_suffix in ns_suffixes:
                             ns_suffixes.add(ns_suffix)
                     if len(ns_suffixes) == 0:
-                        ns_suffix = zoneparser.extract_server_suffix(dns_look.domain, self.zp.ps, self.zp.dups)
+                        ns_suffix = zoneparser.extract_server_suffix(domain, self.zp.ps, self.zp.dups)
                         ns_suffixes.add(ns_suffix)
                     weight /= len(ns_suffixes)
                     for ns_suffix in ns_suffixes:
-                        self.suffix_stats.load(dns_look.million_range, dns_sec, ns_suffix, weight)
-                    tld = extract_tld(dns_look.domain)
-                    self.tld_stats.load(dns_look.million_range, dns_sec, tld, 1.0)
+                        self.suffix_stats.load(million_range, dns_sec, ns_suffix, weight)
+                    tld = extract_tld(domain)
+                    self.tld_stats.load(million_range, dns_sec, tld, 1.0)
             except Exception as e:
                 traceback.print_exc()
-                print("Cannot parse <" + line  + ">\nException: " + str(e))
+                print("Cannot process <" + domain  + ">\nException: " + str(e))
             if (self.total%5000) == 0:
                 sys.stdout.write(".")
                 sys.stdout.flush()
-        print("\nFound " + str(len(domainsFound)) + " domains, " + str(nb_domains_duplicate) + " duplicates.")
+        print("\nFound " + str(len(first_rows)) + " domains, " + str(nb_domains_duplicate) + " duplicates.")
 
     def save_m11(self, m11_date, m11_csv):
         with open(m11_csv, "wt") as F:
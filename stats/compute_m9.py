@@ -1,12 +1,24 @@
 #
 # Produce the metric M9
 #
+# The metric is computed from the weights of the suffixes, AS and NS AS
+# of the domains in the monthly result file. That file grows every day,
+# so if a state file is provided, the weights are kept in it after each
+# run, see m9_state. The next run only adds the weights of the domains
+# appended to the result file since the previous run, and then writes
+# the M9 metrics from the updated weights. The "full" option recomputes
+# the weights from the whole result file, e.g., for validation.
+#
 
 import sys
+import os
+import json
+import hashlib
 import traceback
 import pubsuffix
 import ip2as
 import dnslook
+import dnslook_store
 import ns_store
 #import random
 import zoneparser
@@ -69,6 +81,20 @@ class key_weights:
                 if len(key_weight) > i:
                     self.weight[key][i] += key_weight[i]*w
 
+    # the weights are saved as a list of pairs, in order to keep the
+    # type of the keys (AS numbers are integers) and the order in which
+    # they were added, which determines the order of equal weights.
+    def to_dict(self):
+        return { "weight": [ [key, self.weight[key]] for key in self.weight ], \
+            "total": self.total, "nb_names": self.nb_names }
+
+    def from_dict(self, kd):
+        self.weight = dict()
+        for key, weights in kd["weight"]:
+            self.weight[key] = weights
+        self.total = kd["total"]
+        self.nb_names = kd["nb_names"]
+
     # add one domain name in million range rng
     def add_names(self, key_set, rng, fixed_weight=False):
         w = [ 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0 ]
@@ -148,18 +174,18 @@ def print_top_key_range_asn(key_list, list_name, asns):
         if nb_top >= 10:
             break;
 
-def millions_to_suffix_weights(millions, ps, dups, fixed_weight):
-    suffix_weights = key_weights()
+def add_suffix_weights(suffix_weights, millions, ps, dups, fixed_weight):
+    ns_names = []
+    for dns_item in millions:
+        ns_names += dns_item.ns
+    server_suffixes = zoneparser.extract_server_suffixes(ns_names, ps, dups)
     for dns_item in millions:
         ns_suffixes = set()
         for ns in dns_item.ns:
-            ns_suffix = zoneparser.extract_server_suffix(ns, ps, dups)
-            ns_suffixes.add(ns_suffix)
+            ns_suffixes.add(server_suffixes[ns])
         suffix_weights.add_names(ns_suffixes, dns_item.million_range, fixed_weight=fixed_weight)
-    return suffix_weights
 
-def millions_to_ns_as_weights(millions, nd, asn_ag, fixed_weight):
-    ns_as_weights = key_weights()
+def add_ns_as_weights(ns_as_weights, millions, nd, asn_ag, fixed_weight):
     for dns_item in millions:
         ns_as_numbers = set()
         for ns in dns_item.ns:
@@ -167,38 +193,184 @@ def millions_to_ns_as_weights(millions, nd, asn_ag, fixed_weight):
                 for asn in nd.d[ns].ases:
                     ns_as_numbers.add(asn_ag.get_asn(asn))
         ns_as_weights.add_names(ns_as_numbers, dns_item.million_range, fixed_weight=fixed_weight)
-    return ns_as_weights
 
-def millions_to_as_weights(millions, asn_ag, fixed_weight):
-    as_weights = key_weights()
+def add_as_weights(as_weights, millions, asn_ag, fixed_weight):
     for dns_item in millions:
         as_numbers = set()
         for asn in dns_item.ases:
             as_numbers.add(asn_ag.get_asn(asn))
         as_weights.add_names(as_numbers, dns_item.million_range, fixed_weight=fixed_weight)
+
+def add_ns_ip_weights(ns_ip4_weight, ns_ip6_weight, millions, nd, fixed_weight):
+    for dns_item in millions:
+        for ns in dns_item.ns:
+            if ns in nd.d:
+                ns_ip4_weight.add_names(nd.d[ns].ip, dns_item.million_range, fixed_weight=fixed_weight)
+                ns_ip6_weight.add_names(nd.d[ns].ipv6, dns_item.million_range, fixed_weight=fixed_weight)
+
+def millions_to_suffix_weights(millions, ps, dups, fixed_weight):
+    suffix_weights = key_weights()
+    add_suffix_weights(suffix_weights, millions, ps, dups, fixed_weight)
+    return suffix_weights
+
+def millions_to_ns_as_weights(millions, nd, asn_ag, fixed_weight):
+    ns_as_weights = key_weights()
+    add_ns_as_weights(ns_as_weights, millions, nd, asn_ag, fixed_weight)
+    return ns_as_weights
+
+def millions_to_as_weights(millions, asn_ag, fixed_weight):
+    as_weights = key_weights()
+    add_as_weights(as_weights, millions, asn_ag, fixed_weight)
     return as_weights
 
-def compute_m9(millions, ps, dups, nd, asn_ag, asns, m9date, fixed_weight, F):
-    suffix_weights = millions_to_suffix_weights(millions, ps, dups, fixed_weight)
+def ns_digest(nd, ns):
+    # Digest of the NS data used in the weights, "" if the NS is not known.
+    if not ns in nd.d:
+        return ""
+    ns_item = nd.d[ns]
+    js = json.dumps([ns_item.ases, ns_item.ip, ns_item.ipv6])
+    return hashlib.sha256(js.encode("utf-8")).hexdigest()[:16]
+
+def config_digest(file_names, fixed_weight):
+    # Digest of the files that determine the suffixes, such as the public
+    # suffix list and the duplicate services.
+    h = hashlib.sha256(str(fixed_weight).encode("utf-8"))
+    for file_name in file_names:
+        with open(file_name, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+# The state of the M9 computation holds the weights accumulated from the
+# first "rows" rows of the column store of the result file (see
+# dnslook_store.py), with the size and tail hash of the JSON data that
+# these rows were read from. The domains are counted once, in the first
+# row where they appear, as in dnslook.load_dns_file. The weights are
+# added in the order of the rows, so updating the state gives exactly the
+# same weights as a full computation.
+#
+# The suffix and AS weights only depend on the rows. The NS AS and NS
+# address weights also depend on the NS list, which find_ns_servers.py
+# updates between runs. The state keeps a digest of the NS data used for
+# each NS name, and if any of them changed these weights are computed
+# again from all the rows.
+class m9_state:
+    def __init__(self, config=""):
+        self.config = config
+        self.clear()
+
+    def clear(self):
+        self.rows = 0
+        self.json_size = 0
+        self.json_hash = ""
+        self.suffix_weights = key_weights()
+        self.as_weights = key_weights()
+        self.clear_ns()
+
+    def clear_ns(self):
+        self.ns_as_weights = key_weights()
+        self.ns_ip4_weight = key_weights()
+        self.ns_ip6_weight = key_weights()
+        self.ns_digests = dict()
+
+    def add_ns_millions(self, millions, nd, asn_ag, fixed_weight):
+        add_ns_as_weights(self.ns_as_weights, millions, nd, asn_ag, fixed_weight)
+        add_ns_ip_weights(self.ns_ip4_weight, self.ns_ip6_weight, millions, nd, fixed_weight)
+        for dns_item in millions:
+            for ns in dns_item.ns:
+                if not ns in self.ns_digests:
+                    self.ns_digests[ns] = ns_digest(nd, ns)
+
+    def add_millions(self, millions, ps, dups, nd, asn_ag, fixed_weight):
+        add_suffix_weights(self.suffix_weights, millions, ps, dups, fixed_weight)
+        add_as_weights(self.as_weights, millions, asn_ag, fixed_weight)
+        self.add_ns_millions(millions, nd, asn_ag, fixed_weight)
+
+    def ns_changed(self, nd):
+        for ns in self.ns_digests:
+            if ns_digest(nd, ns) != self.ns_digests[ns]:
+                return True
+        return False
+
+    def update(self, million_file, ps, dups, nd, asn_ag, fixed_weight, full=False):
+        # Add the rows appended to the result file since the last update,
+        # and return the number of domains added.
+        store = dnslook_store.open_dns_columns(million_file)
+        if full or self.rows > store.nb_rows or self.json_size > store.json_size or \
+            (self.json_size > 0 and dnslook_store.tail_hash(million_file, self.json_size) != self.json_hash):
+            if not full:
+                print("The state does not match " + million_file + ", computing all weights.")
+            self.clear()
+        first_rows = store.first_rows()
+        old_rows = [i for i in first_rows if i < self.rows]
+        new_rows = [i for i in first_rows if i >= self.rows]
+        if self.ns_changed(nd):
+            print("The NS list changed, computing the NS weights of " + str(len(old_rows)) + " domains.")
+            self.clear_ns()
+            self.add_ns_millions(list(store.dnslooks(old_rows)), nd, asn_ag, fixed_weight)
+        self.add_millions(list(store.dnslooks(new_rows)), ps, dups, nd, asn_ag, fixed_weight)
+        self.rows = store.nb_rows
+        self.json_size = store.json_size
+        self.json_hash = store.json_hash
+        return len(new_rows)
+
+    def save(self, file_name):
+        sd = { "config": self.config, "rows": self.rows, "json_size": self.json_size, \
+            "json_hash": self.json_hash, "ns_digests": self.ns_digests }
+        for name in [ "suffix_weights", "as_weights", "ns_as_weights", "ns_ip4_weight", "ns_ip6_weight" ]:
+            sd[name] = getattr(self, name).to_dict()
+        with open(file_name + ".tmp", "wt", encoding="utf-8") as F:
+            json.dump(sd, F)
+        os.replace(file_name + ".tmp", file_name)
+
+    def load(self, file_name):
+        # Returns False if the file cannot be loaded, or was saved with a
+        # different configuration, in which case the state is empty.
+        try:
+            with open(file_name, "rt", encoding="utf-8") as F:
+                sd = json.load(F)
+            if sd["config"] != self.config:
+                print("The configuration changed since " + file_name + " was saved.")
+                return False
+            self.rows = sd["rows"]
+            self.json_size = sd["json_size"]
+            self.json_hash = sd["json_hash"]
+            self.ns_digests = sd["ns_digests"]
+            for name in [ "suffix_weights", "as_weights", "ns_as_weights", "ns_ip4_weight", "ns_ip6_weight" ]:
+                getattr(self, name).from_dict(sd[name])
+        except Exception as e:
+            print("Cannot load M9 state from " + file_name + ", exception: " + str(e))
+            self.clear()
+            return False
+        return True
+
+def write_m9(suffix_weights, as_weights, ns_as_weights, asns, m9date, F):
     suffix_weights.weights_to_m9(m9date, "M9", 1, F)
-    as_weights = millions_to_as_weights(millions, asn_ag, fixed_weight)
     top_as = as_weights.weights_to_m9(m9date, "M9", 13, F, write_metric=False)
-
-    ns_as_weights = millions_to_ns_as_weights(millions, nd, asn_ag, fixed_weight)
     top_as = ns_as_weights.weights_to_m9(m9date, "M9", 7, F, top_as)
     as_weights.weights_to_m9(m9date, "M9", 13, F, top_as)
     for asn in top_as:
         F.write("M9.19.1," + m9date + ",v2.0, " + ip2as.asname.clean(asns.name(asn)) + "," + str(asn) + "\n")
 
+def compute_m9(millions, ps, dups, nd, asn_ag, asns, m9date, fixed_weight, F):
+    suffix_weights = millions_to_suffix_weights(millions, ps, dups, fixed_weight)
+    as_weights = millions_to_as_weights(millions, asn_ag, fixed_weight)
+    ns_as_weights = millions_to_ns_as_weights(millions, nd, asn_ag, fixed_weight)
+    write_m9(suffix_weights, as_weights, ns_as_weights, asns, m9date, F)
+
 def save_m9(millions, ps, dups, nd, asn_ag, asns, m9date, fixed_weight, file_name):
     with open(file_name, "w") as F:
         compute_m9(millions, ps, dups, nd, asn_ag, asns, m9date, fixed_weight, F)
     print("Save M9 metric for " + m9date + " in " + file_name)
 
+def save_m9_state(state, asns, m9date, file_name):
+    with open(file_name, "w") as F:
+        write_m9(state.suffix_weights, state.as_weights, state.ns_as_weights, asns, m9date, F)
+    print("Save M9 metric for " + m9date + " in " + file_name)
+
 # Main
 def main():
-    if len(sys.argv) != 9:
-        print("Usage: " + sys.argv[0] + " publicsuffix.dat dups asn_file million_domain_list million_ns_list m9_metric_file m9_metric_file m9_day ip_file_prefix")
+    if len(sys.argv) < 9 or len(sys.argv) > 11 or (len(sys.argv) == 11 and sys.argv[10] != "full"):
+        print("Usage: " + sys.argv[0] + " publicsuffix.dat dups asn_file million_domain_list million_ns_list m9_metric_file m9_day ip_file_prefix [m9_state_file [full]]")
         exit(-1)
     fixed_weight = False
     public_suffix_file = sys.argv[1]
@@ -209,6 +381,11 @@ def main():
     m9_metric_file = sys.argv[6]
     m9_metric_day = sys.argv[7]
     ip_file_prefix = sys.argv[8]
+    m9_state_file = ""
+    full = True
+    if len(sys.argv) > 9:
+        m9_state_file = sys.argv[9]
+        full = len(sys.argv) == 11
 
     # load public suffixes
     ps = pubsuffix.public_suffix()
@@ -232,31 +409,30 @@ def main():
         exit(-1)
     print("NS list has " + str(len(nd.d)) + " entries, loading dns millions.")
 
-    # Load the million file now.
-    millions = dnslook.load_dns_file(million_file, dot_after=10000)
-    print("\nLoaded " + str(len(millions)) + " domains from million file.")
-    
-    # Prepare the files of IP addresses
-    ns_ip4_weight = key_weights()
-    ns_ip6_weight = key_weights()
-    for dns_item in millions:
-        for ns in dns_item.ns:
-            if ns in nd.d:
-                ns_ip4_weight.add_names(nd.d[ns].ip, dns_item.million_range, fixed_weight=fixed_weight)
-                ns_ip6_weight.add_names(nd.d[ns].ipv6, dns_item.million_range, fixed_weight=fixed_weight)
+    # Load the previous state, and add the domains found in the million file.
+    state = m9_state(config_digest([public_suffix_file, dups_file], fixed_weight))
+    if not full and os.path.isfile(m9_state_file):
+        if state.load(m9_state_file):
+            print("Loaded M9 state for " + str(state.rows) + " rows from " + m9_state_file)
+    nb_added = state.update(million_file, ps, zp.dups, nd, asn_ag, fixed_weight, full=full)
+    print("Added " + str(nb_added) + " domains from million file.")
+    if m9_state_file != "":
+        state.save(m9_state_file)
+        print("Saved M9 state for " + str(state.rows) + " rows in " + m9_state_file)
 
-    print("After loading from NS, NS_IP4 weights has " + str(len(ns_ip4_weight.weight)) + " entries")
-    print("After loading from NS, NS_IP6 weights has " + str(len(ns_ip4_weight.weight)) + " entries")
+    # Prepare the files of IP addresses
+    print("After loading from NS, NS_IP4 weights has " + str(len(state.ns_ip4_weight.weight)) + " entries")
+    print("After loading from NS, NS_IP6 weights has " + str(len(state.ns_ip6_weight.weight)) + " entries")
 
-    top_ns_ip4 = ns_ip4_weight.get_sorted_list(-1)
+    top_ns_ip4 = state.ns_ip4_weight.get_sorted_list(-1)
     print_top_key_range_items(top_ns_ip4, "top_ns_ip4")
     write_key_range_items(top_ns_ip4, ip_file_prefix + "_ip4.csv", "ipv4", "weight")
-    top_ns_ip6 = ns_ip6_weight.get_sorted_list(-1)
+    top_ns_ip6 = state.ns_ip6_weight.get_sorted_list(-1)
     print_top_key_range_items(top_ns_ip6, "top_ns_ip6")
     write_key_range_items(top_ns_ip6, ip_file_prefix + "_ip6.csv", "ipv6", "weight")
 
     # produce M9
-    save_m9(millions, ps, zp.dups, nd, asn_ag, asns, m9_metric_day, fixed_weight, m9_metric_file)
+    save_m9_state(state, asns, m9_metric_day, m9_metric_file)
 
 # actual main program, can be called by threads, etc.
 if __name__ == '__main__':
@@ -0,0 +1,158 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Unit test of the incremental computation of M9.
+#
+# The lines of a JSON result file are copied in a temporary file in two
+# steps, as do_dnslookup would append them, and an NS list is created for
+# most of the NS names found in these lines. After each step, the M9 state
+# is loaded, updated and saved, and the metrics written from the state
+# must be exactly the same as the metrics computed from all the domains
+# in the file by compute_m9.save_m9. The same is checked after changing
+# the NS list, which requires computing the NS weights again.
+#
+# Expect this test to work:
+#
+# py .\compute_m9_test.py ..\data\public_suffix_list.dat ..\data\service-duplicates.csv ..\data\asnames.txt ..\data\dnslook_test.json ..\tmp\
+
+import sys
+import os
+import shutil
+import pubsuffix
+import ip2as
+import dnslook
+import dnslook_store
+import ns_store
+import zoneparser
+import compute_m9
+
+def make_ns_dict(lines, nb_skip):
+    # Create NS entries with made up addresses and AS numbers, except for
+    # one in "nb_skip" names.
+    nd = ns_store.ns_dict()
+    nb = 0
+    for d in dnslook.decode_lines(lines):
+        for ns in d.ns:
+            if not ns in nd.d:
+                nb += 1
+                if nb%nb_skip == 0:
+                    continue
+                nd.add_ns_name(ns)
+                ns_item = nd.d[ns]
+                ns_item.ases = [str(16509 + nb%7), str(13335 + nb%3)]
+                ns_item.ip = ["10.0." + str(nb%5) + "." + str(nb%11)]
+                ns_item.ipv6 = ["2001:db8::" + str(nb%13)]
+                ns_item.nb_queries = 1
+    return nd
+
+def ip_lines(state):
+    ips = []
+    for w in [ state.ns_ip4_weight, state.ns_ip6_weight ]:
+        for kri in w.get_sorted_list(-1):
+            ips.append(str(kri.key) + "," + str(kri.weight))
+    return ips
+
+def reference_ip_lines(millions, nd):
+    ns_ip4_weight = compute_m9.key_weights()
+    ns_ip6_weight = compute_m9.key_weights()
+    for dns_item in millions:
+        for ns in dns_item.ns:
+            if ns in nd.d:
+                ns_ip4_weight.add_names(nd.d[ns].ip, dns_item.million_range)
+                ns_ip6_weight.add_names(nd.d[ns].ipv6, dns_item.million_range)
+    ips = []
+    for w in [ ns_ip4_weight, ns_ip6_weight ]:
+        for kri in w.get_sorted_list(-1):
+            ips.append(str(kri.key) + "," + str(kri.weight))
+    return ips
+
+def check_m9(label, tmp_json, state_file, ns_file, expected_added):
+    ret = True
+    nd = ns_store.ns_dict()
+    nd.load_ns_file(ns_file)
+    state = compute_m9.m9_state(config)
+    state.load(state_file)
+    nb_added = state.update(tmp_json, ps, zp.dups, nd, asn_ag, False)
+    state.save(state_file)
+    if nb_added != expected_added:
+        print(label + ": added " + str(nb_added) + " domains instead of " + str(expected_added))
+        ret = False
+    m9_state_file = os.path.join(tmp_dir, "compute_m9_test_state.csv")
+    compute_m9.save_m9_state(state, asns, "2024-01-31", m9_state_file)
+    m9_ref_file = os.path.join(tmp_dir, "compute_m9_test_ref.csv")
+    millions = dnslook.load_dns_json(tmp_json, dot_after=0)
+    compute_m9.save_m9(millions, ps, zp.dups, nd, asn_ag, asns, "2024-01-31", False, m9_ref_file)
+    m9_state = open(m9_state_file, "rt").read()
+    m9_ref = open(m9_ref_file, "rt").read()
+    if m9_state != m9_ref or len(m9_ref) == 0:
+        print(label + ": M9 from the state differs from the reference.")
+        ret = False
+    elif ip_lines(state) != reference_ip_lines(millions, nd):
+        print(label + ": NS addresses from the state differ from the reference.")
+        ret = False
+    else:
+        print(label + ": " + str(len(m9_ref.split("\n"))) + " M9 lines match.")
+    return ret
+
+# main program
+
+if len(sys.argv) != 6:
+    print("Usage: " + sys.argv[0] + " public_suffix_file dups_file asn_file dns_json tmp_dir")
+    exit(1)
+tmp_dir = sys.argv[5]
+ps = pubsuffix.public_suffix()
+if not ps.load_file(sys.argv[1]):
+    print("Could not load the public suffixes")
+    exit(1)
+zp = zoneparser.zone_parser2(ps)
+zp.load_dups(sys.argv[2])
+asns = ip2as.asname()
+if not asns.load(sys.argv[3]):
+    exit(1)
+asn_ag = ip2as.aggregated_asn()
+config = compute_m9.config_digest([sys.argv[1], sys.argv[2]], False)
+
+tmp_json = os.path.join(tmp_dir, "compute_m9_test.json")
+state_file = os.path.join(tmp_dir, "compute_m9_test_state.json")
+ns_file = os.path.join(tmp_dir, "compute_m9_test_ns.json")
+if os.path.isdir(tmp_json + dnslook_store.COLUMN_SUFFIX):
+    shutil.rmtree(tmp_json + dnslook_store.COLUMN_SUFFIX)
+for file_name in [ tmp_json, state_file ]:
+    if os.path.isfile(file_name):
+        os.remove(file_name)
+
+lines = [line for line in open(sys.argv[4], "rt", encoding="utf-8")]
+nd = make_ns_dict(lines, 5)
+nd.save_ns_file(ns_file)
+
+ret = True
+written = 0
+domains = set()
+for step in [ len(lines)//2, len(lines) ]:
+    with open(tmp_json, "at", encoding="utf-8") as f:
+        for line in lines[written:step]:
+            f.write(line)
+    nb_new = 0
+    for d in dnslook.decode_lines(lines[written:step]):
+        if not d.domain in domains:
+            domains.add(d.domain)
+            nb_new += 1
+    written = step
+    ret &= check_m9("step " + str(step), tmp_json, state_file, ns_file, nb_new)
+
+# Change the NS list: the NS weights must be computed again.
+nd = make_ns_dict(lines, 7)
+nd.save_ns_file(ns_file)
+ret &= check_m9("new NS list", tmp_json, state_file, ns_file, 0)
+
+# Replace the result file by a shorter one, the state must be reset.
+with open(tmp_json, "wt", encoding="utf-8") as f:
+    for line in lines[-5:]:
+        f.write(line)
+nb_new = len(set(d.domain for d in dnslook.decode_lines(lines[-5:])))
+ret &= check_m9("new result file", tmp_json, state_file, ns_file, nb_new)
+
+if not ret:
+    exit(1)
+else:
+    exit(0)
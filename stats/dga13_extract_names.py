@@ -12,6 +12,7 @@ import traceback
 import nameparse
 import ipaddress
 import gzip
+import io
 import sys
 import time
 import os
@@ -27,6 +28,7 @@ class dga13_bucket:
     def __init__(self):
         self.bucket_id = 0
         self.input_files = []
+        self.input_chunk = None
         self.dga_subnets = dict()
         self.suffix_file_name = ""
         self.p0_count_file_name = ""
@@ -81,6 +83,10 @@ class dga13_bucket:
             print("Giving up");
             exit(1) 
 
+    def load_logchunk(self, chunk):
+        for line in io.TextIOWrapper(io.BytesIO(chunk)):
+            self.load_logline(line)
+
     def load_logfile(self, logfile):
         if logfile.endswith(".gz"):
             self.load_logfile_gz(logfile)
@@ -89,8 +95,11 @@ class dga13_bucket:
 
     def load(self):
         try:
-            for input_file in self.input_files:
-                self.load_logfile(input_file)
+            if self.input_chunk is not None:
+                self.load_logchunk(self.input_chunk)
+            else:
+                for input_file in self.input_files:
+                    self.load_logfile(input_file)
         except:
             traceback.print_exc()
             print("Abandon bucket " + str(self.bucket_id))
@@ -148,6 +157,12 @@ class dga13_bucket:
             print("For file <" + suffix_file_name  + ">\nException: " + str(e))
             exit(1)
 
+    def import_bucket(self, bucket):
+        self.import_list(bucket.suffix_file_name)
+        self.import_p0_count(bucket.p0_count_file_name)
+        # the chunk was only needed by the worker
+        bucket.input_chunk = None
+
 def usage(argv0):
     print("Usage: " + argv0 + " suffix_file_name tmp_prefix dga_subnet_file name_files*")
     exit(1)
@@ -176,32 +191,24 @@ def main():
         nb_process = os.cpu_count()
     print("Aiming for " + str(nb_process) + " processes")
 
-    # prepare a set of buckets for as many processes.
-    bucket_list = parallel_buckets.init_buckets(dga13_bucket, nb_process, files, params)
-
-    print("Will use " + str(len(bucket_list)) + " buckets")
-    
+    # prepare a set of buckets, several per process, cutting large files
+    # in chunks. The buckets are created as the workers need them.
     start_time = time.time()
-    if len(bucket_list) > 1:
-        parallel_buckets.run_buckets(bucket_list)
-        bucket_time = time.time()
-        print("\nThreads took " + str(bucket_time - start_time))
+    if nb_process > 1:
         summary = dga13_bucket()
         summary.dga_subnets = dga_subnets
         summary.suffix_file_name = suffix_file_name
         summary.p0_count_file_name = p0_count_file_name
-        for bucket in bucket_list:
-            summary.import_list(bucket.suffix_file_name)
-            summary.import_p0_count(bucket.p0_count_file_name)
-            sys.stdout.write(".")
-            sys.stdout.flush()
+        bucket_list = parallel_buckets.init_chunk_tasks(dga13_bucket, nb_process, files, params)
+        completed = parallel_buckets.run_tasks(bucket_list, nb_process, merge=summary.import_bucket)
         summary_time = time.time()
-        print("\nSummary took " + str(summary_time - bucket_time))
+        print("\nThreads and summary took " + str(summary_time - start_time))
         summary.save()
         save_time = time.time()
-        print("Loaded " + str(len(bucket_list)) + " buckets into " + suffix_file_name)
+        print("Loaded " + str(len(completed)) + " buckets into " + suffix_file_name)
         print("\nSave took " + str(save_time - summary_time))
     else:
+        bucket_list = parallel_buckets.init_buckets(dga13_bucket, nb_process, files, params)
         bucket_list[0].suffix_file_name = suffix_file_name
         bucket_list[0].p0_count_file_name = p0_count_file_name
         bucket_list[0].load()
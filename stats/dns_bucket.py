@@ -3,7 +3,9 @@
 #
 
 import dnslook
-import concurrent.futures
+import dnslook_async
+import zonecut_cache
+import parallel_buckets
 import time
 import os
 import sys
@@ -20,7 +22,7 @@ def load_name(d, ps, i2a, i2a6, stats):
     return success, d
 
 class dns_lookup_bucket:
-    def __init__(self, bucket_id,bucket_file_name, stats_file_name, targets, ps, i2a, i2a6):
+    def __init__(self, bucket_id,bucket_file_name, stats_file_name, targets, ps, i2a, i2a6, zone_cache=None):
         self.bucket_id = bucket_id
         # self.item_dict = item_dict
         self.targets = targets
@@ -28,14 +30,17 @@ class dns_lookup_bucket:
         self.ps = ps
         self.i2a = i2a
         self.i2a6 = i2a6
-        self.stats = [ 0, 0, 0, 0, 0, 0, 0 ]
+        # stats[7] and stats[8] count the hits and lookups in the zone cut cache.
+        self.stats = [ 0, 0, 0, 0, 0, 0, 0, 0, 0 ]
         self.stats_file_name = stats_file_name
+        self.zone_cache = zone_cache
         self.is_complete = False
 
     def load(self):
+        engine = dnslook_async.dnslook_engine(zone_cache=self.zone_cache)
+        results = engine.get_domains_data(self.targets, self.ps, self.i2a, self.i2a6, self.stats, retry=True)
         with open(self.bucket_file_name, "wt") as f_out:
-            for target in self.targets:
-                success, d = load_name(target, self.ps, self.i2a, self.i2a6, self.stats)
+            for success, d in results:
                 if success:
                     # Write the json line in the result file.
                     f_out.write(d.to_json() + "\n")
@@ -70,12 +75,13 @@ class bucket_list:
     def __init__(self, item_dict, targets, ps, i2a, i2a6, temp_prefix, temp_suffix, stats_suffix):
         self.item_dict = item_dict
         self.target_count_per_bucket = []
+        self.target_lists = []
         self.targets = targets
         self.temp_prefix = temp_prefix
         self.temp_suffix = temp_suffix
         self.stats_suffix = stats_suffix
         self.bucket_list = []
-        self.stats = [ 0, 0, 0, 0, 0, 0, 0 ]
+        self.stats = [ 0, 0, 0, 0, 0, 0, 0, 0, 0 ]
         self.ps = ps
         self.i2a = i2a
         self.i2a6 = i2a6
@@ -83,55 +89,35 @@ class bucket_list:
 
     def prepare_target_list(self):
         self.nb_process = os.cpu_count()
-        targets_left = len(self.targets)
-        # split the target with units per processor
-        for bucket_id in range(0,self.nb_process):
-            buckets_left = self.nb_process - bucket_id
-            if buckets_left == 1:
-                nb_this_bucket = targets_left
-            else:
-                nb_this_bucket = int(targets_left/buckets_left)
-                if nb_this_bucket == 0:
-                    nb_this_bucket = 1
-            self.target_count_per_bucket.append(nb_this_bucket)
-            targets_left -= nb_this_bucket
-            if targets_left <= 0:
-                break
+        # split the targets in several batches per processor, each large
+        # enough to keep the queries of the lookup engine in flight.
+        nb_tasks = parallel_buckets.nb_tasks_for(len(self.targets), self.nb_process, min_items_per_task=500)
+        self.target_lists = parallel_buckets.split_list(self.targets, nb_tasks)
+        self.target_count_per_bucket = [len(x) for x in self.target_lists]
         print("Prepared: " + str(len(self.target_count_per_bucket)) + " target lists.")
 
     def prepare_buckets(self):
+        # The zone cut cache is shared by the buckets through an SQLite file.
+        self.zone_cache = zonecut_cache.zone_cut_cache(self.temp_prefix + "_zone_cache.db")
         self.bucket_list = []
-        last_target = 0
-        old_target = 0;
-        for bucket_id in range(0,len(self.target_count_per_bucket)):
+        for bucket_id in range(0,len(self.target_lists)):
             temp_name = self.temp_prefix + str(bucket_id) + self.temp_suffix
             temp_stats =  self.temp_prefix + str(bucket_id) + self.stats_suffix
-            old_target = last_target
-            last_target += self.target_count_per_bucket[bucket_id]
-            bucket_target = self.targets[old_target:last_target]
-            this_bucket = dns_lookup_bucket(bucket_id, temp_name, temp_stats, bucket_target, self.ps, self.i2a, self.i2a6)
+            this_bucket = dns_lookup_bucket(bucket_id, temp_name, temp_stats, self.target_lists[bucket_id], self.ps, self.i2a, self.i2a6, zone_cache=self.zone_cache)
             self.bucket_list.append(this_bucket)
         print("Prepared: " + str(len(self.bucket_list)) + " buckets.")
 
-    def run_buckets(self):
-        with concurrent.futures.ProcessPoolExecutor(max_workers = self.nb_process) as executor:
-            future_to_bucket = { executor.submit(load_dns_look_up_bucket, bucket):bucket for bucket in self.bucket_list }
-        for future in concurrent.futures.as_completed(future_to_bucket):
-            bucket = future_to_bucket[future]
-            try:
-                data = future.result()
-                bucket.is_complete = True
-                sys.stdout.write(".")
-                sys.stdout.flush()
-            except Exception as exc:
-                traceback.print_exc()
-                print("\nBucket " + str(bucket.bucket_id) + " generated an exception: " + str(exc))
+    def merge_bucket(self, bucket):
+        bucket.is_complete = True
+        bucket.aggregate(self.stats, self.item_dict)
 
-    def aggregate(self):
-        for bucket in self.bucket_list:
-            if not bucket.is_complete:
-                continue
-            bucket.aggregate(self.stats, self.item_dict)
+    def run_buckets(self):
+        # The results of each bucket are aggregated as soon as it completes.
+        parallel_buckets.run_tasks(self.bucket_list, self.nb_process, merge=self.merge_bucket, \
+            run=load_dns_look_up_bucket)
+        # The zone cut cache is only shared during the run.
+        self.zone_cache.close()
+        zonecut_cache.remove_db_files(self.zone_cache.file_name)
 
     def run(self):
         start_time = time.time()
@@ -150,10 +136,8 @@ class bucket_list:
             ready_time = time.time()
             self.prepare_buckets()
             self.run_buckets()
-            bucket_time = time.time()
-            self.aggregate()
             done_time = time.time()
-            print("\nSummary took " + str(done_time - bucket_time))
+            print("\nThreads and summary took " + str(done_time - ready_time))
         nb_assessed = len(self.targets)
         print("Assessed " + str(len(self.targets)) + " targets in " + str(done_time - start_time))  
         stat_name = ["a", "aaaa", "ns", "algo", "cname", "server", "asn"]
@@ -162,6 +146,8 @@ class bucket_list:
         for x in range(0,7):
             if len(self.stats) > x:
                 print("Time " + stat_name[x] + ": " + str(self.stats[x]/nb_assessed))
+        if self.stats[8] > 0:
+            print("Zone cache: " + str(int(self.stats[7])) + " hits in " + str(int(self.stats[8])) + " lookups, " + str(self.stats[7]/self.stats[8]))
 
         
  
@@ -20,26 +20,29 @@
 # to_json(self): serialize the object as a JSON string.
 #
 # from_json(self, js): load the object value from a JSON string. 
+#
+# The NS and DS queries used to find the zone of the domain go through the
+# zone cut cache "zone_cache" if one is set, see zonecut_cache.py.
 
 import sys
+import re
 import dns.resolver
 import json
 import traceback
 import time
+import zonecut_cache
+import dnslook_store
+
+# Characters removed by sanitize. Tabs are kept, and replaced by '_'.
+UNSAFE_CHARS = re.compile(r"[^a-zA-Z0-9:.\-_\t]")
 
 def sanitize(object_may_be_string):
+    # Keep ASCII letters, digits, ':', '.', '-' and '_', replace tabs by
+    # '_' and remove everything else.
     unsafe_str = str(object_may_be_string)
-    safe_str = '' 
-    for char in unsafe_str: 
-        cp = ord(char) 
-        if (cp >= ord('a') and cp <= ord('z')) or \
-           (cp >= ord('0') and cp <= ord('9')) or \
-           (cp >= ord('A') and cp <= ord('Z')) or \
-           cp == ord(':') or cp == ord('.') or \
-           cp == ord('-') or cp == ord('_') : 
-            safe_str += char 
-        elif cp == 9: 
-            safe_str += '_'
+    safe_str = UNSAFE_CHARS.sub("", unsafe_str)
+    if "\t" in safe_str:
+        safe_str = safe_str.replace("\t", "_")
     return safe_str
 
 class dnslook:
@@ -53,97 +56,39 @@ class dnslook:
         self.server = ""
         self.ds_algo = []
         self.ases = []
-        self.resolver=dns.resolver.Resolver()
-        self.resolver.timeout = 1
-        self.resolver.lifetime = 3
+        self._resolver = None
         self.million_rank = -1
         self.million_range = -1
         self.dns_not_found = 0
         self.dns_timeout = 0
         self.zone_dns_error = 0
         self.nb_queries = 0
+        self.zone_cache = None
+
+    @property
+    def resolver(self):
+        # The resolver is only created if queries are made, so that
+        # the objects loaded from files are cheap to create.
+        if self._resolver is None:
+            self._resolver = dns.resolver.Resolver()
+            self._resolver.timeout = 1
+            self._resolver.lifetime = 3
+        return self._resolver
+
+    @resolver.setter
+    def resolver(self, resolver):
+        self._resolver = resolver
 
     def to_json_array(x):
-        jsa = "["
-        is_first = True
-        for item in x:
-            if not is_first:
-                jsa += ","
-            is_first = False
-            jsa += "\"" + sanitize(item) + "\""
-        jsa += "]"
-        return(jsa)
+        return "[" + ",".join(["\"" + sanitize(item) + "\"" for item in x]) + "]"
 
     def to_json(self):
-        js = "{\"domain\":\"" + self.domain + "\""
-        if len(self.ip) > 0:
-            js += ",\"ip\":" + dnslook.to_json_array(self.ip)
-        if len(self.ipv6) > 0:
-            # TODO: bug -- "sanitize" will remove the colons!
-            js += ",\"ipv6\":" + dnslook.to_json_array(self.ipv6)
-        js += ",\"zone\":\"" + self.zone + "\""
-        if len(self.ns) > 0:
-            js += ",\"ns\":" + dnslook.to_json_array(self.ns)
-        js += ",\"ds_algo\":" + dnslook.to_json_array(self.ds_algo)
-        if len(self.cname) > 0:
-            js += ",\"cname\":" + dnslook.to_json_array(self.cname)
-        js += ",\"server\":\"" + self.server + "\""
-        if self.million_rank >= 0:
-            js += ",\"rank\":" + str(self.million_rank)
-        if self.million_range >= 0:
-            js += ",\"range\":" + str(self.million_range)
-        if len(self.ases) > 0:
-            js += ",\"ases\":" + dnslook.to_json_array(self.ases)
-        if self.dns_not_found != 0:
-            js += ",\"dns_not_found\":" + str(self.dns_not_found)
-        if self.dns_timeout != 0:
-            js += ",\"dns_timeout\":" + str(self.dns_timeout)
-        if self.nb_queries != 0:
-            js += ",\"nb_queries\":" + str(self.nb_queries)
-        js += "}"
-        return(js)
+        return encode_dnslook(self)
     
     def from_json(self, js):
-        ret = True
-        try:
-            jd = json.loads(js)
-            if not 'domain' in jd:
-                ret = False
-            else:
-                self.__init__()
-                self.domain = jd['domain']
-                if 'ip' in jd:
-                    self.ip = jd['ip']
-                if 'ipv6' in jd:
-                    self.ipv6 = jd['ipv6']
-                if 'zone' in jd:
-                    self.zone = jd['zone']
-                if 'ns' in jd:
-                    self.ns = jd['ns']
-                if 'cname' in jd:
-                    self.cname = jd['cname']
-                if 'server' in jd:
-                    self.server = jd['server']
-                if 'ases' in jd:
-                    self.ases = jd['ases']
-                if 'ds_algo' in jd:
-                    self.ds_algo = jd['ds_algo']
-                if 'rank' in jd:
-                    self.million_rank = jd['rank']
-                if 'range' in jd:
-                    self.million_range = jd['range']
-                if 'dns_not_found' in jd:
-                    self.dns_not_found = jd['dns_not_found']
-                if 'dns_timeout' in jd:
-                    self.dns_timeout = jd['dns_timeout']
-                if 'nb_queries' in jd:
-                    self.nb_queries = jd['nb_queries']
-
-        except Exception as e:
-            traceback.print_exc()
-            print("Cannot parse <" + js + ">")
-            print("error: " + str(e));
-            ret = False
+        ret = decode_dnslook(js, self) is not None
+        if not ret:
+            print("Cannot parse <" + js.strip() + ">")
         return(ret)
 
     def protected_dns_query(self, record_type):
@@ -175,6 +120,32 @@ class dnslook:
             for ipval in addresses:
                 self.ipv6.append(ipval.to_text())
 
+    def zone_query(self, zone, record_type):
+        # Query the NS or DS records of a zone, through the zone cut cache
+        # if there is one. Returns the status and the list of values, as
+        # defined in zonecut_cache. Timeouts are raised, not cached.
+        if self.zone_cache is not None:
+            cached = self.zone_cache.get(zone, record_type)
+            if cached is not None:
+                return cached
+        ttl = None
+        try:
+            answer = self.resolver.query(zone, record_type)
+            values = [x.to_text() for x in answer]
+            status = zonecut_cache.ANSWER
+            ttl = zonecut_cache.answer_ttl(answer)
+        except dns.resolver.NoAnswer as e:
+            status, values = zonecut_cache.NO_ANSWER, []
+            ttl = zonecut_cache.negative_ttl(e)
+        except dns.exception.Timeout:
+            raise
+        except Exception as e:
+            status, values = zonecut_cache.ERROR, []
+            ttl = zonecut_cache.negative_ttl(e)
+        if self.zone_cache is not None:
+            self.zone_cache.put(zone, record_type, status, values, ttl)
+        return status, values
+
     def get_ns(self):
         self.ns = []
         nameparts = self.domain.split(".")
@@ -184,16 +155,17 @@ class dnslook:
                 self.zone += p
                 self.zone += '.'
             try:
-                nameservers = self.resolver.query(self.zone, 'NS')
-                for nsval in nameservers:
-                    self.ns.append(sanitize(nsval.to_text()))
-                break
-            except dns.resolver.NoAnswer:
-                break
+                status, nameservers = self.zone_query(self.zone, 'NS')
             except dns.exception.Timeout:
                 self.dns_timeout += 1
                 break
-            except Exception as e:
+            if status == zonecut_cache.ANSWER:
+                for nsval in nameservers:
+                    self.ns.append(sanitize(nsval))
+                break
+            elif status == zonecut_cache.NO_ANSWER:
+                break
+            else:
                 nameparts.pop(0)
 
     def get_ds_algo(self):
@@ -201,17 +173,17 @@ class dnslook:
             # we assume that "get_ds_algo" is called after "get_ns", so
             # we use the same zone definition.
             try:
-                ds_recv =  self.resolver.query(self.zone, 'DS')
-                for ds in ds_recv:
-                    ds_parts = str(ds).split(" ")
-                    if len(ds_parts) > 2:
-                        self.ds_algo.append(ds_parts[1])
-                    else:
-                        print("Malformed DS for " + self.zone + ": " + str(ds))
-            except dns.resolver.NoAnswer:
-                pass
-            except Exception as e:
+                status, ds_recv = self.zone_query(self.zone, 'DS')
+            except dns.exception.Timeout:
+                status, ds_recv = zonecut_cache.ERROR, []
+            if status == zonecut_cache.ERROR:
                 self.zone_dns_error += 1
+            for ds in ds_recv:
+                ds_parts = ds.split(" ")
+                if len(ds_parts) > 2:
+                    self.ds_algo.append(ds_parts[1])
+                else:
+                    print("Malformed DS for " + self.zone + ": " + ds)
 
     def get_cname(self):
         self.cname = []
@@ -244,7 +216,7 @@ class dnslook:
 
     def get_asn(self, i2a, i2a6):
         as_list = set()
-        if len(i2a.table) > 0 and len(i2a6.table) > 0:
+        if i2a.nb_ranges() > 0 and i2a6.nb_ranges() > 0:
             for ipv4 in self.ip:
                 as_number = i2a.get_as_number(ipv4)
                 as_list.add(as_number)
@@ -257,6 +229,19 @@ class dnslook:
         else:
             print("I2A or I2A6 table is empty")
 
+    def cache_counters(self):
+        if self.zone_cache is None:
+            return 0, 0
+        return self.zone_cache.hits, self.zone_cache.lookups
+
+    def add_cache_stats(self, stats, cache_state):
+        # If the stats have room for them, stats[7] and stats[8] count the
+        # hits and the lookups in the zone cut cache.
+        if len(stats) > 8:
+            hits, lookups = self.cache_counters()
+            stats[7] += hits - cache_state[0]
+            stats[8] += lookups - cache_state[1]
+
     def get_domain_data(self, domain, ps, i2a, i2a6, stats, rank=-1, rng=-1):
         self.domain = domain
         if rank >= 0:
@@ -264,6 +249,7 @@ class dnslook:
         if rng >= 0:
             self.million_range = rng
         self.dns_timeout = 0
+        cache_state = self.cache_counters()
         start_time = time.time()
         self.get_a()
         a_time = time.time()
@@ -286,11 +272,13 @@ class dnslook:
         stats[4] += cname_time - ds_algo_time
         stats[5] += server_time - cname_time
         stats[6] += asn_time - server_time
+        self.add_cache_stats(stats, cache_state)
         self.nb_queries += 1
 
     def retry_domain_data(self, ps, i2a, i2a6, stats):
         need_new_as = False
         self.dns_timeout = 0
+        cache_state = self.cache_counters()
         start_time = time.time()
         if len(self.ip) == 0:
             self.get_a()  
@@ -324,27 +312,134 @@ class dnslook:
         stats[4] += cname_time - ds_algo_time
         stats[5] += server_time - cname_time
         stats[6] += asn_time - server_time
+        self.add_cache_stats(stats, cache_state)
         self.nb_queries += 1
 
+# Encoder and decoder specialized for the dnslook records.
+#
+# The encoder produces the same bytes as the original "to_json", which
+# concatenated the fields in a fixed order, with the names and the values
+# of lists sanitized but the domain, zone and server copied as is. It
+# joins a list of parts instead of concatenating strings.
+#
+# The decoder uses json.loads, which is implemented in C and was faster
+# than a specialized parser written in python, and copies the known
+# fields to a dnslook object. Most of the cost of the original from_json
+# was in fact the creation of a DNS resolver for each object, which is
+# now only created if queries are made. Lines that cannot be parsed, or
+# that have no "domain" field, are rejected without printing a trace.
+#
+# The function extract_domain gets the domain of a record without parsing
+# the whole line, for the scripts that only check which domains are
+# present in a result file.
+
+def encode_dnslook(d):
+    js = [ "{\"domain\":\"", d.domain, "\"" ]
+    if len(d.ip) > 0:
+        js += [ ",\"ip\":", dnslook.to_json_array(d.ip) ]
+    if len(d.ipv6) > 0:
+        # TODO: bug -- "sanitize" will remove the colons!
+        js += [ ",\"ipv6\":", dnslook.to_json_array(d.ipv6) ]
+    js += [ ",\"zone\":\"", d.zone, "\"" ]
+    if len(d.ns) > 0:
+        js += [ ",\"ns\":", dnslook.to_json_array(d.ns) ]
+    js += [ ",\"ds_algo\":", dnslook.to_json_array(d.ds_algo) ]
+    if len(d.cname) > 0:
+        js += [ ",\"cname\":", dnslook.to_json_array(d.cname) ]
+    js += [ ",\"server\":\"", d.server, "\"" ]
+    if d.million_rank >= 0:
+        js += [ ",\"rank\":", str(d.million_rank) ]
+    if d.million_range >= 0:
+        js += [ ",\"range\":", str(d.million_range) ]
+    if len(d.ases) > 0:
+        js += [ ",\"ases\":", dnslook.to_json_array(d.ases) ]
+    if d.dns_not_found != 0:
+        js += [ ",\"dns_not_found\":", str(d.dns_not_found) ]
+    if d.dns_timeout != 0:
+        js += [ ",\"dns_timeout\":", str(d.dns_timeout) ]
+    if d.nb_queries != 0:
+        js += [ ",\"nb_queries\":", str(d.nb_queries) ]
+    js.append("}")
+    return "".join(js)
+
+# Fields of the JSON records, and the corresponding dnslook attributes.
+JSON_ATTRIBUTES = { "domain": "domain", "ip": "ip", "ipv6": "ipv6", "zone": "zone", "ns": "ns", \
+    "cname": "cname", "server": "server", "ases": "ases", "ds_algo": "ds_algo", "rank": "million_rank", \
+    "range": "million_range", "dns_not_found": "dns_not_found", "dns_timeout": "dns_timeout", \
+    "nb_queries": "nb_queries" }
+
+def decode_dnslook(js, d=None):
+    # Load the record in "d", or in a new dnslook object. Returns the
+    # object, or None if the line cannot be parsed.
+    try:
+        jd = json.loads(js)
+    except ValueError:
+        return None
+    if not isinstance(jd, dict) or not 'domain' in jd:
+        return None
+    if d is None:
+        d = dnslook()
+    else:
+        d.__init__()
+    for key, value in jd.items():
+        attribute = JSON_ATTRIBUTES.get(key)
+        if attribute is not None:
+            setattr(d, attribute, value)
+    return d
+
+def decode_lines(lines):
+    # Generator of the dnslook objects for the lines that can be parsed.
+    # Empty and malformed lines are skipped.
+    for line in lines:
+        d = decode_dnslook(line)
+        if d is not None:
+            yield d
+
+def extract_domain(js):
+    # Return the domain of a record without parsing the whole line, or
+    # None if the line cannot be parsed. The encoder writes the domain
+    # first: lines that start with the domain and end with a closing
+    # brace are trusted, which rejects lines truncated by an interrupted
+    # write. Other lines use the full decoder.
+    if js.startswith("{\"domain\":\"") and js.rstrip().endswith("}"):
+        end = js.find("\"", 11)
+        if end > 0 and js.find("\\", 11, end) < 0:
+            return js[11:end]
+    d = decode_dnslook(js)
+    if d is None:
+        return None
+    return d.domain
+
 def load_dns_file(dns_json, dot_after=10000):
+    # The objects are materialized from the columnar store, which is
+    # created or updated next to the JSON file, see dnslook_store.py.
+    # If the store cannot be written, the JSON file is parsed.
+    try:
+        store = dnslook_store.open_dns_columns(dns_json)
+    except OSError as e:
+        print("Cannot use the column store of <" + dns_json + ">\nException: " + str(e))
+        return load_dns_json(dns_json, dot_after=dot_after)
     stats = []
     loaded = 0
-    domainsFound = dict()
-    nb_domains_duplicate = 0
-    for line in open(dns_json, "rt"):
-        dns_look = dnslook()
-        try:
-            dns_look.from_json(line)
-            if dns_look.domain in domainsFound:
-                domainsFound[dns_look.domain] += 1
-                nb_domains_duplicate += 1
-            else:
-                domainsFound[dns_look.domain] = 1
-                stats.append(dns_look)
-            loaded += 1
-        except Exception as e:
-            traceback.print_exc()
-            print("Cannot parse <" + line  + ">\nException: " + str(e))
+    for dns_look in store.dnslooks(store.first_rows()):
+        stats.append(dns_look)
+        loaded += 1
+        if dot_after > 0 and loaded%dot_after == 0:
+            sys.stdout.write(".")
+            sys.stdout.flush()
+    if dot_after > 0 and loaded%dot_after == 0:
+        print(".")
+    return stats
+
+def load_dns_json(dns_json, dot_after=10000):
+    stats = []
+    loaded = 0
+    domainsFound = set()
+    for dns_look in decode_lines(open(dns_json, "rt")):
+        if not dns_look.domain in domainsFound:
+            domainsFound.add(dns_look.domain)
+            stats.append(dns_look)
+        loaded += 1
         if dot_after > 0 and loaded%dot_after == 0:
             sys.stdout.write(".")
             sys.stdout.flush()
@@ -0,0 +1,259 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Asynchronous version of the dnslook queries.
+#
+# The method dnslook.get_domain_data runs the A, AAAA, NS, DS and CNAME
+# queries of a domain in sequence, and the lookup scripts get concurrency
+# by running one process per core. The lookups are bound by the network
+# latency, not by the CPU, so most of the time is spent waiting. The
+# class "dnslook_engine" runs the same queries with dns.asyncresolver,
+# with up to "max_in_flight" queries outstanding at any time in a single
+# process. For each domain, the A, AAAA and CNAME queries and the search
+# of the zone run in parallel, and the DS query is sent once the zone is
+# known. The queries, the handling of errors and the resulting dnslook
+# objects are the same as in the blocking version, so the JSON records
+# do not change.
+#
+# The "stats" are the same 7 timers as in dnslook.get_domain_data: a,
+# aaaa, ns, algo, cname, server and asn. Since the queries run in
+# parallel, each timer measures the duration of its own phase, including
+# the time spent waiting for a query slot, and the sum of the timers
+# exceeds the elapsed time.
+#
+# Usage:
+#
+#    engine = dnslook_async.dnslook_engine(max_in_flight=500)
+#    results = engine.get_domains_data(targets, ps, i2a, i2a6, stats)
+#
+# where "targets" is a list of dnslook objects with the domain, rank and
+# range set, and results is the list of pairs (success, dnslook) in the
+# order in which the lookups completed. If a zonecut_cache.zone_cut_cache
+# is passed as "zone_cache", it is used for the NS and DS queries, and if
+# "stats" has 9 entries the cache hits and lookups are added to the last
+# two.
+
+import asyncio
+import time
+import traceback
+import dns.asyncresolver
+import dns.resolver
+import dns.exception
+import dnslook
+import zonecut_cache
+
+class dnslook_engine:
+    def __init__(self, max_in_flight=500, resolver=None, zone_cache=None):
+        self.max_in_flight = max_in_flight
+        self.zone_cache = zone_cache
+        if resolver is None:
+            resolver = dns.asyncresolver.Resolver()
+            resolver.timeout = 1
+            resolver.lifetime = 3
+        self.resolver = resolver
+        self.query_slots = None
+        self.domain_slots = None
+
+    async def query(self, name, record_type):
+        # Same as the blocking "resolver.query", i.e., with the search list.
+        async with self.query_slots:
+            return await self.resolver.resolve(name, record_type, search=True)
+
+    async def protected_dns_query(self, d, record_type):
+        response = []
+        success = True
+        try:
+            response = await self.query(d.domain, record_type)
+        except dns.resolver.NoAnswer:
+            pass
+        except dns.exception.Timeout:
+            success = False
+            d.dns_timeout += 1
+        except Exception as e:
+            d.dns_not_found += 1
+            success = False
+        return success, response
+
+    async def get_a(self, d):
+        d.ip = []
+        success, addresses = await self.protected_dns_query(d, 'A')
+        if success:
+            for ipval in addresses:
+                d.ip.append(ipval.to_text())
+
+    async def get_aaaa(self, d):
+        d.ipv6 = []
+        success, addresses = await self.protected_dns_query(d, 'AAAA')
+        if success:
+            for ipval in addresses:
+                d.ipv6.append(ipval.to_text())
+
+    async def zone_query(self, zone, record_type):
+        # Same as dnslook.zone_query, with the engine's cache.
+        if self.zone_cache is not None:
+            cached = self.zone_cache.get(zone, record_type)
+            if cached is not None:
+                return cached
+        ttl = None
+        try:
+            answer = await self.query(zone, record_type)
+            values = [x.to_text() for x in answer]
+            status = zonecut_cache.ANSWER
+            ttl = zonecut_cache.answer_ttl(answer)
+        except dns.resolver.NoAnswer as e:
+            status, values = zonecut_cache.NO_ANSWER, []
+            ttl = zonecut_cache.negative_ttl(e)
+        except dns.exception.Timeout:
+            raise
+        except Exception as e:
+            status, values = zonecut_cache.ERROR, []
+            ttl = zonecut_cache.negative_ttl(e)
+        if self.zone_cache is not None:
+            self.zone_cache.put(zone, record_type, status, values, ttl)
+        return status, values
+
+    async def get_ns(self, d):
+        d.ns = []
+        nameparts = d.domain.split(".")
+        while len(nameparts) > 1 :
+            d.zone = ""
+            for p in nameparts:
+                d.zone += p
+                d.zone += '.'
+            try:
+                status, nameservers = await self.zone_query(d.zone, 'NS')
+            except dns.exception.Timeout:
+                d.dns_timeout += 1
+                break
+            if status == zonecut_cache.ANSWER:
+                for nsval in nameservers:
+                    d.ns.append(dnslook.sanitize(nsval))
+                break
+            elif status == zonecut_cache.NO_ANSWER:
+                break
+            else:
+                nameparts.pop(0)
+
+    async def get_ds_algo(self, d):
+        if d.zone != "":
+            try:
+                status, ds_recv = await self.zone_query(d.zone, 'DS')
+            except dns.exception.Timeout:
+                status, ds_recv = zonecut_cache.ERROR, []
+            if status == zonecut_cache.ERROR:
+                d.zone_dns_error += 1
+            for ds in ds_recv:
+                ds_parts = ds.split(" ")
+                if len(ds_parts) > 2:
+                    d.ds_algo.append(ds_parts[1])
+                else:
+                    print("Malformed DS for " + d.zone + ": " + ds)
+
+    async def get_cname(self, d):
+        d.cname = []
+        candidate = d.domain
+        loop_count = 0
+        while loop_count < 16:
+            try:
+                aliases = await self.query(candidate, 'CNAME')
+                if len(aliases) > 0:
+                    candidate = dnslook.sanitize(aliases[0].to_text())
+                    d.cname.append(candidate)
+                    loop_count += 1
+                else:
+                    break
+            except Exception as e:
+                break
+
+    async def timed(self, coro, stats, index):
+        start_time = time.time()
+        await coro
+        stats[index] += time.time() - start_time
+
+    async def get_ns_and_ds(self, d, stats, do_ns, do_ds):
+        # The DS query needs the zone found by the NS search.
+        if do_ns:
+            await self.timed(self.get_ns(d), stats, 2)
+        if do_ds:
+            await self.timed(self.get_ds_algo(d), stats, 3)
+
+    async def finish(self, d, ps, i2a, i2a6, stats, do_server, do_asn):
+        start_time = time.time()
+        if do_server:
+            d.get_server(ps)
+        server_time = time.time()
+        if do_asn:
+            d.get_asn(i2a, i2a6)
+        asn_time = time.time()
+        stats[5] += server_time - start_time
+        stats[6] += asn_time - server_time
+        d.nb_queries += 1
+
+    async def get_domain_data(self, d, domain, ps, i2a, i2a6, stats, rank=-1, rng=-1):
+        d.domain = domain
+        if rank >= 0:
+            d.million_rank = rank
+        if rng >= 0:
+            d.million_range = rng
+        d.dns_timeout = 0
+        await asyncio.gather(
+            self.timed(self.get_a(d), stats, 0),
+            self.timed(self.get_aaaa(d), stats, 1),
+            self.get_ns_and_ds(d, stats, True, True),
+            self.timed(self.get_cname(d), stats, 4))
+        await self.finish(d, ps, i2a, i2a6, stats, True, True)
+
+    async def retry_domain_data(self, d, ps, i2a, i2a6, stats):
+        d.dns_timeout = 0
+        need_new_as = len(d.ip) == 0 or len(d.ipv6) == 0
+        need_cname = len(d.cname) == 0
+        tasks = []
+        if len(d.ip) == 0:
+            tasks.append(self.timed(self.get_a(d), stats, 0))
+        if len(d.ipv6) == 0:
+            tasks.append(self.timed(self.get_aaaa(d), stats, 1))
+        tasks.append(self.get_ns_and_ds(d, stats, len(d.ns) == 0, len(d.ds_algo) == 0))
+        if need_cname:
+            tasks.append(self.timed(self.get_cname(d), stats, 4))
+        await asyncio.gather(*tasks)
+        await self.finish(d, ps, i2a, i2a6, stats, need_cname, len(d.ases) == 0 or need_new_as)
+
+    async def load_one(self, d, ps, i2a, i2a6, stats, retry):
+        success = False
+        async with self.domain_slots:
+            try:
+                if retry:
+                    await self.retry_domain_data(d, ps, i2a, i2a6, stats)
+                else:
+                    await self.get_domain_data(d, d.domain, ps, i2a, i2a6, stats, rank=d.million_rank, rng=d.million_range)
+                success = True
+            except Exception as e:
+                traceback.print_exc()
+                print("Cannot assess domain <" + d.domain  + ">\nException: " + str(e))
+        return success, d
+
+    async def load_all(self, targets, ps, i2a, i2a6, stats, retry, on_result=None):
+        # The semaphores must be created in the running loop.
+        self.query_slots = asyncio.Semaphore(self.max_in_flight)
+        self.domain_slots = asyncio.Semaphore(self.max_in_flight)
+        results = []
+        if self.zone_cache is not None:
+            hits, lookups = self.zone_cache.hits, self.zone_cache.lookups
+        tasks = [self.load_one(d, ps, i2a, i2a6, stats, retry) for d in targets]
+        for future in asyncio.as_completed(tasks):
+            result = await future
+            results.append(result)
+            if on_result is not None:
+                on_result(result[0], result[1])
+        # The lookups overlap, so the cache counters are only added for
+        # the whole run, as in dnslook.add_cache_stats.
+        if self.zone_cache is not None and len(stats) > 8:
+            stats[7] += self.zone_cache.hits - hits
+            stats[8] += self.zone_cache.lookups - lookups
+        return results
+
+    def get_domains_data(self, targets, ps, i2a, i2a6, stats, retry=False, on_result=None):
+        # Look up all the targets. If "retry" is set, only the missing data
+        # is queried, as in dnslook.retry_domain_data. If "on_result" is
+        # set, on_result(success, d) is called as each lookup completes.
+        return asyncio.run(self.load_all(targets, ps, i2a, i2a6, stats, retry, on_result=on_result))
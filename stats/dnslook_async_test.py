@@ -0,0 +1,252 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Unit test of the asynchronous dnslook engine.
+#
+# A stub DNS server answers queries on a local port from a small table of
+# records, including aliases, names that do not exist, names without
+# the requested record type, and names for which queries are dropped to
+# cause timeouts. The same domains are looked up with the blocking
+# dnslook.get_domain_data and with dnslook_async.dnslook_engine, and the
+# resulting JSON records must be identical, except for the order of the
+# values in lists, which follows the order of the records in the DNS
+# responses. The retry path is checked the same way, starting from
+# records that lack addresses and names. The lookups are then repeated
+# with a zone cut cache, first in memory and then shared through an
+# SQLite file, and must give the same records with some cache hits.
+#
+# Expect this test to work:
+#
+# py .\dnslook_async_test.py ..\data\public_suffix_list.dat ..\tmp\
+
+import sys
+import os
+import json
+import socket
+import threading
+import time
+import ipaddress
+import dns.message
+import dns.rrset
+import dns.rcode
+import dns.resolver
+import dns.asyncresolver
+import dnslook
+import dnslook_async
+import pubsuffix
+import ip2as
+import zonecut_cache
+
+records = {
+    "example.com.": { "NS": ["ns1.example.net.", "ns2.example.org."], "DS": ["12345 8 1 49fd46e6c4b45c55d4ac69cbd3cd34ac1afe51de"], \
+        "A": ["10.0.0.1"], "AAAA": ["2001:db8::1"] },
+    "www.example.com.": { "CNAME": ["cdn.example.net."] },
+    "cdn.example.net.": { "CNAME": ["edge.example.org."] },
+    "edge.example.org.": { "A": ["10.1.0.1", "10.1.0.2"], "AAAA": ["2001:db8:1::1"] },
+    "example.net.": { "NS": ["ns1.example.net."] },
+    "example.org.": { "NS": ["ns1.example.net."], "DS": ["5678 13 1 49fd46e6c4b45c55d4ac69cbd3cd34ac1afe51de"] },
+    "noaddr.example.com.": { "TXT": ["\"nothing here\""] },
+    "deep.sub.example.org.": { "A": ["10.2.0.1"] },
+    "loop1.example.com.": { "CNAME": ["loop2.example.com."] },
+    "loop2.example.com.": { "CNAME": ["loop1.example.com."] },
+    "com.": { "NS": ["a.gtld-servers.net."], "DS": ["30909 8 1 49fd46e6c4b45c55d4ac69cbd3cd34ac1afe51de"] },
+    "org.": { "NS": ["a0.org.afilias-nst.info."] },
+    "net.": { "NS": ["a.gtld-servers.net."] },
+}
+negative_soa = dns.rrset.from_text("example.com.", 3600, "IN", "SOA", "ns1.example.net. admin.example.com. 1 7200 3600 86400 60")
+dropped = set(["slow.example.com.", "slow.example.org."])
+
+def answer_rrsets(name, rtype, depth=0):
+    rrsets = []
+    if name in records:
+        entry = records[name]
+        if rtype in entry:
+            rrsets.append(dns.rrset.from_text_list(name, 300, "IN", rtype, entry[rtype]))
+        elif "CNAME" in entry and depth < 8:
+            rrsets.append(dns.rrset.from_text_list(name, 300, "IN", "CNAME", entry["CNAME"]))
+            rrsets += answer_rrsets(entry["CNAME"][0], rtype, depth + 1)
+    return rrsets
+
+def serve(sock):
+    while True:
+        try:
+            wire, addr = sock.recvfrom(4096)
+        except OSError:
+            break
+        query = dns.message.from_wire(wire)
+        question = query.question[0]
+        name = question.name.to_text().lower()
+        if name in dropped:
+            continue
+        response = dns.message.make_response(query)
+        response.flags |= dns.flags.RA
+        if name in records:
+            response.answer = answer_rrsets(name, dns.rdatatype.to_text(question.rdtype))
+            if len(response.answer) == 0:
+                response.authority = [negative_soa]
+        else:
+            response.set_rcode(dns.rcode.NXDOMAIN)
+            response.authority = [negative_soa]
+        sock.sendto(response.to_wire(), addr)
+
+def configure(resolver, port):
+    resolver.nameservers = ["127.0.0.1"]
+    resolver.port = port
+    resolver.timeout = 0.2
+    resolver.lifetime = 0.4
+    return resolver
+
+def lookup_sync(domains, port, ps, i2a, i2a6, retry_from=None, zone_cache=None):
+    results = dict()
+    stats = [0, 0, 0, 0, 0, 0, 0, 0, 0]
+    for i in range(0, len(domains)):
+        if retry_from is None:
+            d = dnslook.dnslook()
+        else:
+            d = retry_from[i]
+        d.resolver = configure(dns.resolver.Resolver(configure=False), port)
+        d.zone_cache = zone_cache
+        if retry_from is None:
+            d.get_domain_data(domains[i], ps, i2a, i2a6, stats, rank=i, rng=i%5)
+        else:
+            d.retry_domain_data(ps, i2a, i2a6, stats)
+        results[d.domain] = d.to_json()
+    if not check_cache_stats("sync", stats, zone_cache):
+        results = dict()
+    return results
+
+def check_cache_stats(label, stats, zone_cache):
+    if zone_cache is None:
+        ret = stats[7] == 0 and stats[8] == 0
+    else:
+        ret = stats[7] > 0 and stats[8] >= stats[7]
+    if not ret:
+        print(label + ", unexpected cache stats: " + str(stats[7]) + " hits in " + str(stats[8]) + " lookups.")
+    return ret
+
+def lookup_async(domains, port, ps, i2a, i2a6, retry_from=None, zone_cache=None):
+    stats = [0, 0, 0, 0, 0, 0, 0, 0, 0]
+    targets = []
+    for i in range(0, len(domains)):
+        if retry_from is None:
+            d = dnslook.dnslook()
+            d.domain = domains[i]
+            d.million_rank = i
+            d.million_range = i%5
+        else:
+            d = retry_from[i]
+        targets.append(d)
+    engine = dnslook_async.dnslook_engine(max_in_flight=4, \
+        resolver=configure(dns.asyncresolver.Resolver(configure=False), port), zone_cache=zone_cache)
+    results = dict()
+    for success, d in engine.get_domains_data(targets, ps, i2a, i2a6, stats, retry=retry_from is not None):
+        if success:
+            results[d.domain] = d.to_json()
+    if len(stats) != 9 or stats[0] <= 0 or stats[2] <= 0:
+        print("Unexpected stats: " + str(stats))
+        results = dict()
+    if not check_cache_stats("async", stats, zone_cache):
+        results = dict()
+    return results
+
+def partial_records(domains):
+    # Records as they would be after a lookup that missed addresses and names.
+    partial = []
+    for domain in domains:
+        d = dnslook.dnslook()
+        d.domain = domain
+        if domain.startswith("example"):
+            d.ns = ["ns1.example.net."]
+            d.zone = domain + "."
+        partial.append(d)
+    return partial
+
+def canonical(js):
+    jd = json.loads(js)
+    for key in jd:
+        if isinstance(jd[key], list) and key != "cname":
+            jd[key] = sorted(jd[key])
+    return jd
+
+def compare_results(label, ref, res):
+    ret = True
+    if len(ref) != len(res):
+        print(label + ": got " + str(len(res)) + " records instead of " + str(len(ref)))
+        ret = False
+    for domain in ref:
+        if not domain in res:
+            print(label + ": no result for " + domain)
+            ret = False
+        elif canonical(ref[domain]) != canonical(res[domain]):
+            print(label + ": for " + domain + "\n    " + res[domain] + "\ninstead of:\n    " + ref[domain])
+            ret = False
+    if ret:
+        print(label + ": " + str(len(ref)) + " records match.")
+    return ret
+
+# main program
+
+if len(sys.argv) != 3:
+    print("Usage: " + sys.argv[0] + " public_suffix_file tmp_dir")
+    exit(1)
+tmp_dir = sys.argv[2]
+ps = pubsuffix.public_suffix()
+if not ps.load_file(sys.argv[1]):
+    print("Could not load the suffixes from " + sys.argv[1])
+    exit(1)
+i2a = ip2as.ip2as_table()
+i2a.add(ipaddress.IPv4Address("10.0.0.0"), ipaddress.IPv4Address("10.0.255.255"), 64500)
+i2a.add(ipaddress.IPv4Address("10.1.0.0"), ipaddress.IPv4Address("10.1.255.255"), 64501)
+i2a6 = ip2as.ip2as_table()
+i2a6.add(ipaddress.IPv6Address("2001:db8::"), ipaddress.IPv6Address("2001:db8:0:ffff:ffff:ffff:ffff:ffff"), 64502)
+
+sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+sock.bind(("127.0.0.1", 0))
+port = sock.getsockname()[1]
+server = threading.Thread(target=serve, args=(sock,), daemon=True)
+server.start()
+
+domains = [ "example.com", "www.example.com", "noaddr.example.com", "deep.sub.example.org", \
+    "missing.example.com", "loop1.example.com", "slow.example.com", "edge.example.org" ]
+
+ref = lookup_sync(domains, port, ps, i2a, i2a6)
+ret = compare_results("lookup", ref, lookup_async(domains, port, ps, i2a, i2a6))
+ret &= compare_results("retry", lookup_sync(domains, port, ps, i2a, i2a6, retry_from=partial_records(domains)), \
+    lookup_async(domains, port, ps, i2a, i2a6, retry_from=partial_records(domains)))
+
+ret &= compare_results("cached lookup", ref, lookup_sync(domains, port, ps, i2a, i2a6, zone_cache=zonecut_cache.zone_cut_cache()))
+ret &= compare_results("cached async lookup", ref, lookup_async(domains, port, ps, i2a, i2a6, zone_cache=zonecut_cache.zone_cut_cache()))
+# A second cache on the same file finds the entries written by the first.
+cache_file = os.path.join(tmp_dir, "zone_cache_test.db")
+if os.path.isfile(cache_file):
+    os.remove(cache_file)
+ret &= compare_results("shared cache, first", ref, lookup_async(domains, port, ps, i2a, i2a6, zone_cache=zonecut_cache.zone_cut_cache(cache_file)))
+shared = zonecut_cache.zone_cut_cache(cache_file)
+ret &= compare_results("shared cache, second", ref, lookup_sync(domains, port, ps, i2a, i2a6, zone_cache=shared))
+# Only the NS and DS queries for slow.example.com time out, and are not cached.
+if shared.get("example.com.", "NS") is None or shared.get("slow.example.com.", "NS") is not None or \
+    shared.hits != shared.lookups - 3:
+    print("Shared cache: " + str(shared.hits) + " hits in " + str(shared.lookups) + " lookups.")
+    ret = False
+shared.close()
+# The expired entries are deleted when the database is opened again.
+expired = zonecut_cache.zone_cut_cache(cache_file)
+expired.put("old.example.com.", "NS", zonecut_cache.NO_ANSWER, [], ttl=-1)
+expired.close()
+reopened = zonecut_cache.zone_cut_cache(cache_file)
+nb_expired = reopened.db.execute("SELECT COUNT(*) FROM zone_cache WHERE expires < ?", (time.time(),)).fetchone()[0]
+if nb_expired != 0 or reopened.get("example.com.", "NS") is None:
+    print("Reopened cache: " + str(nb_expired) + " expired entries.")
+    ret = False
+reopened.close()
+zonecut_cache.remove_db_files(cache_file)
+left = [f for f in [ cache_file, cache_file + "-wal", cache_file + "-shm" ] if os.path.isfile(f)]
+if len(left) > 0:
+    print("Cache files not removed: " + str(left))
+    ret = False
+sock.close()
+
+if not ret:
+    exit(1)
+else:
+    exit(0)
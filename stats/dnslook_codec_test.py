@@ -0,0 +1,187 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Unit test of the dnslook record codec.
+#
+# The encoder must produce exactly the same bytes as the original
+# implementation of dnslook.to_json, which is reproduced here, and the
+# decoder must give the same objects as the original from_json, based on
+# json.loads. The test uses the records in a JSON result file, random
+# records with unusual characters, and variations of the records with
+# spaces, escapes, floating point numbers or nested objects. Malformed
+# lines and lines without domain must be rejected.
+# The domain only fast path must match the full decoder, and reject
+# truncated lines.
+#
+# Expect this test to work:
+#
+# py .\dnslook_codec_test.py ..\data\dnslook_test.json
+
+import sys
+import json
+import random
+import dnslook
+
+def reference_sanitize(object_may_be_string):
+    unsafe_str = str(object_may_be_string)
+    safe_str = ''
+    for char in unsafe_str:
+        cp = ord(char)
+        if (cp >= ord('a') and cp <= ord('z')) or \
+           (cp >= ord('0') and cp <= ord('9')) or \
+           (cp >= ord('A') and cp <= ord('Z')) or \
+           cp == ord(':') or cp == ord('.') or \
+           cp == ord('-') or cp == ord('_') :
+            safe_str += char
+        elif cp == 9:
+            safe_str += '_'
+    return safe_str
+
+def reference_array(x):
+    jsa = "["
+    is_first = True
+    for item in x:
+        if not is_first:
+            jsa += ","
+        is_first = False
+        jsa += "\"" + reference_sanitize(item) + "\""
+    jsa += "]"
+    return(jsa)
+
+def reference_to_json(d):
+    js = "{\"domain\":\"" + d.domain + "\""
+    if len(d.ip) > 0:
+        js += ",\"ip\":" + reference_array(d.ip)
+    if len(d.ipv6) > 0:
+        js += ",\"ipv6\":" + reference_array(d.ipv6)
+    js += ",\"zone\":\"" + d.zone + "\""
+    if len(d.ns) > 0:
+        js += ",\"ns\":" + reference_array(d.ns)
+    js += ",\"ds_algo\":" + reference_array(d.ds_algo)
+    if len(d.cname) > 0:
+        js += ",\"cname\":" + reference_array(d.cname)
+    js += ",\"server\":\"" + d.server + "\""
+    if d.million_rank >= 0:
+        js += ",\"rank\":" + str(d.million_rank)
+    if d.million_range >= 0:
+        js += ",\"range\":" + str(d.million_range)
+    if len(d.ases) > 0:
+        js += ",\"ases\":" + reference_array(d.ases)
+    if d.dns_not_found != 0:
+        js += ",\"dns_not_found\":" + str(d.dns_not_found)
+    if d.dns_timeout != 0:
+        js += ",\"dns_timeout\":" + str(d.dns_timeout)
+    if d.nb_queries != 0:
+        js += ",\"nb_queries\":" + str(d.nb_queries)
+    js += "}"
+    return(js)
+
+def reference_from_json(js):
+    # Returns the dictionary of attributes, or None
+    try:
+        jd = json.loads(js)
+    except Exception:
+        return None
+    if not isinstance(jd, dict) or not 'domain' in jd:
+        return None
+    return jd
+
+def attributes(d):
+    return [ d.domain, d.ip, d.ipv6, d.zone, d.ns, d.cname, d.server, d.ases, d.ds_algo, \
+        d.million_rank, d.million_range, d.dns_not_found, d.dns_timeout, d.nb_queries ]
+
+def expected_attributes(jd):
+    d = dnslook.dnslook()
+    for key in jd:
+        if key in dnslook.JSON_ATTRIBUTES:
+            setattr(d, dnslook.JSON_ATTRIBUTES[key], jd[key])
+    return attributes(d)
+
+def random_text(rd):
+    chars = "abcXYZ019.-_:\t é中/\"\\,[]{}"
+    return "".join(rd.choice(chars) for i in range(0, rd.randint(0, 12)))
+
+def random_record(rd):
+    d = dnslook.dnslook()
+    d.domain = "d" + str(rd.randint(0, 1000)) + ".com"
+    for name in [ "ip", "ipv6", "ns", "cname", "ases", "ds_algo" ]:
+        setattr(d, name, [random_text(rd) for i in range(0, rd.randint(0, 3))])
+    d.zone = d.domain + "."
+    d.server = "example.com"
+    d.million_rank = rd.randint(-1, 1000000)
+    d.million_range = rd.randint(-1, 5)
+    d.dns_not_found = rd.randint(0, 2)
+    d.dns_timeout = rd.randint(0, 2)
+    d.nb_queries = rd.randint(0, 2)
+    return d
+
+def check_decode(label, line):
+    jd = reference_from_json(line)
+    d = dnslook.decode_dnslook(line)
+    domain = dnslook.extract_domain(line)
+    if jd is None:
+        # The domain only path does not check the syntax of complete lines.
+        if d is not None or (domain is not None and not line.endswith("}")):
+            print(label + ", should be rejected: " + line)
+            return False
+        return True
+    if d is None:
+        print(label + ", cannot decode: " + line)
+        return False
+    if attributes(d) != expected_attributes(jd):
+        print(label + ", decoded " + str(attributes(d)) + " instead of " + str(expected_attributes(jd)) + " from " + line)
+        return False
+    if domain != d.domain:
+        print(label + ", domain " + str(domain) + " instead of " + d.domain + " in " + line)
+        return False
+    return True
+
+# main program
+
+if len(sys.argv) != 2:
+    print("Usage: " + sys.argv[0] + " dns_json")
+    exit(1)
+
+ret = True
+lines = [line.strip() for line in open(sys.argv[1], "rt", encoding="utf-8")]
+rd = random.Random(12345)
+for i in range(0, 2000):
+    d = random_record(rd)
+    js = d.to_json()
+    if js != reference_to_json(d):
+        print("Encoded:\n    " + js + "\ninstead of:\n    " + reference_to_json(d))
+        ret = False
+        break
+    lines.append(js)
+
+variations = []
+for line in lines[:50]:
+    variations.append(line.replace(",", ", "))
+    variations.append(line.replace("\"domain\":\"", "\"domain\": \""))
+    variations.append(line.replace("\"zone\":\"", "\"zone\":\"\\u0041"))
+    variations.append(line.replace("\"rank\":", "\"rank\":1.5, \"x\":"))
+    variations.append(line.replace("{\"domain\":", "{\"other\":{\"a\":1},\"domain\":"))
+    variations.append(line.replace("\"domain\":", "\"not_domain\":"))
+    variations.append(line[:-1])
+    variations.append(line + ",")
+    variations.append(line.replace("]", ",]", 1))
+variations += [ "", "{}", "[]", "{\"domain\":\"a.com\",}", "null", "{\"domain\":\"x\\\"y.com\"}" ]
+
+nb_checked = 0
+for line in lines + variations:
+    if not check_decode("line " + str(nb_checked), line):
+        ret = False
+        break
+    nb_checked += 1
+
+# decode_lines skips the lines that cannot be parsed
+nb_expected = sum(1 for line in lines + variations if reference_from_json(line) is not None)
+nb_decoded = sum(1 for d in dnslook.decode_lines(lines + variations))
+if nb_decoded != nb_expected:
+    print("decode_lines returns " + str(nb_decoded) + " records instead of " + str(nb_expected))
+    ret = False
+
+if not ret:
+    exit(1)
+print("Checked " + str(nb_checked) + " lines, " + str(nb_decoded) + " records.")
+exit(0)
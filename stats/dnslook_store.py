@@ -0,0 +1,277 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Columnar store of dnslook results.
+#
+# The dnslook results are kept in JSON lines files, which many scripts
+# read again and parse entirely into dnslook objects, even if they only
+# need a few fields. The store keeps the same data in columns, in a
+# directory next to the JSON file, named after it with the suffix
+# COLUMN_SUFFIX:
+#
+# * integer columns, one binary array per column: rank, range, flags,
+#   dns_not_found, dns_timeout and nb_queries. The flags are bit
+#   masks, FLAG_DNSSEC if there are DS algorithms, FLAG_CNAME if there
+#   are CNAME, FLAG_IP and FLAG_IPV6 if there are addresses.
+# * string columns, one value per line in a text file: domain, zone and
+#   server.
+# * list columns: ip, ipv6, ns, ds_algo, cname and ases. For each, an
+#   array holds the number of values per row and a text file holds the
+#   values, one per line. The offsets of the values of each row are the
+#   cumulative sums of the counts.
+#
+# The file "meta.csv" holds the number of rows, the size of each column
+# file, and the size of the JSON file that was loaded, with a hash of
+# its last bytes. Data written after the sizes in the meta file, e.g.,
+# by an interrupted append, is ignored. The JSON result files grow as
+# lookups are added; when the JSON file is larger than the loaded size
+# and the hash of the loaded bytes did not change, only the new lines are
+# parsed and appended to the columns. In other cases, the store is
+# rebuilt.
+#
+# The function open_dns_columns(dns_json) returns the store after
+# bringing it up to date. Scripts can then read only the columns they
+# need, with "column" and "lists", or get dnslook objects, which are
+# materialized row by row. The rows are in the order of the JSON file,
+# including duplicate domains; first_rows() returns the index of the
+# first row of each domain, as used by dnslook.load_dns_file.
+
+import os
+import hashlib
+import numpy as np
+import dnslook
+
+COLUMN_SUFFIX = ".cols"
+META_FILE = "meta.csv"
+VERSION = 1
+
+FLAG_DNSSEC = 1
+FLAG_CNAME = 2
+FLAG_IP = 4
+FLAG_IPV6 = 8
+
+INT_COLUMNS = { "rank": np.int64, "range": np.int32, "flags": np.uint8, \
+    "dns_not_found": np.int32, "dns_timeout": np.int32, "nb_queries": np.int32 }
+STRING_COLUMNS = [ "domain", "zone", "server" ]
+LIST_COLUMNS = [ "ip", "ipv6", "ns", "ds_algo", "cname", "ases" ]
+COUNT_TYPE = np.uint32
+HASH_BYTES = 256
+
+def column_files():
+    files = [name + ".bin" for name in INT_COLUMNS]
+    files += [name + ".txt" for name in STRING_COLUMNS]
+    for name in LIST_COLUMNS:
+        files += [name + ".cnt", name + ".txt"]
+    return files
+
+def clean_value(x):
+    # Values are stored one per line.
+    return str(x).replace("\n", " ")
+
+def tail_hash(file_name, size):
+    # Hash of the HASH_BYTES bytes before "size" in the file.
+    start = max(0, size - HASH_BYTES)
+    with open(file_name, "rb") as f:
+        f.seek(start)
+        return hashlib.sha256(f.read(size - start)).hexdigest()
+
+class dns_column_store:
+    def __init__(self, dir_name):
+        self.dir_name = dir_name
+        self.nb_rows = 0
+        self.sizes = dict()
+        self.json_size = 0
+        self.json_hash = ""
+        self.cache = dict()
+        if not self.load_meta():
+            self.clear()
+
+    def path(self, file_name):
+        return os.path.join(self.dir_name, file_name)
+
+    def load_meta(self):
+        meta = self.path(META_FILE)
+        if not os.path.isfile(meta):
+            return False
+        version = 0
+        for line in open(meta, "rt", encoding="utf-8"):
+            parts = line.strip().split(",")
+            if len(parts) != 2:
+                continue
+            if parts[0] == "version":
+                version = int(parts[1])
+            elif parts[0] == "rows":
+                self.nb_rows = int(parts[1])
+            elif parts[0] == "json_size":
+                self.json_size = int(parts[1])
+            elif parts[0] == "json_hash":
+                self.json_hash = parts[1]
+            else:
+                self.sizes[parts[0]] = int(parts[1])
+        return version == VERSION and all(x in self.sizes for x in column_files())
+
+    def save_meta(self):
+        meta = self.path(META_FILE)
+        with open(meta + ".tmp", "wt", encoding="utf-8") as f:
+            f.write("version," + str(VERSION) + "\n")
+            f.write("rows," + str(self.nb_rows) + "\n")
+            f.write("json_size," + str(self.json_size) + "\n")
+            f.write("json_hash," + self.json_hash + "\n")
+            for file_name in column_files():
+                f.write(file_name + "," + str(self.sizes[file_name]) + "\n")
+        os.replace(meta + ".tmp", meta)
+
+    def clear(self):
+        os.makedirs(self.dir_name, exist_ok=True)
+        for file_name in column_files():
+            open(self.path(file_name), "wb").close()
+            self.sizes[file_name] = 0
+        self.nb_rows = 0
+        self.json_size = 0
+        self.json_hash = ""
+        self.cache = dict()
+        self.save_meta()
+
+    def append(self, lookups):
+        # Append a list of dnslook objects to the columns.
+        self.cache = dict()
+        n = len(lookups)
+        values = dict()
+        values["rank"] = [d.million_rank for d in lookups]
+        values["range"] = [d.million_range for d in lookups]
+        values["flags"] = [(FLAG_DNSSEC if len(d.ds_algo) > 0 else 0) | \
+            (FLAG_CNAME if len(d.cname) > 0 else 0) | \
+            (FLAG_IP if len(d.ip) > 0 else 0) | \
+            (FLAG_IPV6 if len(d.ipv6) > 0 else 0) for d in lookups]
+        values["dns_not_found"] = [d.dns_not_found for d in lookups]
+        values["dns_timeout"] = [d.dns_timeout for d in lookups]
+        values["nb_queries"] = [d.nb_queries for d in lookups]
+        blobs = dict()
+        for name in INT_COLUMNS:
+            blobs[name + ".bin"] = np.array(values[name], dtype=INT_COLUMNS[name]).tobytes()
+        for name in STRING_COLUMNS:
+            blobs[name + ".txt"] = "".join(clean_value(getattr(d, name)) + "\n" for d in lookups).encode("utf-8")
+        for name in LIST_COLUMNS:
+            lists = [getattr(d, name) for d in lookups]
+            blobs[name + ".cnt"] = np.array([len(x) for x in lists], dtype=COUNT_TYPE).tobytes()
+            blobs[name + ".txt"] = "".join(clean_value(v) + "\n" for x in lists for v in x).encode("utf-8")
+        for file_name in blobs:
+            with open(self.path(file_name), "r+b") as f:
+                # drop whatever an interrupted append left after the end
+                f.truncate(self.sizes[file_name])
+                f.seek(self.sizes[file_name])
+                f.write(blobs[file_name])
+            self.sizes[file_name] += len(blobs[file_name])
+        self.nb_rows += n
+
+    def update_from_json(self, dns_json, chunk_rows=100000):
+        # Bring the columns up to date with the JSON file.
+        json_size = os.path.getsize(dns_json)
+        if json_size < self.json_size or \
+            (self.json_size > 0 and tail_hash(dns_json, self.json_size) != self.json_hash):
+            self.clear()
+        if json_size == self.json_size:
+            return 0
+        nb_added = 0
+        with open(dns_json, "rb") as f:
+            f.seek(self.json_size)
+            lookups = []
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # incomplete last line, wait until it is complete
+                    break
+                self.json_size += len(line)
+                js_line = line.decode("utf-8").strip()
+                if len(js_line) == 0:
+                    continue
+                d = dnslook.decode_dnslook(js_line)
+                if d is not None:
+                    lookups.append(d)
+                if len(lookups) >= chunk_rows:
+                    self.append(lookups)
+                    nb_added += len(lookups)
+                    lookups = []
+            self.append(lookups)
+            nb_added += len(lookups)
+        self.json_hash = tail_hash(dns_json, self.json_size)
+        self.save_meta()
+        return nb_added
+
+    def column(self, name):
+        # Return an integer column as a numpy array, or a string column
+        # as a list of strings.
+        if name in self.cache:
+            return self.cache[name]
+        if name in INT_COLUMNS:
+            dt = np.dtype(INT_COLUMNS[name])
+            x = np.fromfile(self.path(name + ".bin"), dtype=dt, count=self.nb_rows)
+        elif name in STRING_COLUMNS:
+            x = self.read_lines(name + ".txt", self.nb_rows)
+        else:
+            raise ValueError("Unknown column: " + name)
+        self.cache[name] = x
+        return x
+
+    def read_lines(self, file_name, count):
+        with open(self.path(file_name), "rb") as f:
+            data = f.read(self.sizes[file_name]).decode("utf-8")
+        if count == 0:
+            return []
+        return data.split("\n")[:count]
+
+    def lists(self, name):
+        # Return the offsets and the values of a list column. The values
+        # of row i are values[offsets[i]:offsets[i+1]].
+        if name in self.cache:
+            return self.cache[name]
+        if not name in LIST_COLUMNS:
+            raise ValueError("Unknown list column: " + name)
+        counts = np.fromfile(self.path(name + ".cnt"), dtype=COUNT_TYPE, count=self.nb_rows)
+        offsets = np.zeros(self.nb_rows + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        values = self.read_lines(name + ".txt", int(offsets[-1]))
+        self.cache[name] = (offsets, values)
+        return offsets, values
+
+    def row_lists(self, name):
+        # Return a list column as a list of python lists.
+        offsets, values = self.lists(name)
+        o = offsets.tolist()
+        return [values[o[i]:o[i+1]] for i in range(0, self.nb_rows)]
+
+    def first_rows(self):
+        # Index of the first row of each domain, in row order.
+        seen = set()
+        rows = []
+        for i, domain in enumerate(self.column("domain")):
+            if not domain in seen:
+                seen.add(domain)
+                rows.append(i)
+        return rows
+
+    def get_dnslook(self, i):
+        d = dnslook.dnslook()
+        d.domain = self.column("domain")[i]
+        d.zone = self.column("zone")[i]
+        d.server = self.column("server")[i]
+        d.million_rank = int(self.column("rank")[i])
+        d.million_range = int(self.column("range")[i])
+        d.dns_not_found = int(self.column("dns_not_found")[i])
+        d.dns_timeout = int(self.column("dns_timeout")[i])
+        d.nb_queries = int(self.column("nb_queries")[i])
+        for name in LIST_COLUMNS:
+            offsets, values = self.lists(name)
+            setattr(d, name, values[offsets[i]:offsets[i+1]])
+        return d
+
+    def dnslooks(self, rows=None):
+        # Generator of dnslook objects, for all rows or for the listed ones.
+        if rows is None:
+            rows = range(0, self.nb_rows)
+        for i in rows:
+            yield self.get_dnslook(i)
+
+def open_dns_columns(dns_json):
+    store = dns_column_store(dns_json + COLUMN_SUFFIX)
+    store.update_from_json(dns_json)
+    return store
@@ -0,0 +1,107 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Unit test of the columnar store of dnslook results.
+#
+# The lines of a JSON result file are copied in a temporary file in
+# several steps, as do_dnslookup would append them, including a step that
+# ends with an incomplete line. After each step the store is updated, and
+# the objects materialized from the columns must serialize exactly as the
+# objects parsed from the JSON lines. The first rows of each domain must
+# match dnslook.load_dns_json, and replacing the JSON file must cause the
+# store to be rebuilt.
+#
+# Expect this test to work:
+#
+# py .\dnslook_store_test.py ..\data\dnslook_test.json ..\tmp\
+
+import sys
+import os
+import shutil
+import dnslook
+import dnslook_store
+
+def check_store(label, store, lines):
+    ret = True
+    expected = []
+    for line in lines:
+        d = dnslook.dnslook()
+        if d.from_json(line):
+            expected.append(d.to_json())
+    if store.nb_rows != len(expected):
+        print(label + ": " + str(store.nb_rows) + " rows instead of " + str(len(expected)))
+        return False
+    for i, d in enumerate(store.dnslooks()):
+        if d.to_json() != expected[i]:
+            print(label + ", row " + str(i) + ":\n    " + d.to_json() + "\ninstead of:\n    " + expected[i])
+            ret = False
+            break
+    if ret:
+        print(label + ": " + str(store.nb_rows) + " rows match.")
+    return ret
+
+# main program
+
+if len(sys.argv) != 3:
+    print("Usage: " + sys.argv[0] + " dns_json tmp_dir")
+    exit(1)
+dns_json = sys.argv[1]
+tmp_dir = sys.argv[2]
+tmp_json = os.path.join(tmp_dir, "dnslook_store_test.json")
+store_dir = tmp_json + dnslook_store.COLUMN_SUFFIX
+if os.path.isdir(store_dir):
+    shutil.rmtree(store_dir)
+
+lines = [line for line in open(dns_json, "rt", encoding="utf-8")]
+steps = [ len(lines)//3, len(lines)//2, len(lines) ]
+ret = True
+with open(tmp_json, "wt", encoding="utf-8") as f:
+    pass
+written = 0
+for step in steps:
+    with open(tmp_json, "at", encoding="utf-8") as f:
+        for line in lines[written:step]:
+            f.write(line)
+        if step < len(lines):
+            # start writing the next line, without the end of line
+            f.write(lines[step][:10])
+    written = step
+    store = dnslook_store.open_dns_columns(tmp_json)
+    ret &= check_store("step " + str(step), store, lines[:step])
+    if step < len(lines):
+        # remove the incomplete line, as the next append will rewrite it
+        with open(tmp_json, "r+b") as f:
+            f.truncate(store.json_size)
+
+# The first rows of each domain must match load_dns_json
+ref = [d.to_json() for d in dnslook.load_dns_json(tmp_json, dot_after=0)]
+res = [d.to_json() for d in dnslook.load_dns_file(tmp_json, dot_after=0)]
+if ref != res:
+    print("load_dns_file returns " + str(len(res)) + " entries instead of " + str(len(ref)))
+    ret = False
+else:
+    print("load_dns_file: " + str(len(res)) + " unique domains as expected.")
+
+# Reading a column without materializing objects
+store = dnslook_store.open_dns_columns(tmp_json)
+offsets, values = store.lists("ns")
+nb_ns = 0
+for line in lines:
+    d = dnslook.dnslook()
+    if d.from_json(line):
+        nb_ns += len(d.ns)
+if len(values) != nb_ns or offsets[-1] != nb_ns:
+    print("Found " + str(len(values)) + " ns values instead of " + str(nb_ns))
+    ret = False
+
+# Replace the file by a shorter one, the store must be rebuilt
+with open(tmp_json, "wt", encoding="utf-8") as f:
+    for line in lines[-5:]:
+        f.write(line)
+store = dnslook_store.open_dns_columns(tmp_json)
+ret &= check_store("rebuilt", store, lines[-5:])
+
+if not ret:
+    exit(1)
+else:
+    exit(0)
@@ -41,7 +41,7 @@ import zoneparser
 import time
 import concurrent.futures
 import os
-import functools
+import ranking
 
 def get_prefix(name,ps):
     x,is_suffix = ps.suffix(name)
@@ -80,6 +80,10 @@ class stats_one_entry:
         self.name = name
         self.count = count
 
+def stats_entry_key(item):
+    # Sort key with the same order as compare_stats_entry.
+    return (item.count, item.name)
+
 def compare_stats_entry(item, other):
     if item.count < other.count:
         return -1
@@ -115,7 +119,7 @@ class stats_one:
         self.nb_names += nb_names
 
     def compute(self, top_set):
-        self.full_list.sort(key=functools.cmp_to_key(compare_stats_entry), reverse=True)
+        self.full_list = ranking.top_n(self.full_list, stats_entry_key)
         cumul50 = 50*self.total/100
         cumul90 = 90*self.total/100
         cumul = 0.0
@@ -5,6 +5,25 @@
 # The strategy is to pick at random names of small and large files, get the data, and add it
 # to the result file. Running the program in the background will eventually accumulate enough
 # data to do meaning ful statistics.
+#
+# Each bucket of lookups writes its results in a partial file as they
+# arrive, and checkpoints it regularly: the file is synced to disk and a
+# progress marker records how much of it is complete. If a run is
+# interrupted, running again with the same tmp_prefix and the argument
+# "resume" merges the partial files in the result file, and looks up the
+# targets of the interrupted run that are not yet in the result file. A
+# run file records the result file and the number of buckets of the run;
+# it is removed with the partial files once all the buckets are merged, so
+# there is nothing to resume after a complete run, and the partial files
+# of a run are never merged in another result file. The
+# domains already found are read from the column store of the result
+# file, which is only updated with the lines added since the last run.
+#
+# The names that remain to be picked from the million list and the zone
+# sample are kept in a state file next to the result file, see
+# million_random.million_sampler. The next run loads that state and only
+# removes the names found since, unless the million list or the zone
+# sample changed.
 
 import sys
 import dns.resolver
@@ -13,29 +32,228 @@ import traceback
 import pubsuffix
 import ip2as
 import dnslook
+import dnslook_async
+import dnslook_store
+import zonecut_cache
 import random
 import million_random
 import time
-import concurrent.futures
+import parallel_buckets
 import os
+import re
+import glob
+
+# Number of results between two checkpoints of a bucket.
+CHECKPOINT_EVERY = 1000
+MARKER_SUFFIX = ".ckpt"
+RUN_SUFFIX = "_run.txt"
+TARGETS_SUFFIX = "_targets.txt"
+ZONE_CACHE_SUFFIX = "_zone_cache.db"
+# Suffix of the state of the target sampler, appended to the result file name.
+SAMPLER_STATE_SUFFIX = ".sampler.json"
+
+def write_marker(marker_name, nb_bytes, nb_lines, done):
+    # The progress marker holds the number of bytes and lines of the
+    # partial file that are safely on disk, and "done" once the bucket is
+    # complete. It is replaced atomically.
+    with open(marker_name + ".tmp", "wt") as f:
+        f.write(str(nb_bytes) + "," + str(nb_lines) + "," + ("done" if done else "running") + "\n")
+    os.replace(marker_name + ".tmp", marker_name)
+
+def read_marker(marker_name):
+    # Returns (nb_bytes, nb_lines, done), or None if there is no marker.
+    try:
+        parts = open(marker_name, "rt").read().strip().split(",")
+        return int(parts[0]), int(parts[1]), parts[2] == "done"
+    except Exception:
+        return None
+
+class checkpoint_writer:
+    # Writes the results of a bucket as they arrive. Every "every"
+    # results, and at the end, the file is flushed and synced to disk, and
+    # the progress marker is updated, so that an interrupted run loses at
+    # most "every" results. With every=0, there is no marker.
+    def __init__(self, file_name, every=CHECKPOINT_EVERY):
+        self.f = open(file_name, "wt", encoding="utf-8")
+        self.marker_name = file_name + MARKER_SUFFIX
+        self.every = every
+        self.nb_lines = 0
+        self.nb_pending = 0
+
+    def write(self, js_line):
+        self.f.write(js_line + "\n")
+        self.nb_lines += 1
+        self.nb_pending += 1
+        if self.every > 0 and self.nb_pending >= self.every:
+            self.checkpoint(False)
+
+    def checkpoint(self, done):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        write_marker(self.marker_name, self.f.tell(), self.nb_lines, done)
+        self.nb_pending = 0
+
+    def close(self):
+        if self.every > 0:
+            self.checkpoint(True)
+        self.f.close()
 
-def load_names(result_file, targets, ps, i2a, i2a6, stats): 
-    with open(result_file, "wt") as f_out:
-        for target in targets:
-            try:
-                d = dnslook.dnslook()
-                # Get the name servers, etc. 
-                d.get_domain_data(target.domain, ps, i2a, i2a6, stats, rank=target.million_rank, rng=target.million_range)
-                # Write the json line in the result file.
-                f_out.write(d.to_json() + "\n")
-            except Exception as e:
-                traceback.print_exc()
-                print("Cannot assess domain <" + target.domain  + ">\nException: " + str(e))
+def load_names(result_file, targets, ps, i2a, i2a6, stats, zone_cache=None, max_in_flight=500, checkpoint_every=0): 
+    # The queries run in parallel, up to max_in_flight at a time. The
+    # results are written as they complete.
+    lookups = []
+    for target in targets:
+        d = dnslook.dnslook()
+        d.domain = target.domain
+        d.million_rank = target.million_rank
+        d.million_range = target.million_range
+        lookups.append(d)
+    writer = checkpoint_writer(result_file, every=checkpoint_every)
+    def on_result(success, d):
+        if success:
+            # Write the json line in the result file.
+            writer.write(d.to_json())
+    engine = dnslook_async.dnslook_engine(max_in_flight=max_in_flight, zone_cache=zone_cache)
+    engine.get_domains_data(lookups, ps, i2a, i2a6, stats, on_result=on_result)
+    writer.close()
+
+def append_new_lines(file_name, f_out, already_found):
+    # Append to f_out the complete lines of a partial result file whose
+    # domain is not yet found. Returns the number of lines added.
+    nb_added = 0
+    for line in open(file_name, "rt", encoding="utf-8"):
+        js_line = line.strip()
+        if len(js_line) > 0:
+            if not line.endswith("\n"):
+                # torn by an interrupted write
                 break
+            domain = dnslook.extract_domain(js_line)
+            if domain is not None:
+                if not domain in already_found:
+                    already_found.add(domain)
+                    f_out.write(line)
+                    nb_added += 1
+            else:
+                print("Cannot parse result line " + line.strip())
+    return nb_added
+
+def sync_file(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+def repair_tail(result_file):
+    # Cut the incomplete line left at the end of the result file by an
+    # interrupted append. Returns the number of bytes removed.
+    try:
+        size = os.path.getsize(result_file)
+    except OSError:
+        return 0
+    with open(result_file, "r+b") as f:
+        pos = size
+        last = -1
+        while pos > 0 and last < 0:
+            start = max(0, pos - 65536)
+            f.seek(start)
+            last = f.read(pos - start).rfind(b"\n")
+            if last >= 0:
+                last += start
+            pos = start
+        f.truncate(last + 1)
+        sync_file(f)
+    return size - (last + 1)
+
+def partial_files(temp_prefix):
+    # The partial result files of the buckets, named by the bucket number.
+    name_re = re.compile(re.escape(temp_prefix) + "[0-9]+_dns_results.csv$")
+    return sorted(f for f in glob.glob(glob.escape(temp_prefix) + "*_dns_results.csv") if name_re.match(f))
+
+def merge_partials(temp_prefix, result_file, already_found):
+    # Merge the partial files left by an interrupted run in the result
+    # file, then remove them. Returns the number of lines added.
+    nb_added = 0
+    partials = partial_files(temp_prefix)
+    with open(result_file, "at", encoding="utf-8") as f_out:
+        for file_name in partials:
+            marker = read_marker(file_name + MARKER_SUFFIX)
+            nb_file = append_new_lines(file_name, f_out, already_found)
+            nb_added += nb_file
+            if marker is None:
+                state = "no checkpoint"
+            else:
+                state = str(marker[1]) + " lines checkpointed" + (", complete" if marker[2] else "")
+            print("Partial " + file_name + ": " + state + ", " + str(nb_file) + " new lines.")
+        sync_file(f_out)
+    for file_name in partials:
+        for x in [ file_name, file_name + MARKER_SUFFIX ]:
+            if os.path.isfile(x):
+                os.remove(x)
+    return nb_added
+
+def write_run_file(temp_prefix, result_file, nb_buckets):
+    with open(temp_prefix + RUN_SUFFIX + ".tmp", "wt", encoding="utf-8") as f:
+        f.write(os.path.abspath(result_file) + "\n" + str(nb_buckets) + "\n")
+    os.replace(temp_prefix + RUN_SUFFIX + ".tmp", temp_prefix + RUN_SUFFIX)
 
+def read_run_file(temp_prefix):
+    # Returns (result_file, nb_buckets) of an interrupted run, or None.
+    try:
+        lines = open(temp_prefix + RUN_SUFFIX, "rt", encoding="utf-8").read().split("\n")
+        return lines[0], int(lines[1])
+    except Exception:
+        return None
+
+def run_complete(temp_prefix, nb_buckets):
+    # True if the progress markers of all the buckets say "done".
+    for bucket_id in range(0, nb_buckets):
+        marker = read_marker(temp_prefix + str(bucket_id) + "_dns_results.csv" + MARKER_SUFFIX)
+        if marker is None or not marker[2]:
+            return False
+    return True
+
+def remove_run_files(temp_prefix):
+    # Remove the partial files, progress markers, statistics, targets,
+    # zone cut cache and run file of a run.
+    name_re = re.compile(re.escape(temp_prefix) + "[0-9]+_(dns_results|stats)\\.csv(" + re.escape(MARKER_SUFFIX) + ")?$")
+    run_files = [f for f in glob.glob(glob.escape(temp_prefix) + "*.csv*") if name_re.match(f)]
+    for file_name in run_files + [ temp_prefix + TARGETS_SUFFIX, temp_prefix + RUN_SUFFIX ]:
+        if os.path.isfile(file_name):
+            os.remove(file_name)
+    zonecut_cache.remove_db_files(temp_prefix + ZONE_CACHE_SUFFIX)
+
+def load_found_domains(result_file):
+    # List of the domains in the result file, read from the domain column
+    # of the column store, which only parses the lines added since its
+    # last update. If the store cannot be used, the domains are extracted
+    # from the result file.
+    try:
+        store = dnslook_store.open_dns_columns(result_file)
+        return store.column("domain")
+    except FileNotFoundError:
+        raise
+    except Exception as e:
+        print("Cannot use the column store of <" + result_file + ">: " + str(e))
+    domains = []
+    for line in open(result_file, "rt", encoding="utf-8"):
+        js_line = line.strip()
+        if len(js_line) > 0:
+            # Only the domain is needed, no need to parse the whole line.
+            domain = dnslook.extract_domain(js_line)
+            if domain is None:
+                raise ValueError("Cannot parse result line " + js_line)
+            domains.append(domain)
+    return domains
+
+def load_targets(target_file, already_found):
+    # Targets of a previous run that are not in the result file yet.
+    targets = []
+    for line in open(target_file, "rt", encoding="utf-8"):
+        parts = line.strip().split(",")
+        if len(parts) == 3 and not parts[0] in already_found:
+            targets.append(million_random.million_target(parts[0], int(parts[1]), int(parts[2])))
+    return targets
 
 class dns_lookup_bucket:
-    def __init__(self, bucket_id, bucket_file_name, stats_file_name, targets, ps, i2a, i2a6, stats):
+    def __init__(self, bucket_id, bucket_file_name, stats_file_name, targets, ps, i2a, i2a6, stats, zone_cache):
         self.bucket_id = bucket_id
         self.targets = targets
         self.bucket_file_name = bucket_file_name
@@ -44,24 +262,76 @@ class dns_lookup_bucket:
         self.i2a6 = i2a6
         self.stats = stats
         self.stats_file_name = stats_file_name
+        self.zone_cache = zone_cache
         self.is_complete = False
 
     def load(self):
-        load_names(self.bucket_file_name, self.targets, self.ps, self.i2a, self.i2a6, self.stats)
+        load_names(self.bucket_file_name, self.targets, self.ps, self.i2a, self.i2a6, self.stats, zone_cache=self.zone_cache, \
+            checkpoint_every=CHECKPOINT_EVERY)
         sys.stdout.flush()
         with open(self.stats_file_name,"wt") as f_stats:
             for stat in self.stats:
                 f_stats.write(str(stat) + "\n")
 
+    def merge_into(self, f_out, already_found, stats):
+        # load the domain names from the partial result files
+        # we take care to not add duplicates
+        append_new_lines(self.bucket_file_name, f_out, already_found)
+        sync_file(f_out)
+        stats_index = 0
+        for line in open(self.stats_file_name, "rt"):
+            st = float(line.strip())
+            stats[stats_index] += st
+            stats_index += 1
+            if stats_index >= len(stats):
+                break
+
 def load_dns_look_up_bucket(bucket):
     bucket.load()
 
 
+def pick_targets(state_file, million_file, com_sample, already_found, nb_trials, start_time):
+    # Load the names that remain from the state of the previous run, or
+    # from the million file and the zone sample file, then remove the
+    # names already found.
+    mr = million_random.million_sampler(100, 10)
+    if mr.load_state(state_file, [ million_file, com_sample ], len(already_found)):
+        print("Loaded sampler state from " + state_file)
+    else:
+        mr.load(million_file)
+        mr.load_zone_sample(com_sample)
+    for domain in already_found:
+        mr.mark_read(domain)
+    mr.save_state(state_file, len(already_found))
+    # Show the state of the random loader
+    for a in range(0, len(mr.range_ids)):
+        print("Range " + str(a) + ", " + str(len(mr.range_ids[a])) + " names")
+    # Once everything is ready, start getting the requested number of new names
+    # The names are picked at random from five zones in the million names list
+    # as encoded in the "million_sampler" class. The picked names are
+    # removed from the sampler, but not from the saved state, so names
+    # that are not found in this run can be picked again by the next one.
+    pick_start = time.time()
+    print("Ready after " + str(pick_start - start_time))
+    targets = []
+    while len(targets) < nb_trials:
+        target = mr.random_pick()
+        if target.domain == "":
+            print("Error. All ranges empty after " + str(len(targets) + 1) + " trials, but loop did not stop.")
+            break
+        targets.append(target)
+        if mr.nb_names() == 0:
+            # no other empty range
+            print("All ranges empty after " + str(len(targets) + 1) + " trials.")
+            break
+    return targets
+
 # Main
 def main():
     start_time = time.time()
-    if len(sys.argv) != 8 and len(sys.argv) != 9:
-        print("Usage: " + sys.argv[0] + " nb_trials ip2as.csv ip2as6.csv publicsuffix.dat million_domain_list com_sample result_file [tmp_prefix]")
+    if len(sys.argv) < 8 or len(sys.argv) > 10 or (len(sys.argv) == 10 and sys.argv[9] != "resume"):
+        print("Usage: " + sys.argv[0] + " nb_trials ip2as.csv ip2as6.csv publicsuffix.dat million_domain_list com_sample result_file [tmp_prefix [resume]]")
+        print("With \"resume\", the partial results of an interrupted run are merged, and its remaining targets are looked up.")
         exit(1)
     nb_trials = int(sys.argv[1])
     ip2as_file = sys.argv[2]
@@ -70,10 +340,11 @@ def main():
     million_file = sys.argv[5]
     com_sample = sys.argv[6]
     result_file = sys.argv[7]
-    if len(sys.argv) == 9:
+    if len(sys.argv) >= 9:
         temp_prefix = sys.argv[8]
     else:
         temp_prefix = ""
+    resume = len(sys.argv) == 10
 
     ps = pubsuffix.public_suffix()
     if not ps.load_file(public_suffix_file):
@@ -83,25 +354,19 @@ def main():
     i2a = ip2as.load_ip2as(ip2as_file)
     i2a6 = ip2as.load_ip2as(ip2as6_file)
 
-    mr = million_random.million_random(100, 10)
     already_found = set()
     duplicates_found = 0
+    # An interrupted append may have left an incomplete line.
+    nb_cut = repair_tail(result_file)
+    if nb_cut > 0:
+        print("Removed " + str(nb_cut) + " bytes of incomplete line at the end of " + result_file)
     # Read the names already in the result file, remove them from consideration.
     try:
-        for line in open(result_file, "rt", encoding="utf-8"):
-            js_line = line.strip()
-            if len(js_line) > 0:
-                w = dnslook.dnslook()
-                if w.from_json(js_line):
-                    if not w.domain in already_found:
-                        already_found.add(w.domain)
-                        mr.set_already_processed(w.domain)
-                    else:
-                        duplicates_found += 1
-                else:
-                    print("Cannot parse result line " + line.strip())
-                    print("Closing " + result_file + " and exiting.")
-                    exit(1)
+        for domain in load_found_domains(result_file):
+            if not domain in already_found:
+                already_found.add(domain)
+            else:
+                duplicates_found += 1
     except FileNotFoundError:
         # doesn't exist
         print("File " + result_file + " will be created.")
@@ -110,137 +375,96 @@ def main():
         print("Cannot load file <" + result_file  + ">\nException: " + str(e))
         print("Giving up");
         exit(1)
-    print("Loaded " + str(len(mr.already_processed)) + " names, " + str(duplicates_found) + " duplicates.")
-
+    print("Loaded " + str(len(already_found)) + " names, " + str(duplicates_found) + " duplicates.")
 
-    # Load the million file. The loading process will not load the names 
-    # marked as already processed in the previous loop.
-    mr.load(million_file)
-    # Add the names from the zone sample file
-    mr.load_zone_sample(com_sample)
-    # Show the state of the random loader
-    for a in range(0, len(mr.range_names)):
-        print("Range " + str(a) + ", " + str(len(mr.range_names[a])) + " names")
-    # Once everything is ready, start getting the requested number of new names
-    # The names are picked at random from five zones in the million names list
-    # as encoded in the "million_random" class
-    pick_start = time.time()
-    print("Ready after " + str(pick_start - start_time))
     stat_name = ["a", "aaaa", "ns", "algo", "cname", "server", "asn"]
+    # stats[7] and stats[8] count the hits and lookups in the zone cut cache.
     stats = []
-    for x in range(0,7):
+    for x in range(0,9):
         stats.append(0)
-    targets = []
-    while len(targets) < nb_trials:
-        target = mr.random_pick()
-        if target.domain == "":
-            if mr.nb_names() == 0:
-                # no other empty range
-                print("Error. All ranges empty after " + str(len(targets) + 1) + " trials, but loop did not stop.")
-                break
-            else:
-                target =  mr.random_pick()
-                if x.domain == "":
-                    print("Error. Range " + str(mr.random_range) + " is empty, yet was picked.")
-                    break
+    targets = None
+    if resume:
+        # Keep the results of the interrupted run, and only look up the
+        # targets that it did not complete.
+        run = read_run_file(temp_prefix)
+        if run is None:
+            print("No interrupted run for " + temp_prefix + ", picking new targets.")
+        elif run[0] != os.path.abspath(result_file):
+            print("The partial files of " + temp_prefix + " were made for " + run[0] + ", discarding them.")
         else:
-            targets.append(target)
-            mr.mark_read(target)
-        if mr.nb_names() == 0:
-            # no other empty range
-            print("All ranges empty after " + str(len(targets) + 1) + " trials.")
-            break
-    nb_assessed = len(targets)
-
+            is_complete = run_complete(temp_prefix, run[1])
+            nb_merged = merge_partials(temp_prefix, result_file, already_found)
+            print("Merged " + str(nb_merged) + " results from partial files.")
+            target_file = temp_prefix + TARGETS_SUFFIX
+            if is_complete:
+                print("All the buckets of the previous run are done, picking new targets.")
+            elif os.path.isfile(target_file):
+                targets = load_targets(target_file, already_found)
+                print("Resuming with " + str(len(targets)) + " targets not yet found.")
+            else:
+                print("No target file " + target_file + ", picking new targets.")
+    if temp_prefix != "":
+        # The files of a previous run are merged, or belong to another run.
+        if not resume and read_run_file(temp_prefix) is not None:
+            print("Discarding the files of an interrupted run, use \"resume\" to merge them.")
+        remove_run_files(temp_prefix)
+    if targets is None:
+        targets = pick_targets(result_file + SAMPLER_STATE_SUFFIX, million_file, com_sample, already_found, nb_trials, start_time)
     if temp_prefix != "":
-        target_file = temp_prefix + "_targets.txt"
-        with open(target_file, "wt") as tf:
+        with open(temp_prefix + TARGETS_SUFFIX, "wt") as tf:
             for target in targets:
                 tf.write(target.domain + "," + str(target.million_rank) + "," + str(target.million_range) + "\n");
+    nb_assessed = len(targets)
 
     # Once the required number of targets has been selected, prepare parallel threads
     ready_time = time.time()
     if temp_prefix == "":
-        load_names(result_file, targets, ps, i2a, i2a6, stats)
+        load_names(result_file, targets, ps, i2a, i2a6, stats, zone_cache=zonecut_cache.zone_cut_cache())
         done_time = time.time()
         print("\nQueries took " + str(done_time - ready_time))
     else:
         nb_process = os.cpu_count()
-        target_count_per_bucket = []
-        targets_left = len(targets)
-        # split the target with units per processor
-        for bucket_id in range(0,nb_process):
-            buckets_left = nb_process - bucket_id
-            if buckets_left == 1:
-                nb_this_bucket = targets_left
-            else:
-                nb_this_bucket = int(targets_left/buckets_left)
-                if nb_this_bucket == 0:
-                    nb_this_bucket = 1
-            target_count_per_bucket.append(nb_this_bucket)
-            targets_left -= nb_this_bucket
-            if targets_left <= 0:
-                break
-        print("Targets: " +str(nb_assessed) + ", buckets: " + str(len(target_count_per_bucket)) + " (" + str(target_count_per_bucket[0]) + "..." + str(target_count_per_bucket[-1]) + ")")
+        # split the targets in several batches per processor, each large
+        # enough to keep the queries of the lookup engine in flight.
+        nb_tasks = parallel_buckets.nb_tasks_for(len(targets), nb_process, min_items_per_task=500)
+        target_lists = parallel_buckets.split_list(targets, nb_tasks)
+        print("Targets: " +str(nb_assessed) + ", buckets: " + str(len(target_lists)) + " (" + str(len(target_lists[0])) + "..." + str(len(target_lists[-1])) + ")")
+        # The zone cut cache is shared by the buckets through an SQLite file.
+        zone_cache = zonecut_cache.zone_cut_cache(temp_prefix + ZONE_CACHE_SUFFIX)
         bucket_list = []
-        last_target = 0
-        for bucket_id in range(0,len(target_count_per_bucket)):
+        for bucket_id in range(0,len(target_lists)):
             temp_name = temp_prefix + str(bucket_id) + "_dns_results.csv"
             temp_stats =  temp_prefix + str(bucket_id) + "_stats.csv"
-            old_target = last_target
-            last_target += target_count_per_bucket[bucket_id]
-            bucket_target = targets[old_target:last_target]
-            this_bucket = dns_lookup_bucket(bucket_id, temp_name, temp_stats, bucket_target, ps, i2a, i2a6, stats)
+            # each bucket counts its own statistics, which are added to
+            # "stats" when the bucket is merged.
+            this_bucket = dns_lookup_bucket(bucket_id, temp_name, temp_stats, target_lists[bucket_id], ps, i2a, i2a6, [0]*len(stats), zone_cache)
             bucket_list.append(this_bucket)
-        # run multiple parsing in parallel
-        with concurrent.futures.ProcessPoolExecutor(max_workers = nb_process) as executor:
-            future_to_bucket = {executor.submit(load_dns_look_up_bucket, bucket):bucket for bucket in bucket_list }
-            for future in concurrent.futures.as_completed(future_to_bucket):
-                bucket = future_to_bucket[future]
-                try:
-                    data = future.result()
-                    bucket.is_complete = True
-                    sys.stdout.write(".")
-                    sys.stdout.flush()
-                except Exception as exc:
-                    traceback.print_exc()
-                    print('\nBucket %d generated an exception: %s' % (bucket.bucket_id, exc))
-
-        bucket_time = time.time()
-        print("\nThreads took " + str(bucket_time - ready_time))
-        # aggregate the results
+        write_run_file(temp_prefix, result_file, len(bucket_list))
+        # run the lookups in parallel, and append the results of each bucket
+        # to the result file as soon as it completes.
         with open(result_file, "at") as f_out:
-            for bucket in bucket_list:
-                if not bucket.is_complete:
-                    continue
-                b_duplicates_added = 0
-                b_domains_added = 0
-                # load the domain names from the partial result files
-                # we take care to not add duplicates
-                for line in open(bucket.bucket_file_name, "rt"):
-                    js_line = line.strip()
-                    if len(js_line) > 0:
-                        w = dnslook.dnslook()
-                        if w.from_json(js_line):
-                            if not w.domain in already_found:
-                                already_found.add(w.domain)
-                                f_out.write(line);
-                        else:
-                            print("Cannot parse result line " + line.strip())
-                            continue
-                stats_index = 0
-                for line in open(bucket.stats_file_name, "rt"):
-                    st = float(line.strip())
-                    stats[stats_index] += st
-                    stats_index += 1
-                    if stats_index >= len(stats):
-                        break
+            completed = parallel_buckets.run_tasks(bucket_list, nb_process, \
+                merge=lambda bucket: bucket.merge_into(f_out, already_found, stats), run=load_dns_look_up_bucket)
+        zone_cache.close()
+        if len(completed) == len(bucket_list):
+            remove_run_files(temp_prefix)
+        else:
+            print(str(len(bucket_list) - len(completed)) + " buckets failed, run again with \"resume\" to complete them.")
         done_time = time.time()
-        print("\nSummary took " + str(done_time - bucket_time))
+        print("\nThreads and summary took " + str(done_time - ready_time))
 
+    # Append the new results to the column store of the result file.
+    try:
+        store = dnslook_store.open_dns_columns(result_file)
+        print("Column store has " + str(store.nb_rows) + " rows.")
+    except Exception as e:
+        traceback.print_exc()
+        print("Cannot update the column store of <" + result_file + ">\nException: " + str(e))
     print("Assessed " + str(nb_assessed) + " domains in " + str(done_time - start_time))
     for x in range(0,7):
-        print("Time " + stat_name[x] + ": " + str(stats[x]/nb_assessed))
+        print("Time " + stat_name[x] + ": " + str(stats[x]/max(1, nb_assessed)))
+    if stats[8] > 0:
+        print("Zone cache: " + str(int(stats[7])) + " hits in " + str(int(stats[8])) + " lookups, " + str(stats[7]/stats[8]))
 
 # actual main program, can be called by threads, etc.
 if __name__ == '__main__':
@@ -0,0 +1,137 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Unit test of the checkpoints and of the resume mode of do_dnslookup.
+#
+# The lines of a JSON result file are split between a result file, which
+# ends with an incomplete line, and the partial files of two buckets, as
+# an interrupted run would leave them. One bucket file is written with a
+# checkpoint writer, and its progress marker must count its lines; the
+# other one repeats some domains and ends with a torn line. After cutting
+# the result file and merging the partial files, the result file must hold
+# each domain once, the partial files must be removed, and the targets
+# left to look up must be those not found. The run file must tell whether
+# all the buckets of a run are done, and removing the files of a run must
+# leave no partial file, marker, statistics, targets or run file.
+#
+# Expect this test to work:
+#
+# py .\do_dnslookup_test.py ..\data\dnslook_test.json ..\tmp\
+
+import sys
+import os
+import shutil
+import dnslook
+import dnslook_store
+import do_dnslookup
+import zonecut_cache
+
+def main():
+    if len(sys.argv) != 3:
+        print("Usage: " + sys.argv[0] + " dns_json tmp_dir")
+        exit(1)
+    temp_prefix = os.path.join(sys.argv[2], "do_dnslookup_test_")
+    result_file = temp_prefix + "results.json"
+    if os.path.isdir(result_file + dnslook_store.COLUMN_SUFFIX):
+        shutil.rmtree(result_file + dnslook_store.COLUMN_SUFFIX)
+    ret = True
+
+    lines = [line.strip() for line in open(sys.argv[1], "rt", encoding="utf-8") if len(line.strip()) > 0]
+    domains = []
+    for line in lines:
+        domain = dnslook.extract_domain(line)
+        if not domain in domains:
+            domains.append(domain)
+    n = len(lines)//3
+
+    with open(result_file, "wt", encoding="utf-8") as f:
+        for line in lines[:n]:
+            f.write(line + "\n")
+        f.write(lines[n][:len(lines[n])//2])
+    writer = do_dnslookup.checkpoint_writer(temp_prefix + "0_dns_results.csv", every=7)
+    for line in lines[n:2*n]:
+        writer.write(line)
+    marker = do_dnslookup.read_marker(writer.marker_name)
+    if marker is None or marker[1] != 7*(n//7) or marker[2]:
+        print("After " + str(n) + " lines, marker is " + str(marker))
+        ret = False
+    writer.close()
+    marker = do_dnslookup.read_marker(writer.marker_name)
+    if marker is None or marker[:2] != (os.path.getsize(temp_prefix + "0_dns_results.csv"), n) or not marker[2]:
+        print("At the end, marker is " + str(marker))
+        ret = False
+    with open(temp_prefix + "1_dns_results.csv", "wt", encoding="utf-8") as f:
+        for line in lines[n-5:2*n + 5]:
+            f.write(line + "\n")
+        f.write(lines[-1][:10])
+
+    nb_cut = do_dnslookup.repair_tail(result_file)
+    if nb_cut != len(lines[n])//2:
+        print("Removed " + str(nb_cut) + " bytes instead of " + str(len(lines[n])//2))
+        ret = False
+    already_found = set(do_dnslookup.load_found_domains(result_file))
+    nb_merged = do_dnslookup.merge_partials(temp_prefix, result_file, already_found)
+    expected = domains[:len(set(dnslook.extract_domain(line) for line in lines[:2*n + 5]))]
+    found = [dnslook.extract_domain(line.strip()) for line in open(result_file, "rt", encoding="utf-8")]
+    if found != expected or nb_merged != len(found) - len(set(dnslook.extract_domain(line) for line in lines[:n])):
+        print("Result file has " + str(len(found)) + " lines, " + str(len(set(found))) + " domains, expected " + str(len(expected)) + ", merged " + str(nb_merged))
+        ret = False
+    if len(do_dnslookup.partial_files(temp_prefix)) > 0 or os.path.isfile(writer.marker_name):
+        print("Partial files not removed: " + str(do_dnslookup.partial_files(temp_prefix)))
+        ret = False
+    if sorted(do_dnslookup.load_found_domains(result_file)) != sorted(found):
+        print("Domain index does not match the result file.")
+        ret = False
+
+    do_dnslookup.write_run_file(temp_prefix, result_file, 2)
+    run = do_dnslookup.read_run_file(temp_prefix)
+    if run != (os.path.abspath(result_file), 2):
+        print("Run file gives " + str(run))
+        ret = False
+    writer = do_dnslookup.checkpoint_writer(temp_prefix + "0_dns_results.csv", every=7)
+    writer.write(lines[0])
+    writer.close()
+    if do_dnslookup.run_complete(temp_prefix, 2):
+        print("Run is complete with a missing bucket.")
+        ret = False
+    writer = do_dnslookup.checkpoint_writer(temp_prefix + "1_dns_results.csv", every=7)
+    writer.write(lines[1])
+    if do_dnslookup.run_complete(temp_prefix, 2):
+        print("Run is complete with a running bucket.")
+        ret = False
+    writer.close()
+    if not do_dnslookup.run_complete(temp_prefix, 2):
+        print("Run is not complete with all buckets done.")
+        ret = False
+    with open(temp_prefix + "0_stats.csv", "wt") as f:
+        f.write("0\n")
+    with open(temp_prefix + do_dnslookup.TARGETS_SUFFIX, "wt") as f:
+        f.write(domains[0] + ",0,0\n")
+    zone_cache = zonecut_cache.zone_cut_cache(temp_prefix + do_dnslookup.ZONE_CACHE_SUFFIX)
+    zone_cache.put("example.com.", "NS", zonecut_cache.NO_ANSWER, [])
+    zone_cache.close()
+    do_dnslookup.remove_run_files(temp_prefix)
+    left = [f for f in [ temp_prefix + "0_dns_results.csv", temp_prefix + "0_dns_results.csv" + do_dnslookup.MARKER_SUFFIX, \
+        temp_prefix + "1_dns_results.csv", temp_prefix + "0_stats.csv", temp_prefix + do_dnslookup.TARGETS_SUFFIX, \
+        temp_prefix + do_dnslookup.RUN_SUFFIX, temp_prefix + do_dnslookup.ZONE_CACHE_SUFFIX, \
+        temp_prefix + do_dnslookup.ZONE_CACHE_SUFFIX + "-wal", temp_prefix + do_dnslookup.ZONE_CACHE_SUFFIX + "-shm" ] if os.path.isfile(f)]
+    if len(left) > 0:
+        print("Run files not removed: " + str(left))
+        ret = False
+
+    target_file = temp_prefix + "targets.txt"
+    with open(target_file, "wt", encoding="utf-8") as f:
+        for i, domain in enumerate(domains):
+            f.write(domain + "," + str(i) + "," + str(i%5) + "\n")
+    targets = do_dnslookup.load_targets(target_file, set(found))
+    if [t.domain for t in targets] != domains[len(found):] or (len(targets) > 0 and targets[0].million_rank != len(found)):
+        print("Found " + str(len(targets)) + " targets instead of " + str(len(domains) - len(found)))
+        ret = False
+
+    if not ret:
+        exit(1)
+    print("Merged " + str(nb_merged) + " lines, " + str(len(targets)) + " targets left.")
+    exit(0)
+
+if __name__ == '__main__':
+    main()
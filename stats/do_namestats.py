@@ -4,20 +4,40 @@
 # Extract name statistics from a set of files.
 # Since the number of files to merge can be quite large, we spread the processing
 # on all available cores.
+#
+# By default, each bucket saves the details of all the suffixes that it
+# sees, and the main process merges them and saves the top suffixes. With the option "-shuffle", the
+# buckets instead write the suffix contributions of the names in one
+# partition file per process, chosen by a hash of the suffix. Once all
+# buckets are merged, one reducer task per partition loads the
+# contributions to its slice of the suffix space, and the suffix file is
+# the union of the reducer results. Each process then only holds the
+# details of a fraction of the suffixes.
+#
+# With the option "-bounded", the suffix lists of the buckets, or of the
+# reducers, keep at most BOUNDED_SUFFIXES suffixes, the most frequent
+# ones, see suffixes.suffix_details_file. The memory used by each process
+# then does not depend on the number of random suffixes in the traffic.
 
 
 import sys
 import namestats
 import traceback
 import time
-import concurrent.futures
+import parallel_buckets
+import suffixes
 import os
 
 dga_subnet_list = [
     ]
 
+# Ten times the number of suffixes saved in a suffix file.
+BOUNDED_SUFFIXES = 100000
+
 def usage(argv_0):
-    print("Usage:\n" + argv_0 + " result_file suffix_file temp dga_subnets name_file*")
+    print("Usage:\n" + argv_0 + " [-shuffle] [-bounded] result_file suffix_file temp dga_subnets name_file*")
+    print("    -shuffle:     partition the suffixes by hash between reducer processes.")
+    print("    -bounded:     only keep the " + str(BOUNDED_SUFFIXES) + " most frequent suffixes in each process.")
     print("    result_file:  file in which results will be collected.")
     print("    suffix_file:  file in which suffixes are collected.")
     print("    temp:         prefix for temporary files (or \"-\" if only 1 process).")
@@ -25,17 +45,27 @@ def usage(argv_0):
     print("    name_file*:   at least one file containing name lists.")
 
 class name_bucket:
-    def __init__(self, bucket_id, result_file_name, suffix_file_name, dga_subnets, input_files):
+    def __init__(self, bucket_id, result_file_name, suffix_file_name, dga_subnets, input_files, input_chunk=None, partition_files=None, max_suffixes=0, partial=False):
+        # A partial bucket saves all its suffixes, because they are merged
+        # with those of the other buckets before the final file is cut.
         self.bucket_id = bucket_id
+        self.partial = partial
         self.input_files = input_files
+        self.input_chunk = input_chunk
         self.result_file_name = result_file_name
         self.suffix_file_name = suffix_file_name
-        self.stats = namestats.namestats(dga_subnets)
+        self.stats = namestats.namestats(dga_subnets, max_suffixes=max_suffixes)
+        self.partitioned = partition_files is not None
+        if self.partitioned:
+            self.stats.partition_suffixes(partition_files)
 
     def load(self):
         try:
-            for input_file in self.input_files:
-                self.stats.load_logfile(input_file)
+            if self.input_chunk is not None:
+                self.stats.load_logchunk(self.input_chunk)
+            else:
+                for input_file in self.input_files:
+                    self.stats.load_logfile(input_file)
         except:
             traceback.print_exc()
             print("Abandon bucket " + str(self.bucket_id))
@@ -43,23 +73,125 @@ class name_bucket:
 
     def save(self):
         self.stats.export_result_file(self.result_file_name)
-        self.stats.export_suffix_file(self.suffix_file_name)
+        if self.partitioned:
+            self.stats.suffixes.close()
+        elif self.partial:
+            self.stats.export_suffix_file(self.suffix_file_name, nb_top=0)
+        else:
+            self.stats.export_suffix_file(self.suffix_file_name)
+
+    def merge_into(self, stats, merged_ids=None):
+        stats.import_result_file(self.result_file_name)
+        if not self.partitioned:
+            stats.import_suffix_file(self.suffix_file_name)
+        if merged_ids is not None:
+            merged_ids.append(self.bucket_id)
+        # the chunk was only needed by the worker
+        self.input_chunk = None
+
+class suffix_reducer:
+    # Loads the contributions of all the buckets to one partition of the
+    # suffixes, and saves the details of the suffixes of that partition.
+    def __init__(self, bucket_id, partition_files, suffix_file_name, max_suffixes=0):
+        self.bucket_id = bucket_id
+        self.partition_files = partition_files
+        self.suffix_file_name = suffix_file_name
+        self.max_suffixes = max_suffixes
+        self.suffixes = None
+
+    def load(self):
+        self.suffixes = suffixes.suffix_details_file(namestats.HLL_K, namestats.MAX_SUFFIX_PARTS, max_entries=self.max_suffixes, \
+            batch_size=namestats.SUBNAME_BATCH)
+        for file_name in self.partition_files:
+            if os.path.isfile(file_name):
+                self.suffixes.load_contributions(file_name)
+
+    def save(self):
+        self.suffixes.save(self.suffix_file_name)
+        for file_name in self.partition_files:
+            if os.path.isfile(file_name):
+                os.remove(file_name)
+
+    def merge_into(self, suffix_details):
+        # The partitions are disjoint, the suffixes are just added. The
+        # file of the partition is not needed once parsed.
+        suffix_details.parse(self.suffix_file_name)
+        os.remove(self.suffix_file_name)
+
+def partition_file_names(temp_prefix, bucket_id, nb_partitions):
+    return [ temp_prefix + str(bucket_id) + "_part" + str(p) + ".csv" for p in range(0, nb_partitions) ]
+
+def new_name_bucket(temp_prefix, bucket_id, dga_subnets, input_files, input_chunk, nb_partitions, max_suffixes):
+    temp_name = temp_prefix + str(bucket_id) + "_res.csv"
+    temp_suffix = temp_prefix + str(bucket_id) + "_sfx.csv"
+    partition_files = None
+    if nb_partitions > 0:
+        partition_files = partition_file_names(temp_prefix, bucket_id, nb_partitions)
+    return name_bucket(bucket_id, temp_name, temp_suffix, dga_subnets, input_files, input_chunk=input_chunk, \
+        partition_files=partition_files, max_suffixes=max_suffixes, partial=True)
+
+def name_buckets(temp_prefix, dga_subnets, files, nb_process, nb_partitions=0, max_suffixes=0, chunk_size=parallel_buckets.CHUNK_SIZE):
+    # Generator of buckets: groups of files of similar sizes, several per
+    # process, then chunks of the files larger than the share of one
+    # process, which are read and decompressed as the workers need them.
+    # If nb_partitions > 0, the buckets write partitioned suffix
+    # contributions. If max_suffixes > 0, the suffix lists are bounded.
+    large, small = parallel_buckets.large_files(files, nb_process)
+    bucket_id = 0
+    for this_bucket_files in parallel_buckets.group_files(small, nb_process*parallel_buckets.TASKS_PER_PROCESS):
+        bucket_id += 1
+        yield new_name_bucket(temp_prefix, bucket_id, dga_subnets, this_bucket_files, None, nb_partitions, max_suffixes)
+    for file_name in large:
+        for chunk in parallel_buckets.line_chunks(file_name, chunk_size=chunk_size):
+            bucket_id += 1
+            yield new_name_bucket(temp_prefix, bucket_id, dga_subnets, [ file_name ], chunk, nb_partitions, max_suffixes)
 
-def load_name_bucket(bucket):
-    bucket.load()
-    bucket.save()
+def shuffle_stats(result_file, suffix_file_name, temp_prefix, dga_subnets, files, nb_process, max_suffixes=0):
+    # The main process only merges the category counts and the DGA
+    # candidates. The suffixes added by final_dga go to the partitions of
+    # bucket 0, then each partition is reduced by one task.
+    nb_partitions = nb_process
+    stats = namestats.namestats(dga_subnets)
+    stats.partition_suffixes(partition_file_names(temp_prefix, 0, nb_partitions))
+    merged_ids = [ 0 ]
+    completed = parallel_buckets.run_tasks(name_buckets(temp_prefix, dga_subnets, files, nb_process, nb_partitions), nb_process, \
+        merge=lambda bucket: bucket.merge_into(stats, merged_ids))
+    stats.final_dga()
+    stats.suffixes.close()
+    stats.export_result_file(result_file)
+    reducers = []
+    for p in range(0, nb_partitions):
+        partition_files = [ partition_file_names(temp_prefix, bucket_id, nb_partitions)[p] for bucket_id in merged_ids ]
+        reducers.append(suffix_reducer(p, partition_files, temp_prefix + "r" + str(p) + "_sfx.csv", max_suffixes=max_suffixes))
+    suffix_details = suffixes.suffix_details_file(namestats.HLL_K, namestats.MAX_SUFFIX_PARTS)
+    reduced = parallel_buckets.run_tasks(reducers, nb_process, merge=lambda reducer: reducer.merge_into(suffix_details))
+    if len(reduced) != len(reducers):
+        print("\nOnly " + str(len(reduced)) + " partitions of suffixes out of " + str(len(reducers)) + " were reduced.")
+    suffix_details.save(suffix_file_name)
+    return completed
 
 # main loop
 def main():
-    if len(sys.argv) < 6:
-        usage(sys.argv[0])
+    argv = sys.argv[0:1]
+    options = []
+    for arg in sys.argv[1:]:
+        if len(argv) == 1 and arg in [ "-shuffle", "-bounded" ]:
+            options.append(arg)
+        else:
+            argv.append(arg)
+    shuffle = "-shuffle" in options
+    max_suffixes = 0
+    if "-bounded" in options:
+        max_suffixes = BOUNDED_SUFFIXES
+    if len(argv) < 6:
+        usage(argv[0])
         exit(1)
-    result_file = sys.argv[1]
-    suffix_file_name = sys.argv[2]
-    temp_prefix = sys.argv[3]
-    dga_subnets_file = sys.argv[4]
+    result_file = argv[1]
+    suffix_file_name = argv[2]
+    temp_prefix = argv[3]
+    dga_subnets_file = argv[4]
     nb_process = os.cpu_count()
-    files = sys.argv[5:len(sys.argv)]
+    files = argv[5:len(argv)]
     nb_files = len(files)
 
     if dga_subnets_file != "-":
@@ -67,67 +199,30 @@ def main():
     else:
         dga_subnets = dict()
 
-    bucket_list = []
     print("Aiming for " + str(nb_process) + " processes")
-
-    # prepare a set of sublists and result names for each process.
-    process_left = nb_process
     if temp_prefix == "-":
-        process_left = 1
-    elif nb_process < nb_files and 2*nb_process > nb_files:
-        process_left = int((nb_files+1)/2)
-    if process_left != nb_process:
-        print("Using at most " + str(process_left) + " processes.")
-    files_left = nb_files
-    bucket_id = 0
-    while files_left > 0:
-        nb_file_this_process = int(files_left / process_left)
-        if nb_file_this_process == 0:
-            nb_file_this_process = 1
-        this_bucket_files = files[files_left - nb_file_this_process : files_left]
-        bucket_id += 1
-        temp_name = temp_prefix + str(bucket_id) + "_res.csv"
-        temp_suffix = temp_prefix + str(bucket_id) + "_sfx.csv"
-        this_bucket = name_bucket(bucket_id, temp_name, temp_suffix, dga_subnets, this_bucket_files)
-        bucket_list.append(this_bucket)
-        files_left -= nb_file_this_process
-        process_left -= 1
-
-    nb_process = min(nb_process, len(bucket_list))
-    print("Will use " + str(nb_process) + " processes, " + str(len(bucket_list)) + " buckets")
+        nb_process = 1
     
     start_time = time.time()
-    if len(bucket_list) > 1:
-        with concurrent.futures.ProcessPoolExecutor(max_workers = nb_process) as executor:
-            future_to_bucket = {executor.submit(load_name_bucket, bucket):bucket for bucket in bucket_list }
-            for future in concurrent.futures.as_completed(future_to_bucket):
-                bucket = future_to_bucket[future]
-                try:
-                    data = future.result()
-                    sys.stdout.write(".")
-                    sys.stdout.flush()
-                except Exception as exc:
-                    traceback.print_exc()
-                    print('\nBucket %d generated an exception: %s' % (bucket.bucket_id, exc))
-        bucket_time = time.time()
-        print("\nThreads took " + str(bucket_time - start_time))
+    if nb_process > 1 and shuffle:
+        completed = shuffle_stats(result_file, suffix_file_name, temp_prefix, dga_subnets, files, nb_process, max_suffixes=max_suffixes)
+        print("\nShuffled and reduced " + str(len(completed)) + " buckets in " + str(time.time() - start_time))
+    elif nb_process > 1:
+        # the buckets are prepared as the workers need them, and the
+        # results of each bucket are merged as soon as it completes
         stats = namestats.namestats(dga_subnets)
-        for bucket in bucket_list:
-            stats.import_result_file(bucket.result_file_name)
-            stats.import_suffix_file(bucket.suffix_file_name)
-            sys.stdout.write(".")
-            sys.stdout.flush()
+        completed = parallel_buckets.run_tasks(name_buckets(temp_prefix, dga_subnets, files, nb_process, max_suffixes=max_suffixes), nb_process, \
+            merge=lambda bucket: bucket.merge_into(stats))
         summary_time = time.time()
-        print("\nSummary took " + str(summary_time - start_time))
+        print("\nThreads and summary for " + str(len(completed)) + " buckets took " + str(summary_time - start_time))
         stats.final_dga()
         stats.export_result_file(result_file) 
         stats.export_suffix_file(suffix_file_name)
     else:
-        bucket_list[0].result_file_name = result_file
-        bucket_list[0].suffix_file_name = suffix_file_name
-        bucket_list[0].load()
-        bucket_list[0].stats.final_dga()
-        bucket_list[0].save()
+        bucket = name_bucket(1, result_file, suffix_file_name, dga_subnets, files, max_suffixes=max_suffixes)
+        bucket.load()
+        bucket.stats.final_dga()
+        bucket.save()
         print("Loaded a single bucket into " + result_file)
 
 # actual main program, can be called by threads, etc.
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Unit test of the chunks of do_namestats.
+#
+# A name file is made of 3 sections, each with more than 10000 suffixes
+# that only appear in that section, with 5 hits each, and one name with 1
+# hit under the suffix "thin.com". Over the whole file, "thin.com" has 3
+# subnames and is near the top, but in each section it ranks below the
+# 10000 local suffixes. The file is parsed whole by a single namestats
+# object, and in chunks of about one section by the buckets of
+# do_namestats. Both must save the same result and suffix files.
+#
+# Expect this test to work:
+#
+# py .\do_namestats_chunk_test.py ..\tmp\
+
+import sys
+import os
+import namestats
+import parallel_buckets
+import do_namestats
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: " + sys.argv[0] + " tmp_dir")
+        exit(1)
+    temp_prefix = os.path.join(sys.argv[1], "do_namestats_chunk_test_")
+    name_file = temp_prefix + "names.csv"
+    nb_sections = 3
+    nb_local = 10050
+    with open(name_file, "wt", encoding="utf-8") as f:
+        for section in range(0, nb_sections):
+            for i in range(0, nb_local):
+                f.write("n.s" + str(section) + "x" + str(i) + ".com,0,tld,5,10.0." + str(section) + ".1\n")
+                if i == nb_local//2:
+                    f.write("t" + str(section) + ".thin.com,0,tld,1,10.1." + str(section) + ".1\n")
+    chunk_size = os.path.getsize(name_file)//nb_sections + 1
+    ret = True
+
+    stats = namestats.namestats(dict())
+    stats.load_logfile(name_file)
+    stats.final_dga()
+    stats.export_result_file(temp_prefix + "ref_res.csv")
+    stats.export_suffix_file(temp_prefix + "ref_sfx.csv")
+
+    stats = namestats.namestats(dict())
+    buckets = do_namestats.name_buckets(temp_prefix, dict(), [ name_file ], nb_sections, chunk_size=chunk_size)
+    completed = parallel_buckets.run_tasks(buckets, nb_sections, merge=lambda bucket: bucket.merge_into(stats))
+    print("")
+    stats.final_dga()
+    stats.export_result_file(temp_prefix + "res.csv")
+    stats.export_suffix_file(temp_prefix + "sfx.csv")
+    if len(completed) != nb_sections:
+        print("Found " + str(len(completed)) + " chunks instead of " + str(nb_sections))
+        ret = False
+    for name in [ "res.csv", "sfx.csv" ]:
+        if open(temp_prefix + name, "rt").read() != open(temp_prefix + "ref_" + name, "rt").read():
+            print("Chunked " + name + " differs from " + temp_prefix + "ref_" + name)
+            ret = False
+    if not ",thin.com," in "," + open(temp_prefix + "sfx.csv", "rt").read().replace("\n", ","):
+        print("Suffix thin.com is missing from " + temp_prefix + "sfx.csv")
+        ret = False
+
+    for bucket_id in range(1, len(completed) + 1):
+        for x in [ "_res.csv", "_sfx.csv" ]:
+            if os.path.isfile(temp_prefix + str(bucket_id) + x):
+                os.remove(temp_prefix + str(bucket_id) + x)
+    if not ret:
+        exit(1)
+    print("Chunked and whole file runs match for " + str(nb_sections*(nb_local + 1)) + " names.")
+    exit(0)
+
+if __name__ == '__main__':
+    main()
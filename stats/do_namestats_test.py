@@ -0,0 +1,62 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Unit test of the shuffle mode of do_namestats.
+#
+# The name files are parsed by a single namestats object, as in the single
+# process mode, and then by the buckets of the shuffle mode, with the
+# suffixes partitioned between 3 reducers. The result and suffix files
+# must contain the same lines, and the files of the partitions and of the
+# reducers must have been removed.
+#
+# Expect this test to work:
+#
+# py .\do_namestats_test.py ..\tmp\ ..\data\dga13_subnets.txt ..\data\suffix_test_names.csv ..\data\suffix_test_names_2.csv ..\data\dga13_test_names.csv
+
+import sys
+import os
+import namestats
+import do_namestats
+
+def sorted_lines(file_name):
+    return sorted(open(file_name, "rt", encoding="utf-8").readlines())
+
+def main():
+    if len(sys.argv) < 4:
+        print("Usage: " + sys.argv[0] + " tmp_dir dga_subnets name_file*")
+        exit(1)
+    temp_prefix = os.path.join(sys.argv[1], "do_namestats_test_")
+    dga_subnets = namestats.subnet_dict_from_file(sys.argv[2])
+    files = sys.argv[3:]
+    nb_process = 3
+    ret = True
+
+    stats = namestats.namestats(dga_subnets)
+    for input_file in files:
+        stats.load_logfile(input_file)
+    stats.final_dga()
+    stats.export_result_file(temp_prefix + "ref_res.csv")
+    stats.export_suffix_file(temp_prefix + "ref_sfx.csv")
+
+    completed = do_namestats.shuffle_stats(temp_prefix + "res.csv", temp_prefix + "sfx.csv", temp_prefix, dga_subnets, files, nb_process)
+    print("")
+    for name in [ "res.csv", "sfx.csv" ]:
+        if sorted_lines(temp_prefix + name) != sorted_lines(temp_prefix + "ref_" + name):
+            print("Shuffle mode " + name + " differs from " + temp_prefix + "ref_" + name)
+            ret = False
+    leftovers = [ temp_prefix + "r" + str(p) + "_sfx.csv" for p in range(0, nb_process) ]
+    for bucket_id in [ 0 ] + [ bucket.bucket_id for bucket in completed ]:
+        leftovers += do_namestats.partition_file_names(temp_prefix, bucket_id, nb_process)
+    for file_name in leftovers:
+        if os.path.isfile(file_name):
+            print("Temporary file " + file_name + " was not removed.")
+            ret = False
+    nb_suffixes = len(sorted_lines(temp_prefix + "sfx.csv")) - 1
+
+    if not ret:
+        exit(1)
+    print("Shuffled " + str(len(completed)) + " buckets, " + str(nb_suffixes) + " suffixes in " + str(nb_process) + " partitions.")
+    exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -11,7 +11,7 @@ import socket
 import ip2as
 import ipaddress
 import os
-import concurrent.futures
+import parallel_buckets
 import traceback
 import time
 import dns.resolver
@@ -95,11 +95,7 @@ def main():
     log_time = []
     success = 0
 
-    i2a = ip2as.ip2as_table()
-    if i2a.load(ip2as_file):
-        print("Loaded i2a table of length: " + str(len(i2a.table)))
-    else:
-        print("Could not load <" + ip2as_file + ">")
+    i2a = ip2as.load_ip2as(ip2as_file)
 
     bucket_list = []
     dns_list = sample_dns_list(i2a, output_file)
@@ -116,35 +112,23 @@ def main():
     else:
         nb_process = os.cpu_count()
         print("CPU count is: " + str(nb_process))
-        i = 0
-        bucket_created = False
+        names = []
         for line in open(input_names, "rt"):
-            if i >= nb_process:
-                i = 0
-                bucket_created = True
-            elif not bucket_created:
-                target = temp_prefix + str(i) + ".csv"
-                sampler = sample_dns_list(i2a, target,id=i)
-                bucket_list.append(sampler)
-            name = line.strip()
-            bucket_list[i].add_name(name)
-            i += 1
+            names.append(line.strip())
+        # split the names in several batches per process
+        for name_batch in parallel_buckets.split_list(names, nb_process*parallel_buckets.TASKS_PER_PROCESS):
+            target = temp_prefix + str(len(bucket_list)) + ".csv"
+            sampler = sample_dns_list(i2a, target,id=len(bucket_list))
+            for name in name_batch:
+                sampler.add_name(name)
+            bucket_list.append(sampler)
         ready_time = time.time()
-        nb_process = len(bucket_list)
-        print("Ready after " + str(ready_time - start_time) + " with " + str(nb_process) + " processes.")
-        
-        with concurrent.futures.ProcessPoolExecutor(max_workers = nb_process) as executor:
-            future_to_bucket = {executor.submit(load_dns_bucket, bucket):bucket for bucket in bucket_list }
-            for future in concurrent.futures.as_completed(future_to_bucket):
-                bucket = future_to_bucket[future]
-                try:
-                    data = future.result()
-                    sys.stdout.write(".")
-                    sys.stdout.flush()
-                except Exception as exc:
-                    traceback.print_exc()
-                    print('\nBucket %d generated an exception: %s' % (bucket.id, exc))
-                    exit(1)
+        print("Ready after " + str(ready_time - start_time) + " with " + str(len(bucket_list)) + " buckets.")
+
+        completed = parallel_buckets.run_tasks(bucket_list, nb_process, run=load_dns_bucket)
+        if len(completed) < len(bucket_list):
+            print("\n" + str(len(bucket_list) - len(completed)) + " buckets did not complete.")
+            exit(1)
         bucket_time = time.time()
         print("\nThreads took " + str(bucket_time - ready_time))   
         # aggregate the results
@@ -3,7 +3,8 @@
 
 import sys
 import suffixes
-import concurrent.futures
+import suffix_merge
+import parallel_buckets
 import traceback
 import time
 import os
@@ -35,6 +36,12 @@ class suffix_bucket:
             print("Abandon bucket " + str(self.bucket_id))
         return True
 
+    def merge_into(self, sr):
+        if self.city != "":
+            sr.city_list[self.city].parse(self.result_file_name)
+        else:
+            sr.date_list[self.date].parse(self.result_file_name)
+
 def load_suffix_bucket(bucket):
     bucket.process()
 
@@ -77,47 +84,38 @@ def main():
         result_file = date_prefix + date + ".csv"
         bucket_list.append(suffix_bucket(bucket_id, sr.hll_k, \
             sr.max_suffix_parts, "", date, in_files, result_file))
+        bucket_id += 1
     print("Added " + str(len(sr.date_list)) + " dates")
     for city in sr.city_list:
         result_file = city_prefix + city + ".csv"
         bucket_list.append(suffix_bucket(bucket_id, sr.hll_k, \
             sr.max_suffix_parts, city, "", in_files, result_file))
+        bucket_id += 1
     print("Added " + str(len(sr.city_list)) + " cities")
     print("Total: " + str(len(bucket_list)) + " buckets")
 
     # Set the maximum number of processes to the CPU number
     nb_process = os.cpu_count()
 
-    # process the buckets, create result files for each data and city
-    start_time = time.time()
-    with concurrent.futures.ProcessPoolExecutor(max_workers = nb_process) as executor:
-        future_to_bucket = {executor.submit(load_suffix_bucket, bucket):bucket for bucket in bucket_list }
-        for future in concurrent.futures.as_completed(future_to_bucket):
-            bucket = future_to_bucket[future]
-            try:
-                data = future.result()
-                sys.stdout.write(".")
-                sys.stdout.flush()
-            except Exception as exc:
-                traceback.print_exc()
-                print('\nBucket %d generated an exception: %s' % (bucket.bucket_id, exc))
-    bucket_time = time.time()
-    print("\nThreads took " + str(bucket_time - start_time))
-
-    # Now load each of the required results
+    # process the buckets, create result files for each data and city,
+    # and load each of them as soon as it is ready.
     # todo: should write a parse version that only loads the required suffixes
-    for bucket in bucket_list:
-        if bucket.city != "":
-            sr.city_list[bucket.city].parse(bucket.result_file_name)
-        else:
-            sr.date_list[bucket.date].parse(bucket.result_file_name)
-        sys.stdout.write(".")
-        sys.stdout.flush()
+    start_time = time.time()
+    parallel_buckets.run_tasks(bucket_list, nb_process, merge=lambda bucket: bucket.merge_into(sr), \
+        run=load_suffix_bucket)
     summary_time = time.time()
-    print("\nSummary took " + str(summary_time - bucket_time))
-
+    print("\nThreads and summary took " + str(summary_time - start_time))
+
+    # merge the date files by pairs in parallel to find the top domains
+    date_files = [date_prefix + date + ".csv" for date in sr.date_list]
+    date_files = [file_name for file_name in date_files if os.path.isfile(file_name)]
+    # the merged top domains are only kept until they are parsed.
+    top_file = date_prefix + "_top_merge.csv"
+    suffix_merge.merge_details_files(date_files, top_file, sr.nb_top, nb_process, hll_k=sr.hll_k)
+    sr.top_list = suffixes.suffix_details_file(sr.hll_k, sr.max_suffix_parts)
+    sr.top_list.parse(top_file)
+    os.remove(top_file)
     # finally save the report
-    sr.get_top_domains()
     print("Loaded " + str(len(sr.top_list.suffixes)) + " top domains.")
     topload_time = time.time()
     print("\nTop domains took " + str(topload_time - summary_time))
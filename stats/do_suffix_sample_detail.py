@@ -1,7 +1,10 @@
 # obtain suffix sample
 #
 # Expected to run the test as:
-# python3 .\suffix_sample_detail_test.py nb  /data/ITHI/results-name/WEST/ ~/tmp/suffix_details.csv  ~/tmp/suffix_report_ref.csv
+# python3 .\suffix_sample_detail_test.py nb  /data/ITHI/results-name/WEST/ ~/tmp/suffix_details.csv  ~/tmp/suffix_report_ref.csv [weighted]
+#
+# With the optional argument "weighted", the names are sampled in proportion
+# to their hits.
 
 import sys
 import suffix_sample
@@ -14,8 +17,9 @@ nb_samples = int(sys.argv[1])
 dir_prefix = sys.argv[2]
 result_file = sys.argv[3]
 details = sys.argv[4]
+weighted = len(sys.argv) > 5 and sys.argv[5] == "weighted"
 
-sds = suffix_sample.suffix_details_sample(nb_samples, dir_prefix)
+sds = suffix_sample.suffix_details_sample(nb_samples, dir_prefix, weighted=weighted)
 
 # load details file
 sds.load_detail_file(details)
@@ -30,7 +30,7 @@ class zone_sampler_bucket:
         return True
 
     def save(self):
-        self.zs.save(self.result_file_name)
+        self.zs.save_partial_result(self.result_file_name)
 
 def load_zone_bucket(bucket):
     bucket.load()
@@ -69,13 +69,12 @@ def main():
         nb_process = os.cpu_count()
         file_part = zoneparser.compute_file_partitions(zone_file,nb_process)
         print("For " + str(nb_process) + " processes, " + str(len(file_part)) + " partitions.")
-        # compute the number of samples per bucket
-        ns_p = zs.samples_per_bucket(nb_samples, len(file_part) - 1)
-        # prepare a bucket per processor 
+        # prepare a bucket per processor, each with a reservoir of nb_samples
+        # names that is merged with the others when done.
         bucket_list = []
         for bucket_id in range(0, len(file_part) - 1):
             temp_name = temp_prefix + str(bucket_id) + "_samples.txt"
-            this_bucket = zone_sampler_bucket(bucket_id, temp_name, zone_file, file_part[bucket_id], file_part[bucket_id+1], ns_p[bucket_id])
+            this_bucket = zone_sampler_bucket(bucket_id, temp_name, zone_file, file_part[bucket_id], file_part[bucket_id+1], nb_samples)
             bucket_list.append(this_bucket)
         print("Prepared in " + str(ready_time - start_time))
         # run multiple parsing in parallel
@@ -93,7 +92,7 @@ def main():
                     exit(1)
         bucket_time = time.time()
         print("\nThreads took " + str(bucket_time - ready_time))
-        # aggregate the results
+        # merge the reservoirs of the partitions
         for bucket in bucket_list:
             zs.load_partial_result(bucket.result_file_name)
             sys.stdout.write(".")
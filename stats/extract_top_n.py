@@ -3,14 +3,16 @@
 #
 # Extract name statistics from a set of files.
 # Since the number of files to merge can be quite large, we spread the processing
-# on all available cores.
+# on all available cores: the files are merged by pairs in parallel, see
+# suffix_merge.py. As in the previous sorter, which only kept about the
+# 2*N best suffixes while parsing, the partial merges are trimmed to the
+# top 2*N suffixes.
 
 
 import sys
-import suffixes
+import suffix_merge
 import traceback
 import time
-import concurrent.futures
 import os
 
 def usage(argv_0):
@@ -26,13 +28,9 @@ def main():
         exit(1)
     nb_saved = int(sys.argv[2])
 
-    pss = suffixes.suffix_summary_sorter(4, nb_saved)
-    for suffix_file in sys.argv[3:]:
-        pss.parse_suffix_summary(suffix_file)
-        sys.stdout.write(".")
-        sys.stdout.flush()
-    sys.stdout.write("\n")
-    pss.save_summary(sys.argv[1])
+    start_time = time.time()
+    suffix_merge.merge_summary_files(sys.argv[3:], sys.argv[1], nb_saved, os.cpu_count(), partial_top=2*nb_saved)
+    print("\nMerged " + str(len(sys.argv) - 3) + " files in " + str(time.time() - start_time))
 
 # actual main program, can be called by threads, etc.
 
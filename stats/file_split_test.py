@@ -46,10 +46,11 @@ except Exception as e:
 
 
 # Create a copy by reading the 4 ranges
-f_out = open(copy_name, "wt", encoding="utf-8")
+# The partitions are expressed in bytes, so the copy is done in binary mode.
+f_out = open(copy_name, "wb")
 for x in range(0,4):
     # open file
-    file = open(file_name, "rt", encoding="utf-8")
+    file = open(file_name, "rb")
  
     # get the cursor positioned at partition
     file.seek(file_part[x])
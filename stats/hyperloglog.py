@@ -2,17 +2,28 @@
 # coding=utf-8
 #
 # Implementation of the hyperloglog algorithm
+#
+# Most of the hyperloglog objects, e.g., those of the suffixes seen only
+# once, have very few registers that are not zero. As in HLL++, they
+# start in a sparse mode, in which the registers that are not zero are
+# kept in a dictionary by index, and "b" is None. When more than
+# m/SPARSE_FRACTION registers are set, the object becomes dense, with
+# the list "b" of all the registers. Both modes give the same registers,
+# text formats and estimates; "registers()" returns the list of all
+# registers in either mode.
 
 import math
 
+SPARSE_FRACTION = 16
+
 class hyperloglog:
     def __init__(self, k):
         self.k = k
         self.m = 1<<k
         self.mk = self.m - 1
-        self.b = []
-        for i in range(0,self.m):
-            self.b.append(0)
+        self.b = None
+        self.sparse = dict()
+        self.sparse_max = self.m // SPARSE_FRACTION
         self.alpha = 1.0
         if k == 4:
             self.alpha = 0.673
@@ -41,23 +52,64 @@ class hyperloglog:
         return h
 
     def add(self,x):
-        h = hyperloglog.fnv1a64(x)
+        self.add_hash(hyperloglog.fnv1a64(x))
+
+    def add_hash(self, h):
+        # Add a value by its fnv1a64 hash, computed once by the caller when
+        # the same value is added to several objects.
         ib = h&self.mk
         hb = h>>self.k
         zb = hyperloglog.rho(hb)
-        if zb > self.b[ib]:
+        self.set_max(ib, zb)
+
+    def set_max(self, ib, zb):
+        if self.b is not None:
+            if zb > self.b[ib]:
+                self.b[ib] = zb
+        elif zb > self.sparse.get(ib, 0):
+            self.sparse[ib] = zb
+            if len(self.sparse) > self.sparse_max:
+                self.to_dense()
+
+    def set_register(self, ib, zb):
+        if self.b is not None:
             self.b[ib] = zb
+        elif zb != 0:
+            self.sparse[ib] = zb
+            if len(self.sparse) > self.sparse_max:
+                self.to_dense()
+        elif ib in self.sparse:
+            self.sparse.pop(ib)
+
+    def to_dense(self):
+        self.b = self.registers()
+        self.sparse = None
+
+    def registers(self):
+        if self.b is not None:
+            return self.b
+        b = [0]*self.m
+        for ib in self.sparse:
+            b[ib] = self.sparse[ib]
+        return b
 
     def evaluate(self):
-        a = 0.0
-        for z in self.b:
-            a += 1.0/(1<<z)
-        e = self.alpha*self.m*self.m/a
-        if e < (5*self.m/2):
+        if self.b is not None:
+            a = 0.0
             v = 0
             for z in self.b:
+                a += 1.0/(1<<z)
                 if z == 0:
                     v += 1
+        else:
+            # The terms are powers of 2 much larger than the precision of
+            # the sum, which is exact in any order.
+            v = self.m - len(self.sparse)
+            a = float(v)
+            for z in self.sparse.values():
+                a += 1.0/(1<<z)
+        e = self.alpha*self.m*self.m/a
+        if e < (5*self.m/2):
             if v > 0:
                 e = self.m*math.log(self.m/v) 
         e = int(e + 0.5)
@@ -67,14 +119,25 @@ class hyperloglog:
         return self.m
     
     def merge_vector(self, v):
-        for i in range(0,self.m):
-            if v[i] > self.b[i]:
-                self.b[i] = v[i]
+        if self.b is not None:
+            for i in range(0,self.m):
+                if v[i] > self.b[i]:
+                    self.b[i] = v[i]
+        else:
+            for i in range(0,self.m):
+                if v[i] > 0:
+                    self.set_max(i, v[i])
 
     def merge(self, other):
-        self.merge_vector(other.b)
+        if other.b is not None:
+            self.merge_vector(other.b)
+        else:
+            for ib in other.sparse:
+                self.set_max(ib, other.sparse[ib])
 
     def to_text(self):
+        if self.b is None:
+            return ",".join(str(i) + "," + str(self.sparse[i]) for i in sorted(self.sparse))
         s = ""
         for i in range(0,self.m):
             if self.b[i]:
@@ -88,23 +151,28 @@ class hyperloglog:
         p = 0
         while p + 2 <= np and len(parts[p]) > 0:
             x = int(parts[p])
-            self.b[x] = int(parts[p+1])
+            self.set_register(x, int(parts[p+1]))
             p += 2
 
     def to_full_text(self):
-        s = ""
-        for i in range(0,self.m):
-                if s != "":
-                    s += ","
-                s += str(self.b[i])
-        return s
+        return ",".join(map(str, self.registers()))
 
     def from_full_parts(self, parts):
+        b = []
         for p in range(0,self.m):
             if p <= len(parts):
-                self.b[p] = int(parts[p])
+                b.append(int(parts[p]))
             else:
-                self.b[p] = 0
+                b.append(0)
+        if self.m - b.count(0) > self.sparse_max:
+            self.b = b
+            self.sparse = None
+        else:
+            self.b = None
+            self.sparse = dict()
+            for p in range(0,self.m):
+                if b[p] != 0:
+                    self.sparse[p] = b[p]
 
     def header_full_text(self, prefix):
         s = ""
@@ -0,0 +1,146 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Vectorized implementation of the hyperloglog algorithm.
+#
+# This is a drop-in replacement for hyperloglog.hyperloglog, with the
+# registers held in a uint8 numpy array instead of a python list. The
+# hash (FNV-1a over the unicode code points of the string) and the
+# rank computation are the same as in hyperloglog.py, so the register
+# values, the text outputs and the estimates are identical. This
+# matters because the suffix files produced with one class must
+# merge with those produced by the other.
+#
+# The main gain is the "add_many" function, which hashes a whole
+# chunk of strings at once: the strings are converted to a 2D array
+# of code points, the FNV-1a loop runs over the columns for all
+# strings in parallel, the rank is obtained from the lowest bit set
+# and the registers are updated with np.maximum.at.
+
+import math
+import numpy as np
+import hyperloglog
+
+FNV1A64_OFFSET = np.uint64(14695981039346656037)
+FNV1A64_PRIME = np.uint64(1099511628211)
+# The rank computed by hyperloglog.rho is capped at 30, i.e., only the
+# 29 lowest bits of the hash remainder are examined.
+RHO_MASK = np.uint64((1<<29) - 1)
+RHO_MAX = 30
+
+def fnv1a64_many(strings):
+    # Compute the FNV-1a hash of a list of strings, returns an array
+    # of uint64 values identical to hyperloglog.fnv1a64
+    y = [str(x) for x in strings]
+    n = len(y)
+    h = np.full(n, FNV1A64_OFFSET, dtype=np.uint64)
+    if n == 0:
+        return h
+    lengths = np.fromiter((len(x) for x in y), dtype=np.int64, count=n)
+    max_len = int(lengths.max())
+    if max_len == 0:
+        return h
+    # Fixed width unicode array, viewed as code points. Strings shorter than
+    # max_len are padded with zeroes, which the length mask ignores.
+    cp = np.array(y, dtype="U" + str(max_len)).view(np.uint32).reshape(n, max_len).astype(np.uint64)
+    with np.errstate(over='ignore'):
+        for j in range(0, max_len):
+            active = lengths > j
+            hj = (h ^ cp[:,j]) * FNV1A64_PRIME
+            h = np.where(active, hj, h)
+    return h
+
+def rho_many(hb):
+    # Vectorized version of hyperloglog.rho: rank of the lowest bit set,
+    # capped at RHO_MAX.
+    lo = (hb & RHO_MASK).astype(np.int64)
+    low_bit = lo & -lo
+    # For a power of 2, frexp returns the exponent + 1, which is the rank.
+    _, e = np.frexp(low_bit.astype(np.float64))
+    return np.where(lo == 0, RHO_MAX, e).astype(np.uint8)
+
+class hyperloglog_np:
+    def __init__(self, k):
+        self.k = k
+        self.m = 1<<k
+        self.mk = self.m - 1
+        self.b = np.zeros(self.m, dtype=np.uint8)
+        self.alpha = 1.0
+        if k == 4:
+            self.alpha = 0.673
+        elif k == 5:
+            self.alpha = 0.697
+        elif k == 6:
+            self.alpha = 0.709
+        elif k >= 7:
+            self.alpha = 0.7213/(1 + 1.079/self.m)
+
+    def add(self,x):
+        h = hyperloglog.hyperloglog.fnv1a64(x)
+        ib = h&self.mk
+        zb = hyperloglog.hyperloglog.rho(h>>self.k)
+        if zb > self.b[ib]:
+            self.b[ib] = zb
+
+    def add_hashes(self, h):
+        # Add an array of precomputed uint64 FNV-1a hashes.
+        ib = (h & np.uint64(self.mk)).astype(np.intp)
+        zb = rho_many(h >> np.uint64(self.k))
+        np.maximum.at(self.b, ib, zb)
+
+    def add_many(self, strings, chunk_size=4096):
+        # Process the strings by chunks, so the temporary code point arrays
+        # stay small even if a few strings are very long.
+        if not isinstance(strings, list):
+            strings = list(strings)
+        for i in range(0, len(strings), chunk_size):
+            self.add_hashes(fnv1a64_many(strings[i:i+chunk_size]))
+
+    def evaluate(self):
+        # The sum is computed in python, in the same order as in
+        # hyperloglog.py, so that rounding errors and thus estimates
+        # are the same.
+        bl = self.b.tolist()
+        a = 0.0
+        for z in bl:
+            a += 1.0/(1<<z)
+        e = self.alpha*self.m*self.m/a
+        if e < (5*self.m/2):
+            v = bl.count(0)
+            if v > 0:
+                e = self.m*math.log(self.m/v)
+        e = int(e + 0.5)
+        return e
+
+    def nb_buckets(self):
+        return self.m
+
+    def merge_vector(self, v):
+        np.maximum(self.b, np.asarray(v, dtype=np.uint8), out=self.b)
+
+    def registers(self):
+        return self.b
+
+    def merge(self, other):
+        self.merge_vector(other.registers())
+
+    def to_text(self):
+        nz = np.flatnonzero(self.b)
+        return ",".join(str(i) + "," + str(self.b[i]) for i in nz.tolist())
+
+    def from_parts(self, parts):
+        np_parts = len(parts)
+        p = 0
+        while p + 2 <= np_parts and len(parts[p]) > 0:
+            x = int(parts[p])
+            self.b[x] = int(parts[p+1])
+            p += 2
+
+    def to_full_text(self):
+        return ",".join(map(str, self.b.tolist()))
+
+    def from_full_parts(self, parts):
+        self.b[:] = [int(parts[p]) for p in range(0, self.m)]
+
+    def header_full_text(self, prefix):
+        return ",".join(prefix + str(i) for i in range(0, self.m))
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Unit test of the vectorized hyperloglog module.
+#
+# Load the names, IP addresses and subnets found in name files into both
+# the reference hyperloglog and the numpy version, and verify that the
+# registers and estimates are identical.
+#
+# Expect this test to work:
+#
+# py .\hyperloglog_np_test.py ..\data\suffix_test_names.csv ..\data\suffix_test_names_2.csv ..\data\dga13_test_names.csv
+
+import sys
+import nameparse
+import hyperloglog
+import hyperloglog_np
+
+def compare_hll(label, k, strings):
+    hll = hyperloglog.hyperloglog(k)
+    for x in strings:
+        hll.add(x)
+    hll_many = hyperloglog_np.hyperloglog_np(k)
+    hll_many.add_many(strings, chunk_size=97)
+    hll_one = hyperloglog_np.hyperloglog_np(k)
+    for x in strings:
+        hll_one.add(x)
+    ret = True
+    for h in [hll_many, hll_one]:
+        if h.to_full_text() != hll.to_full_text():
+            print(label + ", k=" + str(k) + ", registers differ:\n    " + h.to_full_text() + "\nvs.:\n    " + hll.to_full_text())
+            ret = False
+        elif h.to_text() != hll.to_text():
+            print(label + ", k=" + str(k) + ", text differs:\n    " + h.to_text() + "\nvs.:\n    " + hll.to_text())
+            ret = False
+        elif h.evaluate() != hll.evaluate():
+            print(label + ", k=" + str(k) + ", evaluates to " + str(h.evaluate()) + " instead of " + str(hll.evaluate()))
+            ret = False
+    # Check that the text formats round trip, and that merge works
+    # across the two implementations.
+    hll_back = hyperloglog_np.hyperloglog_np(k)
+    hll_back.from_full_parts(hll.to_full_text().split(","))
+    hll_merged = hyperloglog.hyperloglog(k)
+    hll_merged.merge(hll_back)
+    if hll_merged.to_full_text() != hll.to_full_text():
+        print(label + ", k=" + str(k) + ", round trip fails")
+        ret = False
+    if ret:
+        print(label + ", k=" + str(k) + ": " + str(len(strings)) + " strings, estimate " + str(hll.evaluate()) + " as expected.")
+    return ret
+
+# main program
+
+names = []
+ips = []
+for file_name in sys.argv[1:]:
+    for line in open(file_name , "rt", encoding="utf-8"):
+        nl = nameparse.nameline()
+        if nl.from_csv(line):
+            names += nl.name.split(".")
+            ips.append(nl.ip)
+# Add a few edge cases: empty string, non ascii characters, long names.
+names += [ "", "été", "中文", "x"*300, 12345 ]
+
+ret = True
+for k in [4, 6, 8, 10]:
+    ret &= compare_hll("names", k, names)
+    ret &= compare_hll("ips", k, ips)
+
+if not ret:
+    exit(1)
+else:
+    exit(0)
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Unit test of the sparse mode of the hyperloglog module.
+#
+# Random sets of strings of various sizes are loaded in hyperloglog
+# objects that start sparse, and in objects that are made dense before the
+# first value. Both must have the same registers, text formats and
+# estimates, and the small sets must stay sparse. The sketches must also
+# be identical after merging sparse and dense sketches in every
+# combination, after parsing the text formats, and after merging into the
+# numpy version.
+#
+# Expect this test to work:
+#
+# py .\hyperloglog_sparse_test.py
+
+import sys
+import random
+import hyperloglog
+import hyperloglog_np
+
+def new_hll(k, strings, dense):
+    h = hyperloglog.hyperloglog(k)
+    if dense:
+        h.to_dense()
+    for x in strings:
+        h.add(x)
+    return h
+
+def same_hll(label, h, ref):
+    if h.registers() != ref.registers() or h.to_text() != ref.to_text() or \
+        h.to_full_text() != ref.to_full_text() or h.evaluate() != ref.evaluate():
+        print(label + ": " + h.to_full_text() + " differs from " + ref.to_full_text())
+        return False
+    return True
+
+def check(rd, k, nb):
+    strings = [ "v" + str(rd.randint(0, 1000000)) for i in range(0, nb) ]
+    others = [ "w" + str(rd.randint(0, 1000000)) for i in range(0, rd.randint(0, 2*nb)) ]
+    label = "k=" + str(k) + ", n=" + str(nb)
+    ret = True
+    sparse = new_hll(k, strings, False)
+    dense = new_hll(k, strings, True)
+    ret &= same_hll(label, sparse, dense)
+    if nb <= 1 and sparse.b is not None:
+        print(label + ": sketch is not sparse.")
+        ret = False
+
+    for sparse_first in [ False, True ]:
+        for sparse_other in [ False, True ]:
+            h = new_hll(k, strings, not sparse_first)
+            h.merge(new_hll(k, others, not sparse_other))
+            ret &= same_hll(label + ", merge", h, new_hll(k, strings + others, True))
+    h = new_hll(k, strings, False)
+    h.merge_vector(new_hll(k, others, True).registers())
+    ret &= same_hll(label + ", merge vector", h, new_hll(k, strings + others, True))
+
+    h = hyperloglog.hyperloglog(k)
+    h.from_parts(sparse.to_text().split(","))
+    ret &= same_hll(label + ", text", h, dense)
+    h = hyperloglog.hyperloglog(k)
+    h.from_full_parts(sparse.to_full_text().split(","))
+    ret &= same_hll(label + ", full text", h, dense)
+
+    h_np = hyperloglog_np.hyperloglog_np(k)
+    h_np.merge(sparse)
+    if h_np.to_full_text() != dense.to_full_text():
+        print(label + ": numpy merge " + h_np.to_full_text() + " differs from " + dense.to_full_text())
+        ret = False
+    return ret
+
+# main program
+
+if len(sys.argv) != 1:
+    print("Usage: " + sys.argv[0])
+    exit(1)
+
+rd = random.Random(9753)
+ret = True
+for k in [ 4, 6, 8, 10 ]:
+    for nb in [ 0, 1, 2, 3, 5, 20, 100, 2000 ]:
+        ret &= check(rd, k, nb)
+
+if not ret:
+    exit(1)
+print("Sparse and dense sketches match.")
+exit(0)
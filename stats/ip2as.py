@@ -62,6 +62,11 @@ import gzip
 import sys
 import traceback
 import ipaddress
+import bisect
+import struct
+import mmap
+import os
+import numpy as np
 
 
 def address_last(sn):
@@ -127,13 +132,254 @@ class ip2as_line:
             ret = False
         return(ret)
 
+# Compact index of an ip2as table.
+#
+# Comparing ipaddress objects is slow, and the lookups are done millions of
+# times. The index keeps the range bounds as integers. IPv4 bounds are held
+# in uint32 arrays. IPv6 bounds are split in high and low 64 bits parts,
+# held in uint64 arrays; the search is done on the high part, and refined
+# on the low part for the ranges that start with the same high part.
+# Single lookups use bisect, batch lookups use numpy searchsorted.
+#
+# When the index is built from a loaded table, the single lookups use
+# python lists, which bisect faster than numpy arrays. When it is mapped
+# from a binary snapshot (see ip2as_table.load_mmap), the numpy arrays
+# point to the shared pages of the file and bisect works on them directly.
+
+IP2AS_MAGIC = b"I2AS"
+IP2AS_VERSION = 1
+IP2AS_HEADER_FORMAT = "<4sHHQ"
+IP2AS_HEADER_SIZE = struct.calcsize(IP2AS_HEADER_FORMAT)
+IP2AS_BINARY_SUFFIX = ".i2ab"
+LOW_64_MASK = 0xffffffffffffffff
+
+class ip2as_index:
+    def __init__(self, ip_version, asn, first, last, first_lo=None, last_lo=None, use_lists=True):
+        self.ip_version = ip_version
+        self.np_asn = asn
+        self.np_first = first
+        self.np_last = last
+        self.np_first_lo = first_lo
+        self.np_last_lo = last_lo
+        if use_lists:
+            self.asn = asn.tolist()
+            self.first = first.tolist()
+            self.last = last.tolist()
+            if ip_version == 6:
+                self.first_lo = first_lo.tolist()
+                self.last_lo = last_lo.tolist()
+        else:
+            self.asn = asn
+            self.first = first
+            self.last = last
+            self.first_lo = first_lo
+            self.last_lo = last_lo
+
+    def nb_ranges(self):
+        return len(self.np_asn)
+
+    def lookup(self, a):
+        # a is the integer value of an address of the index version.
+        as_number = 0
+        if self.ip_version == 4:
+            i = bisect.bisect_right(self.first, a) - 1
+            if i >= 0 and a <= self.last[i]:
+                as_number = int(self.asn[i])
+        else:
+            hi = a >> 64
+            lo = a & LOW_64_MASK
+            i = bisect.bisect_right(self.first, hi) - 1
+            if i >= 0 and self.first[i] == hi:
+                # Ranges starting with the same high part are sorted by low part.
+                i_hi = bisect.bisect_left(self.first, hi, 0, i)
+                i = bisect.bisect_right(self.first_lo, lo, i_hi, i + 1) - 1
+            if i >= 0 and (hi < self.last[i] or (hi == self.last[i] and lo <= self.last_lo[i])):
+                as_number = int(self.asn[i])
+        return as_number
+
+    def get_as_number(self, s):
+        as_number = 0
+        try:
+            addr = ipaddress.ip_address(s)
+            if addr.version == self.ip_version:
+                as_number = self.lookup(int(addr))
+            else:
+                print("When evaluating <" + s + ">: not an IPv" + str(self.ip_version) + " address")
+        except Exception as e:
+            traceback.print_exc()
+            print("When evaluating <" + s + ">: " + str(e))
+        return as_number
+
+    def get_as_numbers(self, addresses):
+        # Batch version of get_as_number, returns a list of AS numbers
+        # aligned with the list of addresses.
+        nb = len(addresses)
+        values = []
+        valid = np.zeros(nb, dtype=bool)
+        for n, s in enumerate(addresses):
+            v = 0
+            try:
+                addr = ipaddress.ip_address(s)
+                if addr.version == self.ip_version:
+                    v = int(addr)
+                    valid[n] = True
+                else:
+                    print("When evaluating <" + s + ">: not an IPv" + str(self.ip_version) + " address")
+            except Exception as e:
+                print("When evaluating <" + str(s) + ">: " + str(e))
+            values.append(v)
+        result = np.zeros(nb, dtype=np.int64)
+        if nb == 0 or self.nb_ranges() == 0:
+            return result.tolist()
+        if self.ip_version == 4:
+            q = np.array(values, dtype=np.uint32)
+            i = np.searchsorted(self.np_first, q, side='right') - 1
+            ic = np.maximum(i, 0)
+            hit = valid & (i >= 0) & (q <= self.np_last[ic])
+        else:
+            q = np.array([x >> 64 for x in values], dtype=np.uint64)
+            q_lo = np.array([x & LOW_64_MASK for x in values], dtype=np.uint64)
+            i = np.searchsorted(self.np_first, q, side='right') - 1
+            ic = np.maximum(i, 0)
+            # Queries sharing the high part of their range start need an exact
+            # comparison: resolve them one by one.
+            tie = valid & (i >= 0) & (self.np_first[ic] == q)
+            for n in np.flatnonzero(tie).tolist():
+                i_n = int(i[n])
+                i_hi = bisect.bisect_left(self.first, values[n] >> 64, 0, i_n)
+                i[n] = bisect.bisect_right(self.first_lo, values[n] & LOW_64_MASK, i_hi, i_n + 1) - 1
+            ic = np.maximum(i, 0)
+            last_hi = self.np_last[ic]
+            last_lo = self.np_last_lo[ic]
+            hit = valid & (i >= 0) & ((q < last_hi) | ((q == last_hi) & (q_lo <= last_lo)))
+        result[hit] = self.np_asn[ic[hit]]
+        return result.tolist()
+
+def ip2as_index_from_table(table):
+    ip_version = 4
+    if len(table) > 0:
+        ip_version = table[0].ip_first.version
+    asn = np.array([r.as_number for r in table], dtype=np.uint32)
+    if ip_version == 4:
+        first = np.array([int(r.ip_first) for r in table], dtype=np.uint32)
+        last = np.array([int(r.ip_last) for r in table], dtype=np.uint32)
+        return ip2as_index(ip_version, asn, first, last)
+    first = np.array([int(r.ip_first) >> 64 for r in table], dtype=np.uint64)
+    first_lo = np.array([int(r.ip_first) & LOW_64_MASK for r in table], dtype=np.uint64)
+    last = np.array([int(r.ip_last) >> 64 for r in table], dtype=np.uint64)
+    last_lo = np.array([int(r.ip_last) & LOW_64_MASK for r in table], dtype=np.uint64)
+    return ip2as_index(ip_version, asn, first, last, first_lo=first_lo, last_lo=last_lo)
+
 class ip2as_table:
     def __init__(self, ipv=4):
         self.table = []
         self.ip_version = ipv
+        self.index = None
+        self.mmap_file_name = ""
+        self.mm = None
+
+    def build_index(self):
+        # The index must be rebuilt if the table is modified.
+        self.index = ip2as_index_from_table(self.table)
+
+    def drop_index(self):
+        self.index = None
+        self.mmap_file_name = ""
+        self.mm = None
+
+    def nb_ranges(self):
+        # Tables loaded with load_mmap have an index but no list of lines.
+        if self.index is not None:
+            return self.index.nb_ranges()
+        return len(self.table)
+
+    def save_binary(self, file_name):
+        # Save the sorted ranges in a flat file: header, then the AS numbers
+        # as uint32, then the bounds, as uint32 for IPv4 or as high and low
+        # uint64 parts for IPv6. All arrays are aligned on 8 bytes.
+        ret = False
+        if self.index is None:
+            self.build_index()
+        ix = self.index
+        # Write to a temporary file and rename, so that processes mapping
+        # the file never see a partial copy.
+        temp_name = file_name + "." + str(os.getpid()) + ".tmp"
+        try:
+            nb = ix.nb_ranges()
+            with open(temp_name, "wb") as F:
+                F.write(struct.pack(IP2AS_HEADER_FORMAT, IP2AS_MAGIC, IP2AS_VERSION, ix.ip_version, nb))
+                arrays = [ix.np_asn.astype('<u4'), ix.np_first, ix.np_last]
+                if ix.ip_version == 6:
+                    arrays = [ix.np_asn.astype('<u4'), ix.np_first, ix.np_first_lo, ix.np_last, ix.np_last_lo]
+                for a in arrays:
+                    b = a.tobytes()
+                    F.write(b)
+                    if len(b)%8 != 0:
+                        F.write(bytes(8 - len(b)%8))
+            os.replace(temp_name, file_name)
+            ret = True
+        except Exception as e:
+            print("Cannot save ranges in " + file_name + ", exception:" + str(e))
+        return ret
+
+    def load_mmap(self, file_name):
+        # Map a file written by save_binary. The pages are read only and
+        # shared between all processes mapping the same file. The list of
+        # ip2as_line objects stays empty, only the lookups are available.
+        ret = False
+        try:
+            with open(file_name, "rb") as F:
+                mm = mmap.mmap(F.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, ip_version, nb = struct.unpack_from(IP2AS_HEADER_FORMAT, mm, 0)
+            if magic != IP2AS_MAGIC or version != IP2AS_VERSION:
+                print("File " + file_name + " is not a version " + str(IP2AS_VERSION) + " ip2as file.")
+                mm.close()
+                return False
+            if ip_version == 4:
+                dtypes = ['<u4', '<u4', '<u4']
+            else:
+                dtypes = ['<u4', '<u8', '<u8', '<u8', '<u8']
+            offset = IP2AS_HEADER_SIZE
+            arrays = []
+            for dtype in dtypes:
+                arrays.append(np.frombuffer(mm, dtype=dtype, count=nb, offset=offset))
+                offset += 8*((nb*np.dtype(dtype).itemsize + 7)//8)
+            if ip_version == 4:
+                self.index = ip2as_index(4, arrays[0], arrays[1], arrays[2], use_lists=False)
+            else:
+                self.index = ip2as_index(6, arrays[0], arrays[1], arrays[3], \
+                    first_lo=arrays[2], last_lo=arrays[4], use_lists=False)
+            self.table = []
+            self.ip_version = ip_version
+            self.mm = mm
+            self.mmap_file_name = file_name
+            ret = True
+        except Exception as e:
+            traceback.print_exc()
+            print("When mapping <" + file_name + ">: " + str(e))
+        return ret
+
+    def __getstate__(self):
+        # When sent to a worker process, a mapped table is passed by file
+        # name, and the worker maps the same file instead of receiving a
+        # pickled copy of the arrays.
+        if self.mmap_file_name != "":
+            return { "mmap_file_name": self.mmap_file_name }
+        state = self.__dict__.copy()
+        state["mm"] = None
+        return state
+
+    def __setstate__(self, state):
+        if "table" not in state:
+            self.__init__()
+            if not self.load_mmap(state["mmap_file_name"]):
+                raise ValueError("Cannot map " + state["mmap_file_name"])
+        else:
+            self.__dict__.update(state)
 
     def load(self,file_name):
         ret = True
+        self.drop_index()
         try:
             first = True
             for line in open(file_name, "rt"):
@@ -168,6 +414,7 @@ class ip2as_table:
     def add(self, ip_first, ip_last, as_number):
         r = ip2as_line(ip_first, ip_last, as_number)
         self.table.append(r)
+        self.drop_index()
 
     def collapse(self):
         if len(self.table) < 2:
@@ -183,6 +430,7 @@ class ip2as_table:
                     current_range = r
             new_table.append(current_range)
             self.table = new_table
+            self.drop_index()
 
     def merge(self, other):
         new_table = []
@@ -221,6 +469,7 @@ class ip2as_table:
                     new_table.append(ar)
             i_self += 1
         self.table = new_table
+        self.drop_index()
 
     def nb_zero(self):
         n = 0
@@ -230,6 +479,8 @@ class ip2as_table:
         return n
     
     def get_as_number(self, s):
+        if self.index is not None:
+            return self.index.get_as_number(s)
         as_number = 0
         i_first = 0
         i_last = len(self.table) - 1
@@ -253,6 +504,11 @@ class ip2as_table:
             pass
         return as_number
 
+    def get_as_numbers(self, addresses):
+        if self.index is None:
+            self.build_index()
+        return self.index.get_as_numbers(addresses)
+
 class asname:
     def __init__(self):
         self.table = dict()
@@ -368,10 +624,30 @@ class aggregated_asn:
         return asn
 
 
+# Load an ip2as table for lookups.
+#
+# Parsing the CSV file creates hundreds of thousands of ipaddress objects,
+# which takes seconds per process. The first load of a CSV file thus saves
+# a binary snapshot next to it (ip2as_file + IP2AS_BINARY_SUFFIX). Later
+# loads map the snapshot if it is more recent than the CSV file. A binary
+# file can also be passed directly.
+
 def load_ip2as(ip2as_file):
     i2a = ip2as_table()
-    if i2a.load(ip2as_file):
+    if ip2as_file.endswith(IP2AS_BINARY_SUFFIX):
+        snapshot = ip2as_file
+    else:
+        snapshot = ip2as_file + IP2AS_BINARY_SUFFIX
+    if os.path.exists(snapshot) and (snapshot == ip2as_file or \
+        os.path.getmtime(snapshot) >= os.path.getmtime(ip2as_file)) and \
+        i2a.load_mmap(snapshot):
+        print("From <" + snapshot + ">, mapped table of length: " + str(i2a.nb_ranges()))
+    elif snapshot != ip2as_file and i2a.load(ip2as_file):
+        i2a.build_index()
         print("From <" + ip2as_file + ">, loaded table of length: " + str(len(i2a.table)))
+        i2b = ip2as_table()
+        if i2a.save_binary(snapshot) and i2b.load_mmap(snapshot):
+            i2a = i2b
     else:
         print("Could not load <" + ip2as_file + ">")
         exit(1)
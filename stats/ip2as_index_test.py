@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Unit test of the ip2as index.
+#
+# Build random IPv4 and IPv6 tables, with gaps between ranges, and check that
+# the single and batch lookups of the index return the same AS numbers as
+# the reference binary search on the ip2as_line objects, including the 0
+# returned for addresses outside of the table. The same is checked after
+# saving the index as a binary snapshot and mapping it back.
+#
+# Expect this test to work:
+#
+# py .\ip2as_index_test.py 2000 20000 ..\tmp\
+
+import sys
+import os
+import random
+import ipaddress
+import ip2as
+
+def random_table(rd, version, nb_ranges):
+    if version == 4:
+        nb_bits = 32
+    else:
+        nb_bits = 128
+    bounds = set()
+    while len(bounds) < 2*nb_ranges:
+        x = rd.getrandbits(nb_bits)
+        if version == 6 and len(bounds) > 0 and rd.random() < 0.25:
+            # Several bounds with the same high 64 bits.
+            x = ((max(bounds) >> 64) << 64) | rd.getrandbits(64)
+        bounds.add(x)
+    bounds = sorted(bounds)
+    if version == 4:
+        address_class = ipaddress.IPv4Address
+    else:
+        address_class = ipaddress.IPv6Address
+    t = ip2as.ip2as_table()
+    for i in range(0, nb_ranges):
+        first = bounds[2*i]
+        last = bounds[2*i + 1]
+        if rd.random() < 0.5 and i > 0:
+            # adjacent to the previous range
+            first = int(t.table[-1].ip_last) + 1
+        t.add(address_class(first), address_class(last), rd.randint(1,400000))
+    return t, bounds
+
+def random_addresses(rd, version, bounds, nb_addresses):
+    addresses = []
+    for i in range(0, nb_addresses):
+        r = rd.random()
+        if r < 0.4:
+            x = rd.choice(bounds) + rd.randint(-1, 1)
+        elif version == 4:
+            x = rd.getrandbits(32)
+        else:
+            x = rd.getrandbits(128)
+        if version == 4:
+            x = x % (1<<32)
+            addresses.append(str(ipaddress.IPv4Address(x)))
+        else:
+            x = x % (1<<128)
+            addresses.append(str(ipaddress.IPv6Address(x)))
+    return addresses
+
+def compare_lookups(label, t, addresses, expected):
+    single = []
+    for a in addresses:
+        single.append(t.get_as_number(a))
+    batch = t.get_as_numbers(addresses)
+    ret = True
+    nb_found = 0
+    for i in range(0, len(addresses)):
+        if expected[i] != single[i] or expected[i] != batch[i]:
+            print(label + ", for " + addresses[i] + " expected " + str(expected[i]) + ", got " + str(single[i]) + ", " + str(batch[i]))
+            ret = False
+            break
+        if expected[i] != 0:
+            nb_found += 1
+    if ret:
+        print(label + ": " + str(nb_found) + " addresses out of " + str(len(addresses)) + " found as expected.")
+    return ret
+
+def check_version(rd, version, nb_ranges, nb_addresses, tmp_dir):
+    t, bounds = random_table(rd, version, nb_ranges)
+    addresses = random_addresses(rd, version, bounds, nb_addresses)
+    expected = []
+    for a in addresses:
+        expected.append(t.get_as_number(a))
+    t.build_index()
+    ret = compare_lookups("IPv" + str(version), t, addresses, expected)
+    if ret:
+        binary_file = os.path.join(tmp_dir, "ip2as_test_v" + str(version) + ip2as.IP2AS_BINARY_SUFFIX)
+        tm = ip2as.ip2as_table()
+        ret = t.save_binary(binary_file) and tm.load_mmap(binary_file) and \
+            compare_lookups("IPv" + str(version) + " mapped", tm, addresses, expected)
+    return ret
+
+# main program
+
+if len(sys.argv) != 4:
+    print("Usage: " + sys.argv[0] + " nb_ranges nb_addresses tmp_dir")
+    exit(1)
+nb_ranges = int(sys.argv[1])
+nb_addresses = int(sys.argv[2])
+tmp_dir = sys.argv[3]
+rd = random.Random(1234)
+if not check_version(rd, 4, nb_ranges, nb_addresses, tmp_dir) or \
+   not check_version(rd, 6, nb_ranges, nb_addresses, tmp_dir):
+    exit(1)
+else:
+    exit(0)
@@ -14,7 +14,7 @@ import dnslook
 import ip2as
 import traceback
 import sys
-import concurrent.futures
+import parallel_buckets
 import os
 
 class ns_server_lookup_bucket:
@@ -54,11 +54,7 @@ def main():
         temp_prefix = sys.argv[5]
 
     mf = dnslook.load_dns_file(million_file)
-    i2a = ip2as.ip2as_table()
-    if i2a.load(ip2as_file):
-        print("Loaded i2a table of length: " + str(len(i2a.table)))
-    else:
-        print("Could not load <" + ip2as_file + ">")
+    i2a = ip2as.load_ip2as(ip2as_file)
     nt = dnslook.name_table()
     if os.path.exists(result_file):
         nt.load(result_file)
@@ -75,42 +71,21 @@ def main():
         for name in out_list:
             nt.add_name(name, i2a)
     else:
-        # split the file with units per processor   
+        # split the list in several batches per processor
         nb_process = os.cpu_count()
-        # prepare at most one bucket per processor 
         bucket_list = []
-        todo_list = out_list
-        for bucket_id in range(0, nb_process):
-            nb_queries = int(len(todo_list)/(nb_process - len(bucket_list)))
-            if nb_queries == 0:
-                nb_queries = 1
-            target = todo_list[-nb_queries:]
-            temp_name = temp_prefix + str(bucket_id) + "_ns_data.txt"
-            this_bucket = ns_server_lookup_bucket(bucket_id, temp_name, target, i2a)
+        for target in parallel_buckets.split_list(out_list, nb_process*parallel_buckets.TASKS_PER_PROCESS):
+            temp_name = temp_prefix + str(len(bucket_list)) + "_ns_data.txt"
+            this_bucket = ns_server_lookup_bucket(len(bucket_list), temp_name, target, i2a)
             bucket_list.append(this_bucket)
-            todo_list=todo_list[:-nb_queries]
-            if len(todo_list) == 0:
-                break
-        # launch the parallel buckets
+        # launch the parallel buckets, and load the results of each bucket
+        # as soon as it completes.
         print("Launching " + str(len(bucket_list)) + " parallel buckets")
-        with concurrent.futures.ProcessPoolExecutor(max_workers = nb_process) as executor:
-            future_to_bucket = {executor.submit(load_dns_look_up_bucket, bucket):bucket for bucket in bucket_list }
-            for future in concurrent.futures.as_completed(future_to_bucket):
-                bucket = future_to_bucket[future]
-                try:
-                    data = future.result()
-                    sys.stdout.write(".")
-                    sys.stdout.flush()
-                except Exception as exc:
-                    traceback.print_exc()
-                    print('\nBucket %d generated an exception: %s' % (bucket.bucket_id, exc))
-                    exit(1)
-        print("\nAll buckets completed.")
-        # aggregate the results
-        for bucket in bucket_list:
-            nt.load(bucket.bucket_file_name)
-            sys.stdout.write(".")
-            sys.stdout.flush()
+        completed = parallel_buckets.run_tasks(bucket_list, nb_process, merge=lambda bucket: nt.load(bucket.bucket_file_name), \
+            run=load_dns_look_up_bucket)
+        if len(completed) < len(bucket_list):
+            print("\n" + str(len(bucket_list) - len(completed)) + " buckets did not complete.")
+            exit(1)
         print("\nResults loaded from all buckets.")
     print("Processed " + str(len(nt.table)) + " names")
     nt.save(result_file)
@@ -1,16 +1,18 @@
 #!/usr/bin/python
 # coding=utf-8
 #
-# Extract name statistics from a set of files.
-# Since the number of files to merge can be quite large, we spread the processing
-# on all available cores.
+# Merge suffix detail files, in CSV or binary format (see suffix_binary.py).
+# The merge is done on register arrays, without building python objects for
+# each suffix and register. The format of the merged file is selected by its
+# name, so this can also be used to convert between CSV and binary.
+# The files are merged by pairs in parallel, see suffix_merge.py.
 
 
 import sys
-import namestats
+import suffix_binary
+import suffix_merge
 import traceback
 import time
-import concurrent.futures
 import os
 
 def usage(argv_0):
@@ -18,6 +20,7 @@ def usage(argv_0):
     print("    merged_suffix_file:  file in which all suffixes will be merged.")
     print("    nb_saved: number of suffixes to retain (0 means all).")
     print("    suffix_file*:  file in which suffixes were collected.")
+    print("Files with names ending in " + suffix_binary.BINARY_SUFFIX + " use the binary format.")
 
 # main loop
 def main():
@@ -26,13 +29,9 @@ def main():
         exit(1)
     nb_saved = int(sys.argv[2])
 
-    sublist = dict()
-    nst = namestats.namestats(sublist)
-    for suffix_file in sys.argv[3:]:
-        nst.import_suffix_file(suffix_file)
-        sys.stdout.write(".")
-        sys.stdout.flush()
-    nst.suffixes.save_suffix_summary(sys.argv[1],sort=True, eval=True, top_n=nb_saved)
+    start_time = time.time()
+    suffix_merge.merge_details_files(sys.argv[3:], sys.argv[1], nb_saved, os.cpu_count())
+    print("\nMerged " + str(len(sys.argv) - 3) + " files in " + str(time.time() - start_time))
 
 # actual main program, can be called by threads, etc.
 
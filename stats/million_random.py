@@ -1,9 +1,22 @@
 # Manage the list of a million names used for the random trials 
 # Trials are made by categories, 0 to 99, 100 to 999, etc.
+#
+# The class million_sampler replaces million_random for the daily picks of
+# do_dnslookup.py. Each name of the million list and of the zone sample has
+# an integer id, and the ids of the names not yet processed are kept in an
+# array per range, together with the position of each id in its array. A
+# pick chooses one of the non empty ranges at random, then one id in that
+# range, and removes it by moving the last id of the array in its place, so
+# that picks and removals are O(1). The non empty ranges are kept in the
+# same way. The arrays can be saved in a JSON state file, so that the next
+# run only has to remove the names found since, instead of loading and
+# filtering the million list and the zone sample again.
 
 import random
 import traceback
 import time
+import os
+import json
 import zonesampler
 
 class million_target:
@@ -155,6 +168,182 @@ class million_random(object):
     def nb_names(self):
         return self.names_count
 
+def source_signature(file_names):
+    # Name, size and modification time of the source files of a sampler.
+    signature = []
+    for file_name in file_names:
+        st = os.stat(file_name)
+        signature.append([ os.path.abspath(file_name), st.st_size, st.st_mtime_ns ])
+    return signature
+
+class million_sampler(object):
+    def __init__(self, log_first, log_val):
+        self.log_first = log_first
+        self.log_val = log_val
+        self.clear()
+
+    def clear(self):
+        self.names = []
+        self.ranks = []
+        self.name_ranges = []
+        self.ids = dict()
+        self.range_ids = []
+        self.positions = []
+        self.active = []
+        self.active_positions = []
+        self.nb_million_ranges = 0
+        self.sources = []
+
+    def add_range(self):
+        self.range_ids.append([])
+        self.active_positions.append(-1)
+        return len(self.range_ids) - 1
+
+    def add_name(self, name, million_rank, current_range):
+        name_id = len(self.names)
+        self.ids[name] = name_id
+        self.names.append(name)
+        self.ranks.append(million_rank)
+        self.name_ranges.append(current_range)
+        self.positions.append(len(self.range_ids[current_range]))
+        self.range_ids[current_range].append(name_id)
+        if self.active_positions[current_range] < 0:
+            self.active_positions[current_range] = len(self.active)
+            self.active.append(current_range)
+
+    def load(self, mfn):
+        self.clear()
+        million_rank = 0
+        current_range = self.add_range()
+        range_end = self.log_first
+        try: 
+            for line in open(mfn, "rt", encoding="utf-8"):
+                if million_rank >= range_end:
+                    current_range = self.add_range()
+                    range_end *= self.log_val
+                name = line.strip()
+                while name.endswith("."):
+                    name = name[0:-1]
+                if name != "":
+                    if not name in self.ids:
+                        self.add_name(name, million_rank, current_range)
+                    million_rank += 1
+        except Exception as e:
+            traceback.print_exc()
+            print("Cannot read file <" + mfn  + ">\nException: " + str(e))
+            print("Giving up");
+            exit(1)
+        self.nb_million_ranges = len(self.range_ids)
+        self.sources.append(mfn)
+
+    def load_zone_sample(self, zsn):
+        # The names of the zone sample that are not in the million list
+        # are added in a new range.
+        if len(self.range_ids) == 0:
+            print("Error, calling load_zone_sample before loading million.");
+            exit(1)
+        current_range = self.add_range()
+        print("Zone range: " + str(current_range))
+        try: 
+            for line in open(zsn, "rt", encoding="utf-8"):
+                zs = zonesampler.one_zone_sample("", "")
+                zs.from_json(line)
+                while zs.domain.endswith("."):
+                    zs.domain = zs.domain[0:-1]
+                if zs.domain != "" and not zs.domain in self.ids:
+                    self.add_name(zs.domain, -1, current_range)
+        except Exception as e:
+            traceback.print_exc()
+            print("Cannot read file <" + zsn  + ">\nException: " + str(e))
+            print("Giving up");
+            exit(1)
+        self.sources.append(zsn)
+
+    def remove_id(self, name_id):
+        a = self.name_ranges[name_id]
+        ids = self.range_ids[a]
+        p = self.positions[name_id]
+        last_id = ids.pop()
+        if last_id != name_id:
+            ids[p] = last_id
+            self.positions[last_id] = p
+        self.positions[name_id] = -1
+        if len(ids) == 0:
+            p = self.active_positions[a]
+            last_range = self.active.pop()
+            if last_range != a:
+                self.active[p] = last_range
+                self.active_positions[last_range] = p
+            self.active_positions[a] = -1
+
+    def mark_read(self, name):
+        name_id = self.ids.get(name)
+        if name_id is not None and self.positions[name_id] >= 0:
+            self.remove_id(name_id)
+
+    def random_pick(self):
+        # Pick a non empty range, then a name in that range, and remove it.
+        if len(self.active) == 0:
+            print("Error: trying to get pick from empty list!")
+            return million_target("", 0, 0)
+        a = self.active[random.randrange(0, len(self.active))]
+        ids = self.range_ids[a]
+        name_id = ids[random.randrange(0, len(ids))]
+        self.remove_id(name_id)
+        return million_target(self.names[name_id], self.ranks[name_id], a)
+
+    def nb_ranges(self):
+        return len(self.range_ids)
+
+    def nb_names(self):
+        return sum(len(ids) for ids in self.range_ids)
+
+    def save_state(self, file_name, nb_found):
+        # nb_found is the number of domains found in the result file when
+        # the names were marked as read.
+        sd = { "log_first": self.log_first, "log_val": self.log_val, \
+            "sources": source_signature(self.sources), "nb_million_ranges": self.nb_million_ranges, \
+            "nb_found": nb_found, "names": self.names, "ranks": self.ranks, \
+            "name_ranges": self.name_ranges, "range_ids": self.range_ids }
+        with open(file_name + ".tmp", "wt", encoding="utf-8") as F:
+            json.dump(sd, F)
+        os.replace(file_name + ".tmp", file_name)
+
+    def load_state(self, file_name, source_files, nb_found):
+        # Returns False if the file cannot be loaded, was made from other
+        # source files, or if fewer domains are found than when it was
+        # saved. In that case, the sampler is empty.
+        try:
+            with open(file_name, "rt", encoding="utf-8") as F:
+                sd = json.load(F)
+            if sd["log_first"] != self.log_first or sd["log_val"] != self.log_val or \
+                sd["sources"] != source_signature(source_files) or sd["nb_found"] > nb_found:
+                print("The sampler state in " + file_name + " does not match the sources.")
+                return False
+            self.clear()
+            self.names = sd["names"]
+            self.ranks = sd["ranks"]
+            self.name_ranges = sd["name_ranges"]
+            self.nb_million_ranges = sd["nb_million_ranges"]
+            self.sources = list(source_files)
+            self.ids = dict((name, name_id) for name_id, name in enumerate(self.names))
+            self.positions = [ -1 ]*len(self.names)
+            self.active_positions = [ -1 ]*len(sd["range_ids"])
+            self.range_ids = sd["range_ids"]
+            for a in range(0, len(self.range_ids)):
+                for p in range(0, len(self.range_ids[a])):
+                    self.positions[self.range_ids[a][p]] = p
+                if len(self.range_ids[a]) > 0:
+                    self.active_positions[a] = len(self.active)
+                    self.active.append(a)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print("Cannot load sampler state from " + file_name + ", exception: " + str(e))
+            self.clear()
+            return False
+        return True
+
 class million_time(object):
     def __init__(self):
         self.mdict = dict()
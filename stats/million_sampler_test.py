@@ -0,0 +1,111 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Unit test of the million_sampler class.
+#
+# A million list of 1500 names, with a duplicate and trailing dots, and a
+# zone sample that repeats some of the million names are written in the
+# temporary directory. After marking some names as read, picking all the
+# remaining names must return each of them once, in the range computed by
+# million_random.million_dict, or in the zone range for the names that
+# are only in the zone sample. The state saved after marking the names
+# must give the same remaining names when loaded, and must be rejected
+# if the zone sample changes or if fewer names are found.
+#
+# Expect this test to work:
+#
+# py .\million_sampler_test.py ..\tmp\
+
+import sys
+import os
+import random
+import million_random
+
+def remaining(mr):
+    return sorted(mr.names[name_id] for ids in mr.range_ids for name_id in ids)
+
+def pick_all(label, mr, expected, md, zone_range):
+    ret = True
+    picked = set()
+    while mr.nb_names() > 0:
+        target = mr.random_pick()
+        expected_range = md.get(target.domain, zone_range)
+        if target.domain in picked or not target.domain in expected or target.million_range != expected_range:
+            print(label + ": unexpected pick " + target.domain + ", range " + str(target.million_range))
+            ret = False
+            break
+        picked.add(target.domain)
+    if ret and picked != expected:
+        print(label + ": picked " + str(len(picked)) + " names instead of " + str(len(expected)))
+        ret = False
+    if ret and mr.random_pick().domain != "":
+        print(label + ": pick from empty sampler.")
+        ret = False
+    return ret
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: " + sys.argv[0] + " tmp_dir")
+        exit(1)
+    temp_prefix = os.path.join(sys.argv[1], "million_sampler_test_")
+    million_file = temp_prefix + "million.txt"
+    zone_file = temp_prefix + "zone.txt"
+    state_file = temp_prefix + "state.json"
+    if os.path.isfile(state_file):
+        os.remove(state_file)
+    ret = True
+
+    million = [ "m" + str(i) + ".com" for i in range(0, 1500) ]
+    with open(million_file, "wt") as f:
+        for i in range(0, len(million)):
+            f.write(million[i] + ("." if i%7 == 0 else "") + "\n")
+        f.write(million[5] + "\n")
+    zone = [ "z" + str(i) + ".com" for i in range(0, 300) ]
+    with open(zone_file, "wt") as f:
+        for name in zone + million[0:50]:
+            f.write("{\"domain\":\"" + name + ".\",\"ns\":[\"ns1." + name + "\"]}\n")
+    md, nb_md = million_random.million_dict(million_file, 100, 10)
+    zone_range = nb_md
+
+    rd = random.Random(1234)
+    found = set(rd.sample(million + zone, 400))
+    expected = set(million + zone) - found
+
+    mr = million_random.million_sampler(100, 10)
+    mr.load(million_file)
+    mr.load_zone_sample(zone_file)
+    if mr.nb_ranges() != nb_md + 1:
+        print("Found " + str(mr.nb_ranges()) + " ranges instead of " + str(nb_md + 1))
+        ret = False
+    for name in found:
+        mr.mark_read(name)
+    mr.mark_read("unknown.example")
+    mr.save_state(state_file, len(found))
+    ret &= pick_all("loaded", mr, expected, md, zone_range)
+
+    mr = million_random.million_sampler(100, 10)
+    if not mr.load_state(state_file, [ million_file, zone_file ], len(found)):
+        print("Cannot load the state from " + state_file)
+        ret = False
+    elif remaining(mr) != sorted(expected):
+        print("State has " + str(mr.nb_names()) + " names instead of " + str(len(expected)))
+        ret = False
+    else:
+        ret &= pick_all("state", mr, expected, md, zone_range)
+
+    if million_random.million_sampler(100, 10).load_state(state_file, [ million_file, zone_file ], len(found) - 1):
+        print("State accepted with fewer names found.")
+        ret = False
+    with open(zone_file, "at") as f:
+        f.write("{\"domain\":\"new.com.\",\"ns\":[\"ns1.new.com\"]}\n")
+    if million_random.million_sampler(100, 10).load_state(state_file, [ million_file, zone_file ], len(found)):
+        print("State accepted after the zone sample changed.")
+        ret = False
+
+    if not ret:
+        exit(1)
+    print("Picked " + str(len(expected)) + " names from " + str(nb_md + 1) + " ranges.")
+    exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,7 @@ import nameparse
 import ipaddress
 import suffixes
 import gzip
+import io
 import traceback
 
 def subnet_dict_from_file(file_name):
@@ -39,13 +40,20 @@ class dga13maybe:
         self.ip = ""
         self.count = 0
 
+# Parameters of the suffix details
+HLL_K = 4
+MAX_SUFFIX_PARTS = 3
+# Number of subnames hashed together, see suffixes.suffix_details_file.
+SUBNAME_BATCH = 4096
+
 class namestats:
-    def __init__(self, sublist):
+    def __init__(self, sublist, max_suffixes=0):
         #self.list = dict()
         self.sum_by_cat = dict()
         self.maybe_dga = dict()
         self.dga_count = 0
-        self.suffixes = suffixes.suffix_details_file(4, 3)
+        # if max_suffixes > 0, only the most frequent suffixes are kept
+        self.suffixes = suffixes.suffix_details_file(HLL_K, MAX_SUFFIX_PARTS, max_entries=max_suffixes, batch_size=SUBNAME_BATCH)
         self.sublist = sublist
         self.p0_count = []
         for i in range(0,64):
@@ -135,6 +143,12 @@ class namestats:
             print("Giving up");
             exit(1) 
 
+    def load_logchunk(self, chunk):
+        # Parse a chunk of complete lines read by parallel_buckets.line_chunks,
+        # decoded as in gzip.open(logfile, 'rt').
+        for line in io.TextIOWrapper(io.BytesIO(chunk)):
+            self.load_logline(line)
+
     def load_logfile(self, logfile):
         if logfile.endswith(".gz"):
             self.load_logfile_gz(logfile)
@@ -186,8 +200,13 @@ class namestats:
                 print("Unexpected table in " + result_file + "\n" + line + "\ngiving up")
                 exit(1)
                 
-    def export_suffix_file(self, suffix_file, need_sort=False):
-        self.suffixes.save(suffix_file)
+    def partition_suffixes(self, partition_files):
+        # Write the suffix contributions in partition files instead of
+        # adding them to the suffix details, see suffixes.suffix_partition_file.
+        self.suffixes = suffixes.suffix_partition_file(HLL_K, MAX_SUFFIX_PARTS, partition_files)
+
+    def export_suffix_file(self, suffix_file, need_sort=False, nb_top=10000):
+        self.suffixes.save(suffix_file, nb_top=nb_top)
 
     def import_suffix_file(self, suffix_file):
         self.suffixes.parse(suffix_file)
\ No newline at end of file
@@ -26,18 +26,12 @@ class ns_dict:
 
     def load_ns_file(self, ns_json, dot_after=0):
         loaded = 0
-        for line in open(ns_json, "rt"):
+        for ns_item in dnslook.decode_lines(open(ns_json, "rt")):
             loaded += 1
-            ns_item = dnslook.dnslook()
-            try:
-                ns_item.from_json(line)
-                if ns_item.domain in self.d:
-                    self.nb_duplicate += 1
-                else:
-                    self.d[ns_item.domain] = ns_item
-            except Exception as e:
-                traceback.print_exc()
-                print("Cannot parse <" + line  + ">\nException: " + str(e))
+            if ns_item.domain in self.d:
+                self.nb_duplicate += 1
+            else:
+                self.d[ns_item.domain] = ns_item
             if dot_after > 0 and loaded%dot_after == 0:
                 sys.stdout.write(".")
                 sys.stdout.flush()
@@ -2,12 +2,49 @@
 # coding=utf-8
 #
 # Generic handling of input parallelism
+#
+# A bucket is an object with the methods "load()", which processes its
+# input, and "save()", which writes the results in temporary files. The
+# buckets are pickled and run in worker processes, and the main process
+# then reads the temporary files.
+#
+# The sizes of the input files vary a lot, and so do the DNS latencies
+# of lookup targets. If the input is cut in exactly one bucket per
+# process, the slowest bucket decides of the total time. Instead, the
+# input is split in many small tasks, several per process, with
+# "split_list" for lists of targets or "group_files" for input files.
+# "run_tasks" keeps a pool of workers busy: a worker takes the next task
+# as soon as it is done with the previous one, and the results of each
+# task are merged as soon as it completes, while the other tasks are
+# still running.
+#
+# A single large file, such as the compressed name list of a busy
+# instance, would still keep one worker busy for a long time. A deflate
+# stream cannot be restarted in the middle, so the file is read in this
+# process, decompressed if needed, and cut by "line_chunks" in chunks
+# of complete lines, which are sent to the workers as tasks. The tasks
+# can be produced by a generator, which "run_tasks" only reads as
+# workers become available, so that the file is decompressed while the
+# previous chunks are being parsed.
+#
+# Merging many partial results, such as the suffix files of all the
+# instances for a month, is another long serial pass. "reduce_tree"
+# merges them by small groups in the pool, then merges the results of
+# these merges, and so on, so that the number of partial results is
+# divided by the group size at each level.
 
 import concurrent.futures
+import heapq
+import gzip
 import sys
 import os
 import traceback
 
+# Number of tasks per process when splitting the work.
+TASKS_PER_PROCESS = 8
+# Size of the chunks of large files, in uncompressed bytes.
+CHUNK_SIZE = 1<<24
+
 def load_bucket(bucket):
     bucket.load()
     bucket.save()
@@ -31,15 +68,199 @@ def init_buckets(bucket_class, max_buckets, files, params):
         buckets_left -= 1
     return bucket_list
 
-def run_buckets(bucket_list):
-    with concurrent.futures.ProcessPoolExecutor(max_workers = len(bucket_list)) as executor:
-        future_to_bucket = {executor.submit(load_bucket, bucket):bucket for bucket in bucket_list }
-        for future in concurrent.futures.as_completed(future_to_bucket):
-            bucket = future_to_bucket[future]
-            try:
-                data = future.result()
+def init_tasks(bucket_class, nb_process, files, params, tasks_per_process=TASKS_PER_PROCESS):
+    # Same as init_buckets, but with up to tasks_per_process buckets per
+    # process, with files grouped by size, largest first.
+    bucket_list=[]
+    for bucket_id, task_files in enumerate(group_files(files, nb_process*tasks_per_process)):
+        bucket = bucket_class()
+        bucket.bucket_id = bucket_id
+        bucket.input_files = task_files
+        bucket.complete_init(params)
+        bucket_list.append(bucket)
+    return bucket_list
+
+def init_chunk_tasks(bucket_class, nb_process, files, params, tasks_per_process=TASKS_PER_PROCESS, chunk_size=CHUNK_SIZE):
+    # Generator of buckets, as init_tasks, except that the files larger
+    # than the share of one process are cut in chunks. The bucket for a
+    # chunk has the file name in "input_files" and the data in
+    # "input_chunk", which its "load" method must parse instead of the
+    # file. The chunks are read as the buckets are requested.
+    large, small = large_files(files, nb_process)
+    bucket_id = 0
+    for task_files in group_files(small, nb_process*tasks_per_process):
+        bucket = bucket_class()
+        bucket.bucket_id = bucket_id
+        bucket.input_files = task_files
+        bucket.complete_init(params)
+        bucket_id += 1
+        yield bucket
+    for file_name in large:
+        for chunk in line_chunks(file_name, chunk_size=chunk_size):
+            bucket = bucket_class()
+            bucket.bucket_id = bucket_id
+            bucket.input_files = [ file_name ]
+            bucket.input_chunk = chunk
+            bucket.complete_init(params)
+            bucket_id += 1
+            yield bucket
+
+def nb_tasks_for(nb_items, nb_process, tasks_per_process=TASKS_PER_PROCESS, min_items_per_task=1):
+    nb_tasks = min(nb_process*tasks_per_process, nb_items//max(1, min_items_per_task))
+    return max(1, nb_tasks)
+
+def split_list(items, nb_tasks):
+    # Split the list in at most nb_tasks slices of almost equal sizes,
+    # in the order of the list.
+    nb_tasks = max(1, min(nb_tasks, len(items)))
+    slices = []
+    start = 0
+    for task_id in range(0, nb_tasks):
+        end = start + (len(items) - start)//(nb_tasks - task_id)
+        slices.append(items[start:end])
+        start = end
+    return slices
+
+def file_size(file_name):
+    try:
+        return os.path.getsize(file_name)
+    except OSError:
+        return 0
+
+def group_files(files, nb_tasks):
+    # Group the files in at most nb_tasks lists of similar total size.
+    # Each file goes to the group with the smallest total so far, largest
+    # files first, and the groups are returned largest first, so that the
+    # longest tasks start first.
+    sized = sorted([(file_size(f), i, f) for i, f in enumerate(files)], reverse=True)
+    nb_tasks = max(1, min(nb_tasks, len(files)))
+    heap = [(0, task_id) for task_id in range(0, nb_tasks)]
+    groups = [[] for task_id in range(0, nb_tasks)]
+    totals = [0]*nb_tasks
+    for size, i, f in sized:
+        total, task_id = heapq.heappop(heap)
+        groups[task_id].append(f)
+        totals[task_id] = total + size
+        heapq.heappush(heap, (totals[task_id], task_id))
+    order = sorted(range(0, nb_tasks), key=lambda task_id: totals[task_id], reverse=True)
+    return [groups[task_id] for task_id in order if len(groups[task_id]) > 0]
+
+def large_files(files, nb_process):
+    # Files larger than the share of one process are worth cutting in
+    # chunks, the other ones are processed whole.
+    total = sum(file_size(f) for f in files)
+    large = [f for f in files if nb_process > 1 and file_size(f) > total/nb_process]
+    small = [f for f in files if not f in large]
+    return large, small
+
+def line_chunks(file_name, chunk_size=CHUNK_SIZE):
+    # Yield the content of a text file, decompressed if the name ends with
+    # ".gz", in chunks of about chunk_size bytes ending at an end of line.
+    if file_name.endswith(".gz"):
+        f = gzip.open(file_name, "rb")
+    else:
+        f = open(file_name, "rb")
+    with f:
+        carry = b""
+        eof = False
+        while not eof:
+            # read returns less than asked at the end of gzip buffers
+            parts = [carry]
+            size = 0
+            while size < chunk_size:
+                data = f.read(chunk_size - size)
+                if len(data) == 0:
+                    eof = True
+                    break
+                parts.append(data)
+                size += len(data)
+            buf = b"".join(parts)
+            if eof:
+                last = len(buf)
+            else:
+                # lines longer than chunk_size make larger chunks
+                last = buf.rfind(b"\n") + 1
+            if last > 0:
+                yield buf[:last]
+            carry = buf[last:]
+
+def run_tasks(task_list, nb_process, merge=None, run=load_bucket, max_pending=0):
+    # Run "run(task)" for each task in a pool of nb_process workers. The
+    # tasks are submitted in the order of the list, or of the generator,
+    # keeping at most max_pending tasks (by default, 2 per process)
+    # submitted but not completed, so that the pickled inputs of all the
+    # tasks are not queued at once. When a task completes, "merge(task)"
+    # is called in this process, in the order of completion. Returns the
+    # list of the tasks that completed without exception.
+    completed = []
+    if hasattr(task_list, "__len__"):
+        if len(task_list) == 0:
+            return completed
+        nb_process = min(nb_process, len(task_list))
+    nb_process = max(1, nb_process)
+    if max_pending <= 0:
+        max_pending = 2*nb_process
+    tasks = iter(task_list)
+    has_more = True
+    next_id = 0
+    future_to_task = dict()
+    with concurrent.futures.ProcessPoolExecutor(max_workers = nb_process) as executor:
+        while has_more or len(future_to_task) > 0:
+            while has_more and len(future_to_task) < max_pending:
+                try:
+                    task = next(tasks)
+                except StopIteration:
+                    has_more = False
+                    break
+                future_to_task[executor.submit(run, task)] = (next_id, task)
+                next_id += 1
+            if len(future_to_task) == 0:
+                break
+            done, not_done = concurrent.futures.wait(future_to_task, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                task_id, task = future_to_task.pop(future)
+                try:
+                    future.result()
+                except Exception as exc:
+                    traceback.print_exc()
+                    print('\nTask %d generated an exception: %s' % (task_id, exc))
+                    continue
+                completed.append(task)
+                if merge is not None:
+                    merge(task)
                 sys.stdout.write(".")
                 sys.stdout.flush()
-            except Exception as exc:
-                traceback.print_exc()
-                print('\nBucket %d generated an exception: %s' % (bucket.bucket_id, exc))
+    return completed
+
+def run_buckets(bucket_list):
+    return run_tasks(bucket_list, len(bucket_list))
+
+def reduce_tree(inputs, nb_process, new_task, fan_in=2):
+    # Merge the inputs by groups of fan_in in a pool of nb_process workers,
+    # level by level, until at most fan_in inputs remain, and return them
+    # for the final merge by the caller. "new_task(level, task_id, group)"
+    # returns a task merging the inputs in "group", whose "output"
+    # attribute is the input for the next level. If a task fails, its
+    # inputs are passed to the next level instead.
+    fan_in = max(2, fan_in)
+    level = 0
+    while len(inputs) > fan_in and nb_process > 1:
+        next_inputs = []
+        tasks = []
+        for task_id, start in enumerate(range(0, len(inputs), fan_in)):
+            group = inputs[start:start + fan_in]
+            if len(group) == 1:
+                next_inputs.append(group[0])
+            else:
+                tasks.append((new_task(level, task_id, group), group))
+        completed = run_tasks([task for task, group in tasks], nb_process)
+        if len(completed) == 0:
+            break
+        for task, group in tasks:
+            if task in completed:
+                next_inputs.append(task.output)
+            else:
+                next_inputs += group
+        inputs = next_inputs
+        level += 1
+    return inputs
@@ -0,0 +1,162 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Unit test of the task scheduler in parallel_buckets.
+#
+# The test creates text files of very different sizes, and groups them
+# in tasks that count the lines of their files. The tasks run in a pool
+# of 2 processes, with more tasks than the number of tasks submitted at
+# a time, and the counts are merged as the tasks complete. The total must
+# match the number of lines written. A task that reads a missing file
+# fails, and must not be merged. The test also checks that split_list
+# and group_files keep all the items, and that line_chunks cuts plain and
+# compressed files in chunks of complete lines. The count is then done
+# again with the large files cut in chunks by init_chunk_tasks.
+#
+# Expect this test to work:
+#
+# py .\parallel_buckets_test.py ..\tmp\
+
+import sys
+import os
+import gzip
+import parallel_buckets
+
+class line_count_bucket:
+    def __init__(self):
+        self.bucket_id = 0
+        self.input_files = []
+        self.input_chunk = None
+        self.result_file_name = ""
+        self.nb_lines = 0
+
+    def complete_init(self, temp_prefix):
+        self.result_file_name = temp_prefix + str(self.bucket_id) + "_lines.txt"
+
+    def load(self):
+        if self.input_chunk is not None:
+            self.nb_lines += self.input_chunk.count(b"\n")
+            return
+        for input_file in self.input_files:
+            if input_file.endswith(".gz"):
+                f = gzip.open(input_file, "rt")
+            else:
+                f = open(input_file, "rt")
+            for line in f:
+                self.nb_lines += 1
+            f.close()
+
+    def save(self):
+        with open(self.result_file_name, "wt") as f:
+            f.write(str(self.nb_lines) + "\n")
+
+class line_count_total:
+    def __init__(self):
+        self.nb_lines = 0
+        self.merged = []
+
+    def merge(self, bucket):
+        for line in open(bucket.result_file_name, "rt"):
+            self.nb_lines += int(line.strip())
+        self.merged.append(bucket.bucket_id)
+
+def check_split(items, nb_tasks):
+    slices = parallel_buckets.split_list(items, nb_tasks)
+    sizes = [len(x) for x in slices]
+    joined = []
+    for x in slices:
+        joined += x
+    if joined != items or len(slices) > max(1, nb_tasks) or (len(items) > 0 and max(sizes) - min(sizes) > 1):
+        print("split_list(" + str(len(items)) + ", " + str(nb_tasks) + ") returns sizes " + str(sizes))
+        return False
+    return True
+
+def check_chunks(file_name, chunk_size):
+    if file_name.endswith(".gz"):
+        data = gzip.open(file_name, "rb").read()
+    else:
+        data = open(file_name, "rb").read()
+    chunks = list(parallel_buckets.line_chunks(file_name, chunk_size=chunk_size))
+    if b"".join(chunks) != data or not all(c.endswith(b"\n") for c in chunks) or \
+        len(chunks) < len(data)//(2*chunk_size):
+        print("line_chunks(" + file_name + ", " + str(chunk_size) + ") returns " + str(len(chunks)) + " chunks.")
+        return False
+    return True
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: " + sys.argv[0] + " tmp_dir")
+        exit(1)
+    temp_prefix = os.path.join(sys.argv[1], "parallel_buckets_test_")
+    ret = True
+
+    for nb_items, nb_tasks in [ (0, 4), (3, 8), (10, 4), (100, 7), (17, 17) ]:
+        ret &= check_split(list(range(0, nb_items)), nb_tasks)
+
+    files = []
+    nb_lines = 0
+    for i in range(0, 20):
+        file_name = temp_prefix + "in_" + str(i) + ".txt"
+        n = 10 if i%5 != 0 else 500 + 100*i
+        with open(file_name, "wt") as f:
+            for j in range(0, n):
+                f.write("line " + str(j) + "\n")
+        nb_lines += n
+        files.append(file_name)
+    # one very large compressed file
+    file_name = temp_prefix + "in_large.txt.gz"
+    with gzip.open(file_name, "wt") as f:
+        for j in range(0, 50000):
+            f.write("large line " + str(j) + "\n")
+    nb_lines += 50000
+    files.append(file_name)
+
+    for chunk_size in [ 100, 1000, 1<<16 ]:
+        ret &= check_chunks(files[0], chunk_size)
+        ret &= check_chunks(file_name, chunk_size)
+
+    groups = parallel_buckets.group_files(files, 6)
+    grouped = sorted(f for g in groups for f in g)
+    sizes = [sum(os.path.getsize(f) for f in g) for g in groups]
+    if grouped != sorted(files) or len(groups) != 6 or sizes != sorted(sizes, reverse=True):
+        print("group_files returns " + str(len(groups)) + " groups, sizes: " + str(sizes))
+        ret = False
+
+    bucket_list = parallel_buckets.init_tasks(line_count_bucket, 2, files, temp_prefix, tasks_per_process=4)
+    failing = line_count_bucket()
+    failing.bucket_id = len(bucket_list)
+    failing.input_files = [ temp_prefix + "missing.txt" ]
+    failing.complete_init(temp_prefix)
+    bucket_list.append(failing)
+
+    total = line_count_total()
+    completed = parallel_buckets.run_tasks(bucket_list, 2, merge=total.merge)
+    print("")
+    if len(completed) != len(bucket_list) - 1 or failing.bucket_id in total.merged:
+        print("Completed " + str(len(completed)) + " tasks out of " + str(len(bucket_list)) + ", merged: " + str(total.merged))
+        ret = False
+    if total.nb_lines != nb_lines:
+        print("Counted " + str(total.nb_lines) + " lines instead of " + str(nb_lines))
+        ret = False
+    else:
+        print("Counted " + str(nb_lines) + " lines in " + str(len(completed)) + " tasks.")
+
+    # the large file is cut in chunks, the buckets are generated as needed
+    large, small = parallel_buckets.large_files(files, 2)
+    total = line_count_total()
+    bucket_list = parallel_buckets.init_chunk_tasks(line_count_bucket, 2, files, temp_prefix, tasks_per_process=4, chunk_size=1<<16)
+    completed = parallel_buckets.run_tasks(bucket_list, 2, merge=total.merge)
+    print("")
+    if large != [ file_name ] or total.nb_lines != nb_lines or len(completed) < 8:
+        print("With chunks, counted " + str(total.nb_lines) + " lines instead of " + str(nb_lines) + " in " + str(len(completed)) + " tasks")
+        ret = False
+    else:
+        print("With chunks, counted " + str(nb_lines) + " lines in " + str(len(completed)) + " tasks.")
+
+    if not ret:
+        exit(1)
+    else:
+        exit(0)
+
+if __name__ == '__main__':
+    main()
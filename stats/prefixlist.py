@@ -8,7 +8,7 @@ import nameparse
 import hyperloglog
 import gzip
 import traceback
-import functools
+import ranking
 import sys
 
 # Unified list of prefixes
@@ -70,6 +70,10 @@ class suffix_summary_entry:
             success = False
         return success
 
+def subs_key(item):
+    # Sort key with the same order as compare_by_subs.
+    return (item.evaluate(), item.suffix)
+
 def compare_by_subs(item, other):
     n1 = item.evaluate()
     n2 = other.evaluate()
@@ -179,9 +183,9 @@ class suffix_summary_file:
         if top_n > 0 or sort:
             print("sorting")
             if by_hits:
-                flat.sort(key=hits, reverse=True)
+                flat = ranking.top_n(flat, lambda sse: sse.hits, top_n)
             else:
-                flat.sort(key=functools.cmp_to_key(compare_by_subs), reverse=True)
+                flat = ranking.top_n(flat, subs_key, top_n)
             print("sorted")
         if top_n == 0:
             top_n = len(flat)
@@ -207,17 +211,14 @@ class suffix_summary_sorter:
 
     def sort_and_filter(self):       
         if self.need_sort:
-            self.list.sort(key=functools.cmp_to_key(compare_by_subs), reverse=True)
+            self.list = ranking.top_n(self.list, subs_key)
 
     def add_file_entries_to_summary(self):
         # First add the summary to the in_file list
         for suffix in self.summary:
             self.in_file.append(self.summary[suffix])
-        # Sort the file list
-        self.in_file.sort(key=functools.cmp_to_key(compare_by_subs), reverse=True)
-        # Trim to top N
-        if self.top_n > 0:
-            self.in_file = self.in_file[0:self.top_n]
+        # Sort the file list and trim to top N
+        self.in_file = ranking.top_n(self.in_file, subs_key, self.top_n)
         # Reset the summary
         self.summary = dict()
         if self.top_n <= 0 or len(self.summary) < self.top_n or len(self.in_file) == 0:
@@ -267,11 +268,11 @@ class suffix_summary_sorter:
         flat = list(self.summary.values())
         if top_n > 0:
             print("sorting")
-            flat.sort(key=functools.cmp_to_key(compare_by_subs), reverse=True)
+            flat = ranking.top_n(flat, subs_key, top_n)
             print("sorted")
         if top_n == 0:
-            top_n = len(self.list)
+            top_n = len(flat)
         print("saving " + str(self.top_n))
-        suffix_summary_file.save_list(self.list[0:top_n], file_name)
+        suffix_summary_file.save_list(flat[0:top_n], file_name)
         print("saved")
 
@@ -4,6 +4,9 @@
 # The module provides functions to manage the public suffix list
 
 import traceback
+import collections
+import concurrent.futures
+import os
 
 def is_ascii(s):
     return all(ord(c) < 128 for c in s)
@@ -27,9 +30,54 @@ def parts_to_domain(np):
                 z += p
     return z
 
+# The suffix function is called once or more per record when parsing zone
+# files or DNS results, i.e., hundreds of millions of times. To speed it up,
+# the table is complemented by a trie of labels, starting from the TLD, and
+# by a bounded LRU memo of the results, keyed on the cleaned name, because
+# names like the NS host names repeat a lot.
+#
+# Each trie node is a list [s_class, children], where s_class is the class
+# of the table entry ending at that node (None if there is no such entry),
+# and children is a dictionary of label to node. The deepest node with a
+# class along the path of the name labels is the longest suffix of the name
+# present in the table, i.e. the first match found by scanning the table
+# from the full name down. The result is then obtained with "apply_match",
+# exactly as in the table scan.
+
+# Workers for suffix_many. The table is sent once to each process of the
+# pool by the initializer, which keeps it in "worker_ps", and each task
+# only carries a chunk of cleaned names.
+worker_ps = None
+
+def init_suffix_worker(ps):
+    global worker_ps
+    worker_ps = ps
+
+def suffix_chunk(ps, names):
+    return [ps.suffix_trie(n) for n in names]
+
+def suffix_worker_chunk(names):
+    if worker_ps.trie is None:
+        worker_ps.build_trie()
+    return suffix_chunk(worker_ps, names)
+
 class public_suffix:
-    def __init__(self):
+    def __init__(self, memo_size=65536):
         self.table = dict()
+        self.trie = None
+        self.memo = collections.OrderedDict()
+        self.memo_size = memo_size
+
+    def __getstate__(self):
+        # Only the table is pickled, e.g., when sent to a worker process:
+        # the trie is rebuilt when first needed, and the memo starts empty.
+        return { "table": self.table, "memo_size": self.memo_size }
+
+    def __setstate__(self, state):
+        self.table = state["table"]
+        self.memo_size = state["memo_size"]
+        self.trie = None
+        self.memo = collections.OrderedDict()
 
     def load_file(self, file_name):
         ret = True
@@ -51,8 +99,20 @@ class public_suffix:
             traceback.print_exc()
             print("Cannot load <" + file_name + ">: " + str(e))
             ret = False
+        self.build_trie()
         return(ret)
 
+    def build_trie(self):
+        self.trie = [None, dict()]
+        self.memo = collections.OrderedDict()
+        for z in self.table:
+            node = self.trie
+            for label in reversed(z.split(".")):
+                if not label in node[1]:
+                    node[1][label] = [None, dict()]
+                node = node[1][label]
+            node[0] = self.table[z]
+
     # Algorithm
     #
     # Match domain against all rules and take note of the matching ones.
@@ -66,12 +126,8 @@ class public_suffix:
     def clean_name(name):
         n = ""
         try:
-            if is_ascii(name):
-                n = name.lower()
-            while n.startswith("."):
-                n = n[1:]
-            while n.endswith("."):
-                n = n[:-1]
+            if name.isascii():
+                n = name.lower().strip(".")
         except:
             traceback.print_exc()
             print("Cannot clean up the name: " + str(name) + ", " + name)
@@ -134,9 +190,70 @@ class public_suffix:
         return x,is_suffix
 
     def suffix(self, name, test=False):
+        n = public_suffix.clean_name(name)
+        if test:
+            return self.suffix_scan(n, test)
+        if n in self.memo:
+            self.memo.move_to_end(n)
+            return self.memo[n]
+        if self.trie is None:
+            self.build_trie()
+        r = self.suffix_trie(n)
+        self.memo[n] = r
+        if len(self.memo) > self.memo_size:
+            self.memo.popitem(last=False)
+        return r
+
+    def suffix_many(self, names, nb_process=1, parallel_threshold=1000000, chunk_size=100000):
+        # Batch version of "suffix", returns a list of (x, is_suffix) tuples
+        # aligned with the list of names. Each distinct name is cleaned and
+        # resolved only once, and the memo used by "suffix" is left alone.
+        # If there are more than parallel_threshold distinct names and more
+        # than one process is allowed, the chunks are resolved in a pool of
+        # nb_process processes (0 means one per core).
+        if self.trie is None:
+            self.build_trie()
+        cleaned = dict()
+        for name in names:
+            if not name in cleaned:
+                cleaned[name] = public_suffix.clean_name(name)
+        distinct = list(set(cleaned.values()))
+        if nb_process == 0:
+            nb_process = os.cpu_count()
+        if nb_process > 1 and len(distinct) > parallel_threshold:
+            chunks = [distinct[i:i+chunk_size] for i in range(0, len(distinct), chunk_size)]
+            resolved = []
+            with concurrent.futures.ProcessPoolExecutor(max_workers = nb_process, \
+                initializer=init_suffix_worker, initargs=(self,)) as executor:
+                for r in executor.map(suffix_worker_chunk, chunks):
+                    resolved += r
+        else:
+            resolved = suffix_chunk(self, distinct)
+        results = dict(zip(distinct, resolved))
+        return [results[cleaned[name]] for name in names]
+
+    def suffix_trie(self, n):
+        # single pass over the labels, from the TLD down.
+        nameparts = n.split(".")
+        node = self.trie
+        trying = len(nameparts)
+        matched = -1
+        while trying > 0:
+            label = nameparts[trying - 1]
+            if not label in node[1]:
+                break
+            node = node[1][label]
+            trying -= 1
+            if node[0] is not None:
+                matched = trying
+        if matched < 0:
+            return self.default_match(n)
+        return self.apply_match(".".join(nameparts[matched:]), nameparts[0:matched])
+
+    def suffix_scan(self, n, test=False):
+        # Scan the table for the longest suffix of the cleaned name n.
         x = "" 
         is_suffix = False
-        n = public_suffix.clean_name(name)
 
         nameparts = n.split(".")
         if test:
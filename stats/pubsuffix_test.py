@@ -19,6 +19,9 @@ def checkPublicSuffix(d, x):
     if not pubsuffix.is_ascii(d):
         return
     y,is_suffix = ps.suffix(d)
+    if (y,is_suffix) != ps.suffix_scan(pubsuffix.public_suffix.clean_name(d)):
+        print("For <" + d + "> trie and table scan differ.")
+        exit(1)
     if x != y:
         print("For <" + d + "> expected <" + x + "> got <" + y + "," + str(is_suffix) + ">")
         ps.suffix(d, test=True)
@@ -156,10 +159,13 @@ if test_sample_file != "":
     perf_start = time.time()
     nb_success = 0
     nb_total = 0
+    names = []
     for line in open(test_sample_file, "rt", encoding="utf-8"):
         try:
             nb_total += 1
-            name = line.strip()
+            # Sample files can be name lists or CSV files starting with the name
+            name = line.split(",")[0].strip()
+            names.append(name)
             x,is_success = ps.suffix(name)
             if is_success:
                 nb_success += 1
@@ -171,6 +177,29 @@ if test_sample_file != "":
     perf_done = time.time()
     print("Processed " + str(nb_total) + " lines, " + str(nb_success) + " success, in " + str(perf_done-perf_start))
 
+    # Verify that the trie and the memo give the same results as the table scan.
+    for name in names:
+        if ps.suffix(name) != ps.suffix_scan(pubsuffix.public_suffix.clean_name(name)):
+            print("For <" + name + "> trie and table scan differ.")
+            exit(1)
+    print("Trie and table scan match for " + str(len(names)) + " names.")
+
+    # Verify the batch API, and measure its throughput on its own.
+    batch_start = time.time()
+    batch = ps.suffix_many(names)
+    batch_done = time.time()
+    for i in range(0, len(names)):
+        if batch[i] != ps.suffix(names[i]):
+            print("For <" + names[i] + "> batch and single lookups differ.")
+            exit(1)
+    print("Batch processed " + str(len(names)) + " names in " + str(batch_done - batch_start))
+
+    # Verify the batch API in a pool of worker processes.
+    if ps.suffix_many(names, nb_process=2, parallel_threshold=0, chunk_size=max(1, len(names)//5)) != batch:
+        print("Batch lookups in worker processes differ.")
+        exit(1)
+    print("Batch lookups in worker processes match.")
+
 
 
 
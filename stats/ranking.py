@@ -0,0 +1,28 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Ranking of entries by sort keys.
+#
+# The lists of suffixes, services or name servers used to be sorted with
+# comparison functions such as suffixes.compare_suffix_details, wrapped
+# by functools.cmp_to_key. Each comparison is a python call, which may
+# evaluate the hyperloglog estimates of both entries again, and sorting
+# n entries needs about n*log(n) of them, even if only the top N are
+# kept. Instead, each module provides a key function that returns a
+# tuple with the same order as its comparison function, and "top_n"
+# computes the key of each entry once. When only the first nb_top
+# entries are needed, they are selected with a heap, in O(n*log(nb_top)).
+#
+# The order is exactly that of "sorted(items, key=cmp_to_key(compare),
+# reverse=True)", including the order of entries that compare equal,
+# which stay in the order of the input.
+
+import heapq
+
+def top_n(items, key, nb_top=0):
+    # Return the nb_top largest items in decreasing order of key, or all
+    # of them if nb_top <= 0. Same as sorted(items, key=key,
+    # reverse=True)[:nb_top].
+    if nb_top <= 0 or nb_top >= len(items):
+        return sorted(items, key=key, reverse=True)
+    return heapq.nlargest(nb_top, items, key=key)
@@ -0,0 +1,82 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Unit test of the ranking of entries by sort keys.
+#
+# Random suffix details, suffix summaries and name server entries are
+# ranked with ranking.top_n and the key functions of their modules, for
+# several values of N. The result must be the same
+# list, in the same order, as the previous sort with the comparison
+# functions. The values are drawn from small ranges, so that many entries
+# compare equal on the first fields, and some are duplicates.
+#
+# Expect this test to work:
+#
+# py .\ranking_test.py
+
+import sys
+import functools
+import random
+import ranking
+import suffixes
+import prefixlist
+import zoneparser
+
+def random_details(rd, nb):
+    entries = []
+    for i in range(0, nb):
+        sde = suffixes.suffix_detail_entry("s" + str(rd.randint(0, nb//2)) + ".com", 4)
+        for j in range(0, rd.randint(0, 4)):
+            sde.add_subname("n" + str(rd.randint(0, 20)), rd.randint(0, 3), "10.0." + str(rd.randint(0, 3)) + "." + str(rd.randint(0, 5)))
+        entries.append(sde)
+    return entries
+
+def random_summaries(module, rd, nb):
+    entries = []
+    for i in range(0, nb):
+        sse = module.suffix_summary_entry("s" + str(rd.randint(0, nb//2)) + ".net", 0, 4)
+        for j in range(0, rd.randint(0, 4)):
+            sse.add_subname("n" + str(rd.randint(0, 20)), rd.randint(0, 3))
+        entries.append(sse)
+    return entries
+
+def random_servers(rd, nb):
+    entries = []
+    for i in range(0, nb):
+        entry = zoneparser.service_entry("ns" + str(rd.randint(0, nb//2)) + ".example")
+        entry.name_count = rd.randint(0, 5)
+        entry.hit_count = rd.randint(0, 5)
+        entries.append(entry)
+    return entries
+
+def check(label, entries, compare, key):
+    expected = sorted(entries, key=functools.cmp_to_key(compare), reverse=True)
+    for nb_top in [ 0, 1, 5, len(entries)//2, len(entries), len(entries) + 3 ]:
+        ranked = ranking.top_n(entries, key, nb_top)
+        if nb_top > 0:
+            ref = expected[:nb_top]
+        else:
+            ref = expected
+        if len(ranked) != len(ref) or any(a is not b for a, b in zip(ranked, ref)):
+            print(label + ": top " + str(nb_top) + " differs from the sorted list.")
+            return False
+    return True
+
+# main program
+
+if len(sys.argv) != 1:
+    print("Usage: " + sys.argv[0])
+    exit(1)
+
+rd = random.Random(4321)
+ret = True
+for nb in [ 0, 1, 7, 200 ]:
+    ret &= check("suffix details " + str(nb), random_details(rd, nb), suffixes.compare_suffix_details, suffixes.suffix_details_key)
+    ret &= check("suffix summary " + str(nb), random_summaries(suffixes, rd, nb), suffixes.compare_by_subs, suffixes.subs_key)
+    ret &= check("prefix summary " + str(nb), random_summaries(prefixlist, rd, nb), prefixlist.compare_by_subs, prefixlist.subs_key)
+    ret &= check("name servers " + str(nb), random_servers(rd, nb), zoneparser.compare_by_names, zoneparser.names_key)
+
+if not ret:
+    exit(1)
+print("Ranking matches the comparison functions.")
+exit(0)
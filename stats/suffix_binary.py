@@ -0,0 +1,235 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Binary container for suffix detail files.
+#
+# The CSV files produced by suffixes.suffix_details_file write the three
+# hyperloglog register vectors of each suffix as decimal text, 3*2^k
+# integers per line. Parsing these files is dominated by the "int()" calls
+# when merging a month of files from many instances. The binary format
+# stores the same data in fixed width records:
+#
+# * header: magic, version, hll_k, number of records, size of name blob
+# * records: hits (int64), subs, ips, nets (int32), offset and length of
+#   the suffix name in the name blob, then the sub, ip and net registers
+#   as 3*2^k uint8 values
+# * name blob: the utf-8 encoding of all suffix names, concatenated.
+#
+# Files are read through mmap, and the records are exposed as a numpy
+# structured array. The suffix_details_table class merges such files
+# directly in numpy arrays, without creating python objects per register.
+# It can also merge CSV files, and save the result in either format, so
+# CSV export remains available for humans. The format is selected by the
+# file name: names ending with BINARY_SUFFIX use the binary container.
+
+import math
+import mmap
+import struct
+import numpy as np
+
+BINARY_SUFFIX = ".sfxb"
+MAGIC = b"SFXD"
+VERSION = 1
+HEADER_FORMAT = "<4sHHQQ"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+def is_binary_file_name(file_name):
+    return file_name.endswith(BINARY_SUFFIX)
+
+def record_dtype(hll_k):
+    m = 1<<hll_k
+    return np.dtype([('hits', '<i8'), ('subs', '<i4'), ('ips', '<i4'), ('nets', '<i4'), \
+        ('name_off', '<u4'), ('name_len', '<u4'), ('regs', 'u1', (3*m,))])
+
+def write_binary(file_name, hll_k, names, hits, subs, ips, nets, regs):
+    # Write arrays of values in the binary format. The "names" are
+    # python strings, the other arguments are aligned arrays.
+    encoded = [x.encode("utf-8") for x in names]
+    nb = len(encoded)
+    records = np.zeros(nb, dtype=record_dtype(hll_k))
+    name_len = np.fromiter((len(x) for x in encoded), dtype=np.int64, count=nb)
+    name_off = np.zeros(nb, dtype=np.int64)
+    if nb > 0:
+        name_off[1:] = np.cumsum(name_len)[:-1]
+    records['hits'] = hits
+    records['subs'] = subs
+    records['ips'] = ips
+    records['nets'] = nets
+    records['name_off'] = name_off
+    records['name_len'] = name_len
+    records['regs'] = regs
+    blob = b"".join(encoded)
+    with open(file_name, "wb") as f:
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, hll_k, nb, len(blob)))
+        f.write(records.tobytes())
+        f.write(blob)
+
+class suffix_binary_file:
+    # Read only view of a binary suffix file. The "records" array and
+    # the name blob point into the mapped file, and are only valid until
+    # close() is called.
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.f = open(file_name, "rb")
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.hll_k, self.nb_records, blob_size = struct.unpack_from(HEADER_FORMAT, self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("Not a version " + str(VERSION) + " suffix file: " + file_name)
+        dt = record_dtype(self.hll_k)
+        self.m = 1<<self.hll_k
+        self.records = np.frombuffer(self.mm, dtype=dt, count=self.nb_records, offset=HEADER_SIZE)
+        blob_start = HEADER_SIZE + self.nb_records*dt.itemsize
+        self.blob = memoryview(self.mm)[blob_start:blob_start + blob_size]
+
+    def names(self):
+        offs = self.records['name_off'].tolist()
+        lens = self.records['name_len'].tolist()
+        blob = self.blob
+        return [str(blob[o:o+l], "utf-8") for o, l in zip(offs, lens)]
+
+    def close(self):
+        # Drop the views before closing the map, or mmap will refuse.
+        self.records = None
+        self.blob = None
+        self.mm.close()
+        self.f.close()
+
+class hll_estimator:
+    # Vectorized version of hyperloglog.evaluate, applied to the rows of
+    # a register matrix. The registers are small integers, so the sum of
+    # the 2^-z terms is exact in floating point whatever the order of
+    # additions, and the result matches the python implementation. The
+    # small range correction uses a table computed with math.log.
+    def __init__(self, k):
+        self.m = 1<<k
+        self.alpha = 1.0
+        if k == 4:
+            self.alpha = 0.673
+        elif k == 5:
+            self.alpha = 0.697
+        elif k == 6:
+            self.alpha = 0.709
+        elif k >= 7:
+            self.alpha = 0.7213/(1 + 1.079/self.m)
+        self.inverse = np.array([1.0/(1<<z) for z in range(0, 256)])
+        self.small = np.array([0.0] + [self.m*math.log(self.m/v) for v in range(1, self.m + 1)])
+
+    def evaluate(self, regs):
+        a = self.inverse[regs].sum(axis=1)
+        e = self.alpha*self.m*self.m/a
+        v = (regs == 0).sum(axis=1)
+        e = np.where((e < (5*self.m/2)) & (v > 0), self.small[v], e)
+        return (e + 0.5).astype(np.int64)
+
+class suffix_details_table:
+    # Columnar equivalent of suffixes.suffix_details_file, used to merge
+    # large numbers of detail files.
+    def __init__(self, hll_k):
+        self.hll_k = hll_k
+        self.m = 1<<hll_k
+        self.names = []
+        self.index = dict()
+        self.nb = 0
+        self.hits = np.zeros(1024, dtype=np.int64)
+        self.regs = np.zeros((1024, 3*self.m), dtype=np.uint8)
+
+    def reserve(self, nb_needed):
+        if nb_needed > self.hits.shape[0]:
+            capacity = max(nb_needed, 2*self.hits.shape[0])
+            hits = np.zeros(capacity, dtype=np.int64)
+            hits[:self.nb] = self.hits[:self.nb]
+            regs = np.zeros((capacity, 3*self.m), dtype=np.uint8)
+            regs[:self.nb] = self.regs[:self.nb]
+            self.hits = hits
+            self.regs = regs
+
+    def rows_for(self, names):
+        # Return the row number of each name, adding rows as needed.
+        rows = np.empty(len(names), dtype=np.intp)
+        self.reserve(self.nb + len(names))
+        for i, name in enumerate(names):
+            if name in self.index:
+                rows[i] = self.index[name]
+            else:
+                self.index[name] = self.nb
+                self.names.append(name)
+                rows[i] = self.nb
+                self.nb += 1
+        return rows
+
+    def add_arrays(self, names, hits, regs):
+        rows = self.rows_for(names)
+        np.add.at(self.hits, rows, hits)
+        np.maximum.at(self.regs, rows, regs)
+
+    def add_binary_file(self, file_name):
+        sbf = suffix_binary_file(file_name)
+        try:
+            if sbf.hll_k != self.hll_k:
+                raise ValueError("File " + file_name + " has hll_k=" + str(sbf.hll_k) + ", expected " + str(self.hll_k))
+            self.add_arrays(sbf.names(), sbf.records['hits'], sbf.records['regs'])
+        finally:
+            sbf.close()
+
+    def add_csv_file(self, file_name):
+        # Lines that do not parse, such as the header, are skipped, as in
+        # suffix_detail_entry.from_text
+        names = []
+        hits = []
+        regs = []
+        nb_parts = 5 + 3*self.m
+        for line in open(file_name , "rt", encoding="utf-8"):
+            p = line.split(",")
+            if len(p) < nb_parts:
+                continue
+            try:
+                h = int(p[1])
+                r = [int(x) for x in p[5:nb_parts]]
+            except:
+                continue
+            names.append(p[0].strip())
+            hits.append(h)
+            regs.append(r)
+        if len(names) > 0:
+            self.add_arrays(names, np.array(hits, dtype=np.int64), np.array(regs, dtype=np.uint8))
+
+    def add_file(self, file_name):
+        if is_binary_file_name(file_name):
+            self.add_binary_file(file_name)
+        else:
+            self.add_csv_file(file_name)
+
+    def evaluate(self):
+        est = hll_estimator(self.hll_k)
+        regs = self.regs[:self.nb]
+        subs = est.evaluate(regs[:, 0:self.m])
+        ips = est.evaluate(regs[:, self.m:2*self.m])
+        nets = est.evaluate(regs[:, 2*self.m:3*self.m])
+        return subs, ips, nets
+
+    def top_rows(self, nb_top, subs, ips, nets):
+        # Same order as sorting with suffixes.compare_suffix_details in
+        # reverse: subs, nets, ips, hits, then suffix, all descending.
+        names = np.array(self.names, dtype=str) if self.nb > 0 else np.array([], dtype=str)
+        order = np.lexsort((names, self.hits[:self.nb], ips, nets, subs))[::-1]
+        if nb_top > 0 and len(order) > nb_top:
+            order = order[:nb_top]
+        return order
+
+    def save(self, file_name, nb_top=10000):
+        subs, ips, nets = self.evaluate()
+        order = self.top_rows(nb_top, subs, ips, nets)
+        names = [self.names[i] for i in order.tolist()]
+        if is_binary_file_name(file_name):
+            write_binary(file_name, self.hll_k, names, self.hits[order], \
+                subs[order], ips[order], nets[order], self.regs[order])
+            return
+        m = self.m
+        with open(file_name , "wt", encoding="utf-8") as f:
+            if len(names) > 0:
+                header = ["S" + str(i) for i in range(0, m)] + ["I" + str(i) for i in range(0, m)] + ["N" + str(i) for i in range(0, m)]
+                f.write("Suffix,Hits,Subs,IPs,Nets," + ",".join(header) + "\n")
+            for name, h, s, i, n, r in zip(names, self.hits[order].tolist(), subs[order].tolist(), \
+                ips[order].tolist(), nets[order].tolist(), self.regs[order].tolist()):
+                f.write(name + "," + str(h) + "," + str(s) + "," + str(i) + "," + str(n) + "," + ",".join(map(str, r)) + "\n")
@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Unit test of the binary suffix detail format.
+#
+# The detail files are merged as in suffix_summary_test.py, saved in binary
+# format, and then read back both as a suffix_details_file and through the
+# array based suffix_details_table. The CSV exported from either must match
+# the reference.
+#
+# The following tests are expected to work:
+#
+# py .\suffix_binary_test.py ..\tmp\ ..\data\suffix_test_ref.csv ..\data\suffix_test_ref.csv
+# py .\suffix_binary_test.py ..\tmp\ ..\data\suffix_test_2_ref.csv ..\data\suffix_test_ref.csv ..\data\suffix_test_details_2.csv
+
+import sys
+import os
+import suffixes
+import suffix_binary
+import compare_file_test
+
+# main program
+
+tmp_dir = sys.argv[1]
+suffix_ref = sys.argv[2]
+files = sys.argv[3:]
+binary_out = os.path.join(tmp_dir, "details_out" + suffix_binary.BINARY_SUFFIX)
+details_out = os.path.join(tmp_dir, "details_out.csv")
+table_out = os.path.join(tmp_dir, "details_table_out.csv")
+
+sub_s = suffixes.suffix_details_file(4,3)
+for file_name in files:
+    sub_s.parse(file_name)
+sub_s.save(binary_out)
+
+sub_b = suffixes.suffix_details_file(4,3)
+sub_b.parse(binary_out)
+sub_b.save(details_out)
+
+sub_t = suffix_binary.suffix_details_table(4)
+sub_t.add_file(binary_out)
+sub_t.save(table_out)
+
+if not compare_file_test.compare_files(details_out, suffix_ref) or \
+   not compare_file_test.compare_files(table_out, suffix_ref):
+    exit(1)
+
+# Merging the CSV files directly in the table must give the same result
+sub_t = suffix_binary.suffix_details_table(4)
+for file_name in files:
+    sub_t.add_file(file_name)
+sub_t.save(table_out)
+
+if not compare_file_test.compare_files(table_out, suffix_ref):
+    exit(1)
+else:
+    exit(0)
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Unit test of the bounded suffix list.
+#
+# The names of the test files are loaded in a bounded suffix list large
+# enough to hold all the suffixes, which must save the same file as the
+# unbounded list. Then random names are made under a few frequent suffixes,
+# mixed with many random suffixes seen only once. With a bound of 200
+# entries, the list must never hold more than 200 suffixes, the frequent
+# suffixes must be saved exactly as in the unbounded list, and the counts
+# must be within the Space-Saving error bounds.
+#
+# Expect this test to work:
+#
+# py .\suffix_bounded_test.py ..\tmp\ ..\data\suffix_test_names.csv ..\data\suffix_test_names_2.csv
+
+import sys
+import os
+import random
+import suffixes
+import nameparse
+
+def load_names(sdf, file_name):
+    for line in open(file_name, "rt"):
+        nl = nameparse.nameline()
+        if nl.from_csv(line) and nl.name_type == "tld":
+            sdf.add_name(nl.name, nl.count, nl.ip)
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: " + sys.argv[0] + " tmp_dir name_file*")
+        exit(1)
+    temp_prefix = os.path.join(sys.argv[1], "suffix_bounded_test_")
+    ret = True
+
+    ref = suffixes.suffix_details_file(4, 3)
+    bounded = suffixes.suffix_details_file(4, 3, max_entries=100000)
+    for file_name in sys.argv[2:]:
+        load_names(ref, file_name)
+        load_names(bounded, file_name)
+    ref.save(temp_prefix + "ref.csv")
+    bounded.save(temp_prefix + "bounded.csv")
+    if open(temp_prefix + "ref.csv", "rt").read() != open(temp_prefix + "bounded.csv", "rt").read():
+        print("Bounded list with enough entries differs from the reference.")
+        ret = False
+
+    rd = random.Random(2468)
+    max_entries = 200
+    ref = suffixes.suffix_details_file(4, 3)
+    bounded = suffixes.suffix_details_file(4, 3, max_entries=max_entries)
+    true_counts = dict()
+    max_size = 0
+    nb_added = 0
+    for i in range(0, 20000):
+        if i%4 == 0:
+            name = "n" + str(rd.randint(0, 1000)) + ".top" + str(rd.randint(0, 9)) + ".com"
+        else:
+            name = "x" + str(i) + ".rnd" + str(i) + ".net"
+        ip = "10." + str(rd.randint(0, 3)) + "." + str(rd.randint(0, 255)) + ".1"
+        for sdf in [ ref, bounded ]:
+            sdf.add_name(name, 1, ip)
+        parts = name.split(".")
+        # short names are also counted as suffixes, without subname
+        for j in range(0 if len(parts) <= 3 else 1, len(parts)):
+            suffix = ".".join(parts[j:])
+            true_counts[suffix] = true_counts.get(suffix, 0) + 1
+            nb_added += 1
+        max_size = max(max_size, len(bounded.suffixes))
+    if max_size > max_entries:
+        print("Bounded list grew to " + str(max_size) + " entries.")
+        ret = False
+    for suffix in bounded.counts:
+        low, high = bounded.count_bounds(suffix)
+        if low > true_counts[suffix] or high < true_counts[suffix] or high - low > nb_added/max_entries:
+            print("Count of " + suffix + " in [" + str(low) + ", " + str(high) + "], true count " + str(true_counts[suffix]))
+            ret = False
+            break
+    ref_top = ref.top_n(12)
+    bounded_top = bounded.top_n(12)
+    for sde, bsde in zip(ref_top, bounded_top):
+        if sde.to_text() != bsde.to_text():
+            print("Bounded top suffix " + bsde.to_text()[:60] + "\n  differs from " + sde.to_text()[:60])
+            ret = False
+            break
+
+    if not ret:
+        exit(1)
+    print("Bounded list kept " + str(len(bounded.suffixes)) + " suffixes out of " + str(len(ref.suffixes)) + ".")
+    exit(0)
+
+if __name__ == '__main__':
+    main()
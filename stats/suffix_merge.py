@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Parallel merge of suffix files.
+#
+# A month of suffix files, from hundreds of instances and every day, was
+# merged in a single loop. The functions in this module merge them with
+# parallel_buckets.reduce_tree: each task merges a small group of files
+# in a worker process and saves the result in a temporary file, and the
+# temporary files are merged in turn, until the last few are merged in
+# the final file.
+#
+# The suffix details are merged as register arrays by
+# suffix_binary.suffix_details_table, and the temporary files use the
+# binary format, so that the intermediate levels do not parse and print
+# the registers as text. The suffix summaries are merged with
+# suffixes.suffix_summary_file.
+#
+# The top N of a union is not the union of the top N of its parts: a
+# suffix that is just below the top N in every file can be in the top N
+# of the merged file. The intermediate files are therefore not trimmed,
+# unless the caller accepts this approximation by setting "partial_top".
+
+import os
+import suffixes
+import suffix_binary
+import parallel_buckets
+
+class details_merge_task:
+    def __init__(self, hll_k, input_files, output, nb_top, temp_files):
+        self.hll_k = hll_k
+        self.input_files = input_files
+        self.output = output
+        self.nb_top = nb_top
+        self.temp_files = temp_files
+        self.table = None
+
+    def load(self):
+        self.table = suffix_binary.suffix_details_table(self.hll_k)
+        for file_name in self.input_files:
+            self.table.add_file(file_name)
+
+    def save(self):
+        self.table.save(self.output, nb_top=self.nb_top)
+        self.table = None
+        remove_temp_files(self.input_files, self.temp_files)
+
+class summary_merge_task:
+    def __init__(self, hll_m, input_files, output, nb_top, temp_files):
+        self.hll_m = hll_m
+        self.input_files = input_files
+        self.output = output
+        self.nb_top = nb_top
+        self.temp_files = temp_files
+        self.summary = None
+
+    def load(self):
+        self.summary = suffixes.suffix_summary_file(self.hll_m, 0)
+        for file_name in self.input_files:
+            self.summary.parse_suffix_summary(file_name)
+
+    def save(self):
+        self.summary.save_suffix_summary(self.output, top_n=self.nb_top, sort=True, eval=True)
+        self.summary = None
+        remove_temp_files(self.input_files, self.temp_files)
+
+def remove_temp_files(input_files, temp_files):
+    for file_name in input_files:
+        if file_name in temp_files and os.path.isfile(file_name):
+            os.remove(file_name)
+
+def merge_tree(task_class, hll_k, files, output_file, nb_top, nb_process, temp_prefix, temp_suffix, partial_top=0, fan_in=2):
+    # The temporary files are all the inputs that are not in "files".
+    originals = set(files)
+    def new_task(level, task_id, group):
+        temp_file = temp_prefix + "_merge_" + str(level) + "_" + str(task_id) + temp_suffix
+        return task_class(hll_k, group, temp_file, partial_top, [f for f in group if not f in originals])
+    inputs = parallel_buckets.reduce_tree(files, nb_process, new_task, fan_in=fan_in)
+    last = task_class(hll_k, inputs, output_file, nb_top, [f for f in inputs if not f in originals])
+    last.load()
+    last.save()
+
+def merge_details_files(files, output_file, nb_top, nb_process, hll_k=4, temp_prefix="", partial_top=0):
+    # Merge suffix detail files, in CSV or binary format, and save the top
+    # nb_top suffixes, or all of them if nb_top is 0.
+    if temp_prefix == "":
+        temp_prefix = output_file
+    merge_tree(details_merge_task, hll_k, files, output_file, nb_top, nb_process, \
+        temp_prefix, suffix_binary.BINARY_SUFFIX, partial_top=partial_top)
+
+def merge_summary_files(files, output_file, nb_top, nb_process, hll_m=4, temp_prefix="", partial_top=0):
+    # Merge suffix summary files, and save the nb_top suffixes with the
+    # most subnames, or all of them if nb_top is 0.
+    if temp_prefix == "":
+        temp_prefix = output_file
+    merge_tree(summary_merge_task, hll_m, files, output_file, nb_top, nb_process, \
+        temp_prefix, ".csv", partial_top=partial_top)
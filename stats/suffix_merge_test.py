@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Unit test of the parallel merge of suffix files.
+#
+# The detail files given as arguments are copied with different names,
+# in CSV and binary format, to get enough files for several levels of
+# merges. They are merged by suffix_merge in a pool of 3 processes, and
+# the result must be the same as merging all the files in a single
+# suffix_details_table, both for all the suffixes and for a top N.
+# Suffix summary files are made from random names, and their parallel
+# merge must also match the serial merge. No temporary file must remain.
+#
+# Expect this test to work:
+#
+# py .\suffix_merge_test.py ..\tmp\ ..\data\suffix_test_ref.csv ..\data\suffix_test_details_2.csv
+
+import sys
+import os
+import glob
+import random
+import shutil
+import suffixes
+import suffix_binary
+import suffix_merge
+
+def same_files(label, file_name, ref_name):
+    if open(file_name, "rb").read() != open(ref_name, "rb").read():
+        print(label + ": " + file_name + " differs from " + ref_name)
+        return False
+    return True
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: " + sys.argv[0] + " tmp_dir detail_file*")
+        exit(1)
+    temp_prefix = os.path.join(sys.argv[1], "suffix_merge_test_")
+    for file_name in glob.glob(temp_prefix + "*"):
+        os.remove(file_name)
+    ret = True
+
+    files = []
+    for i in range(0, 11):
+        source = sys.argv[2 + i%(len(sys.argv) - 2)]
+        file_name = temp_prefix + "in_" + str(i) + ".csv"
+        shutil.copyfile(source, file_name)
+        if i%3 == 1:
+            table = suffix_binary.suffix_details_table(4)
+            table.add_file(file_name)
+            os.remove(file_name)
+            file_name = temp_prefix + "in_" + str(i) + suffix_binary.BINARY_SUFFIX
+            table.save(file_name, nb_top=0)
+        files.append(file_name)
+
+    for nb_top in [ 0, 20 ]:
+        ref_name = temp_prefix + "ref_" + str(nb_top) + ".csv"
+        table = suffix_binary.suffix_details_table(4)
+        for file_name in files:
+            table.add_file(file_name)
+        table.save(ref_name, nb_top=nb_top)
+        merged_name = temp_prefix + "merged_" + str(nb_top) + ".csv"
+        suffix_merge.merge_details_files(files, merged_name, nb_top, 3)
+        ret &= same_files("Details, top " + str(nb_top), merged_name, ref_name)
+
+    rd = random.Random(1234)
+    summary_files = []
+    for i in range(0, 9):
+        ssf = suffixes.suffix_summary_file(4, 3)
+        for j in range(0, 200):
+            name = "n" + str(rd.randint(0, 50)) + ".s" + str(rd.randint(0, 30)) + "." + rd.choice([ "com", "net", "org" ])
+            ssf.add_name(name, rd.randint(0, 3))
+        file_name = temp_prefix + "summary_" + str(i) + ".csv"
+        ssf.save_suffix_summary(file_name)
+        summary_files.append(file_name)
+    ref_name = temp_prefix + "summary_ref.csv"
+    task = suffix_merge.summary_merge_task(4, summary_files, ref_name, 10, [])
+    task.load()
+    task.save()
+    merged_name = temp_prefix + "summary_merged.csv"
+    suffix_merge.merge_summary_files(summary_files, merged_name, 10, 3)
+    ret &= same_files("Summary, top 10", merged_name, ref_name)
+
+    left = glob.glob(temp_prefix + "*_merge_*")
+    if len(left) > 0:
+        print("Temporary files left: " + str(left))
+        ret = False
+
+    if not ret:
+        exit(1)
+    print("Merged " + str(len(files)) + " detail files and " + str(len(summary_files)) + " summary files.")
+    exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Unit test of the reservoirs of suffix_sample.
+#
+# Random names are added under a suffix, in the uniform and in the
+# weighted mode. The sample must never hold more than nb_samples names,
+# and two sample lists must pick the same names for the same seed. In the
+# weighted mode, a few names have many more hits than the others, and
+# they must be selected much more often than the others over many trials.
+#
+# Expect this test to work:
+#
+# py .\suffix_reservoir_test.py
+
+import sys
+import random
+import suffix_sample
+
+def fill(weighted, names, nb_samples, seed):
+    ssl = suffix_sample.suffix_sample_list(nb_samples, weighted=weighted)
+    ssl.rd = random.Random(seed)
+    ssl.add_suffix("example.com")
+    max_size = 0
+    for name, hits in names:
+        ssl.add(name + ".example.com", "10.0.0.1", "A", hits)
+        max_size = max(max_size, len(ssl.suffixes["example.com"].samples))
+    return list(ssl.suffixes["example.com"].samples.keys()), max_size
+
+# main program
+
+if len(sys.argv) != 1:
+    print("Usage: " + sys.argv[0])
+    exit(1)
+
+ret = True
+nb_samples = 10
+nb_names = 1000
+heavy = [ "n" + str(i) for i in range(0, nb_names, 100) ]
+names = []
+for i in range(0, nb_names):
+    name = "n" + str(i)
+    names.append((name, 1000 if name in heavy else 1))
+
+for weighted in [ False, True ]:
+    label = "weighted" if weighted else "uniform"
+    sample, max_size = fill(weighted, names, nb_samples, 17)
+    again, max_size_again = fill(weighted, names, nb_samples, 17)
+    if max_size > nb_samples or len(sample) != nb_samples:
+        print(label + ": sample has " + str(len(sample)) + " names, up to " + str(max_size))
+        ret = False
+    if sample != again:
+        print(label + ": samples differ for the same seed.")
+        ret = False
+
+nb_trials = 200
+nb_heavy = 0
+for trial in range(0, nb_trials):
+    sample, max_size = fill(True, names, nb_samples, trial)
+    for name in sample:
+        if name in heavy:
+            nb_heavy += 1
+# The heavy names have 10000 of the 10990 hits, about 91% of the samples
+# would pick them if they were drawn with replacement.
+ratio = nb_heavy/(nb_trials*nb_samples)
+if ratio < 0.6:
+    print("Weighted samples picked heavy names " + str(int(100*ratio)) + "% of the time.")
+    ret = False
+
+if not ret:
+    exit(1)
+print("Weighted samples picked heavy names " + str(int(100*ratio)) + "% of the time.")
+exit(0)
@@ -80,8 +80,26 @@
 # with the lowest score? Maybe use a longuish list and an LRU strategy? Maybe keep
 # a new list for each slice and then merge it? Keep a running score of number
 # of names for an IP address? Let's do that later.
+#
+# The sampled names are kept in a dictionary, and their keys in the array
+# "slots", so that the name to replace is picked at random in O(1), without
+# copying the keys of the dictionary at each replacement. The random draws
+# are the same as when the name was picked in the order of the dictionary,
+# but a new name takes the slot of the name it replaces instead of going
+# last, so after the first replacement the samples differ from those of
+# that earlier version for the same seed.
+#
+# In the weighted mode, the sampling is biased by hits, using the A-ExpJ
+# variant of the weighted reservoir of Efraimidis and Spirakis. Each
+# sampled name has a key u^(1/hits), and the sample keeps the names with
+# the largest keys in a heap. Instead of drawing a random number per name,
+# the sampler draws the total weight of the names that will be skipped
+# before the next replacement. Both modes use the random generator of the
+# sample list, so a given seed always gives the same samples.
 
 import random
+import heapq
+import math
 import nameparse
 import os
 import gzip
@@ -102,36 +120,77 @@ class suffix_sample_data:
         return s
 
 class suffix_sample:
-    def __init__(self, suffix, nb_samples, rd):
+    def __init__(self, suffix, nb_samples, rd, weighted=False):
         self.suffix = suffix
         self.nb_samples = nb_samples
         self.samples = dict()
+        self.slots = []
         self.pop_size = 0
         self.rd = rd
+        self.weighted = weighted
+        self.heap = []
+        self.skip_weight = 0.0
 
-    def add(self, name, fqdn, ip, rr_type):
+    def add(self, name, fqdn, ip, rr_type, hits=1):
         if not name in self.samples:
-            if len(self.samples) < self.nb_samples:
+            if self.weighted:
+                self.add_weighted(name, fqdn, ip, rr_type, hits)
+            elif len(self.samples) < self.nb_samples:
                 self.samples[name] = suffix_sample_data(fqdn, ip, rr_type)
+                self.slots.append(name)
             else:
                 self.pop_size += 1
                 x = self.rd.randrange(self.pop_size)
                 if x < self.nb_samples:
-                    key_out = self.rd.choice(list(self.samples.keys()))
-                    self.samples.pop(key_out)
+                    i_out = self.rd.randrange(len(self.slots))
+                    self.samples.pop(self.slots[i_out])
+                    self.slots[i_out] = name
                     self.samples[name] = suffix_sample_data(fqdn, ip, rr_type)
 
+    def add_weighted(self, name, fqdn, ip, rr_type, hits):
+        if hits <= 0 or self.nb_samples <= 0:
+            return
+        if len(self.samples) < self.nb_samples:
+            key = (1.0 - self.rd.random())**(1.0/hits)
+            heapq.heappush(self.heap, (key, name))
+            self.samples[name] = suffix_sample_data(fqdn, ip, rr_type)
+            if len(self.samples) == self.nb_samples:
+                self.next_skip()
+        else:
+            self.skip_weight -= hits
+            if self.skip_weight <= 0:
+                # the new key is drawn above the smallest key in the sample,
+                # conditionally to the name being selected.
+                t_w = self.heap[0][0]**hits
+                key = self.rd.uniform(t_w, 1.0)**(1.0/hits)
+                key_out, name_out = heapq.heapreplace(self.heap, (key, name))
+                self.samples.pop(name_out)
+                self.samples[name] = suffix_sample_data(fqdn, ip, rr_type)
+                self.next_skip()
+
+    def next_skip(self):
+        # Draw the weight of the names that will be skipped before the next
+        # replacement.
+        t = self.heap[0][0]
+        if t >= 1.0:
+            self.skip_weight = math.inf
+        elif t <= 0.0:
+            self.skip_weight = 0.0
+        else:
+            self.skip_weight = math.log(1.0 - self.rd.random())/math.log(t)
+
 class suffix_sample_list:
-    def __init__(self, nb_samples):
+    def __init__(self, nb_samples, weighted=False):
         self.nb_samples = nb_samples
+        self.weighted = weighted
         self.suffixes = dict()
         self.rd = random.Random(123456789)
 
     def add_suffix(self, suffix):
         if not suffix in self.suffixes:
-            self.suffixes[suffix] = suffix_sample(suffix, self.nb_samples, self.rd)
+            self.suffixes[suffix] = suffix_sample(suffix, self.nb_samples, self.rd, weighted=self.weighted)
 
-    def add(self, name, ip, rr_type):
+    def add(self, name, ip, rr_type, hits=1):
         # find all the embedded suffixes, and if they belong to the list
         # add that to the samples
         name_parts = name.split(".")
@@ -143,13 +202,13 @@ class suffix_sample_list:
             i_sfn += len(name_parts[i_start])+1
             suffix = name[i_sfn:]
             if suffix in self.suffixes:
-                self.suffixes[suffix].add(name_parts[i_start], name, ip, rr_type)
+                self.suffixes[suffix].add(name_parts[i_start], name, ip, rr_type, hits)
             i_start += 1
 
     def add_log_line(self, line):
         nl = nameparse.nameline()
         if nl.from_csv(line) and nl.name_type == "tld":
-            self.add(nl.name, nl.ip, nl.rr_type)
+            self.add(nl.name, nl.ip, nl.rr_type, nl.count)
 
     def load_logfile_csv(self, logfile):
         for line in open(logfile , "rt", encoding="utf-8"):
@@ -193,8 +252,8 @@ class suffix_city_date:
 
 
 class suffix_details_sample:
-    def __init__(self, nb_samples, dir_prefix):
-        self.samples = suffix_sample_list(nb_samples)
+    def __init__(self, nb_samples, dir_prefix, weighted=False):
+        self.samples = suffix_sample_list(nb_samples, weighted=weighted)
         self.dir_prefix = dir_prefix
         self.suffixes = dict()
         self.instances = []
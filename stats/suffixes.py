@@ -6,11 +6,16 @@
 import traceback
 import nameparse
 import hyperloglog
+import hyperloglog_np
 import gzip
 import traceback
-import functools
+import ranking
 import sys
 import ipaddress
+import numpy as np
+import suffix_binary
+import zlib
+import heapq
 
 # Unified list of suffixes
 #
@@ -34,6 +39,31 @@ import ipaddress
 #    number of names. If a prefix is filtered, the hit count for that prefix are added
 #    to the next level, or to the artificial prefix "__other_tlds".
 
+# Hash once ingestion
+#
+# A name is added to each of its suffixes, and the hyperloglog objects of
+# each suffix hash the same IP address and subnet again. The hashes of the
+# subname, of the IP address and of its /24 or /48 subnet are computed
+# once per name, and added with "add_hash" to the hyperloglog objects.
+# The registers are the same as with "add".
+
+def subname_hash(name_part):
+    # None for an empty name part, which is not counted as a subname.
+    if name_part == "":
+        return None
+    return hyperloglog.hyperloglog.fnv1a64(name_part)
+
+def ip_net_hashes(ip):
+    # Hashes of the address and of its subnet, as added by add_subname.
+    ipa = ipaddress.ip_address(ip)
+    if ipa.version == 4:
+        isn = ipaddress.ip_network(ip + "/24", strict=False)
+    elif ipa.version == 6:
+        isn = ipaddress.ip_network(ip + "/48", strict=False)
+    else:
+        isn = ipaddress.ip_network("::/64")
+    return hyperloglog.hyperloglog.fnv1a64(str(ipa)), hyperloglog.hyperloglog.fnv1a64(str(isn))
+
 class suffix_summary_entry:
     def __init__(self, suffix, hits, hll_m):
         self.suffix = suffix
@@ -45,6 +75,13 @@ class suffix_summary_entry:
             self.hll.add(name_part)
         self.hits += hits
         self.subs = 0
+    def add_subname_hash(self, name_hash, hits):
+        # Same as add_subname, with the hash of the name part, or None
+        # for an empty name part.
+        if name_hash is not None:
+            self.hll.add_hash(name_hash)
+        self.hits += hits
+        self.subs = 0
     def merge(self, other):
         self.hits += other.hits
         self.hll.merge(other.hll)
@@ -71,6 +108,10 @@ class suffix_summary_entry:
             success = False
         return success
 
+def subs_key(item):
+    # Sort key with the same order as compare_by_subs.
+    return (item.evaluate(), item.suffix)
+
 def compare_by_subs(item, other):
     n1 = item.evaluate()
     n2 = other.evaluate()
@@ -120,13 +161,13 @@ class suffix_summary_file:
                 if suffix in self.summary:
                     # if the suffix is already accounted for, the shorter prefixes
                     # are up to date, so processing will stop there
-                    self.summary[suffix].add_subname(name_parts[i_p],hits)
+                    self.summary[suffix].add_subname_hash(subname_hash(name_parts[i_p]),hits)
                     break
                 else:
                     # if creating a prefix, continue this loop so shorter prefixes
                     # are updated as needed.
                     self.summary[suffix] = suffix_summary_entry(suffix, 0, self.hll_m)
-                    self.summary[suffix].add_subname(name_parts[i_p],hits)
+                    self.summary[suffix].add_subname_hash(subname_hash(name_parts[i_p]),hits)
                     hits = 0
 
     def prune(self, min_hits, min_subnames):
@@ -179,9 +220,9 @@ class suffix_summary_file:
         if top_n > 0 or sort:
             print("sorting")
             if by_hits:
-                flat.sort(key=hits, reverse=True)
+                flat = ranking.top_n(flat, lambda sse: sse.hits, top_n)
             else:
-                flat.sort(key=functools.cmp_to_key(compare_by_subs), reverse=True)
+                flat = ranking.top_n(flat, subs_key, top_n)
             print("sorted")
         if top_n == 0:
             top_n = len(flat)
@@ -207,17 +248,14 @@ class suffix_summary_sorter:
 
     def sort_and_filter(self):       
         if self.need_sort:
-            self.list.sort(key=functools.cmp_to_key(compare_by_subs), reverse=True)
+            self.list = ranking.top_n(self.list, subs_key)
 
     def add_file_entries_to_summary(self):
         # First add the summary to the in_file list
         for suffix in self.summary:
             self.in_file.append(self.summary[suffix])
-        # Sort the file list
-        self.in_file.sort(key=functools.cmp_to_key(compare_by_subs), reverse=True)
-        # Trim to top N
-        if self.top_n > 0:
-            self.in_file = self.in_file[0:self.top_n]
+        # Sort the file list and trim to top N
+        self.in_file = ranking.top_n(self.in_file, subs_key, self.top_n)
         # Reset the summary
         self.summary = dict()
         if self.top_n <= 0 or len(self.summary) < self.top_n or len(self.in_file) == 0:
@@ -267,12 +305,12 @@ class suffix_summary_sorter:
         flat = list(self.summary.values())
         if top_n > 0:
             print("sorting")
-            flat.sort(key=functools.cmp_to_key(compare_by_subs), reverse=True)
+            flat = ranking.top_n(flat, subs_key, top_n)
             print("sorted")
         if top_n == 0:
-            top_n = len(self.list)
+            top_n = len(flat)
         print("saving " + str(self.top_n))
-        suffix_summary_file.save_list(self.list[0:top_n], file_name)
+        suffix_summary_file.save_list(flat[0:top_n], file_name)
         print("saved")
 
 
@@ -334,22 +372,18 @@ class suffix_detail_entry:
         self.net_hll = hyperloglog.hyperloglog(hll_k)
 
     def add_subname(self, name_part, hits, ip):
-        if name_part != "":
-            self.sub_hll.add(name_part)
+        self.add_hashes(subname_hash(name_part), hits, ip_net_hashes(ip))
+
+    def add_hashes(self, name_hash, hits, ip_hashes):
+        # Same as add_subname, with the hash of the name part, or None if
+        # it is empty, and the hashes returned by ip_net_hashes.
+        if name_hash is not None:
+            self.sub_hll.add_hash(name_hash)
             self.subs = 0
-        ip_is_bad = False
-        ipa = ipaddress.ip_address(ip)
-        if ipa.version == 4:
-            isn = ipaddress.ip_network(ip + "/24", strict=False)
-        elif ipa.version == 6:
-            isn = ipaddress.ip_network(ip + "/48", strict=False)
-        else:
-            isn = ipaddress.ip_network("::/64")
-        if not ip_is_bad:
-            self.ip_hll.add(str(ipa))
-            self.net_hll.add(str(isn))
-            self.ips = 0
-            self.nets = 0
+        self.ip_hll.add_hash(ip_hashes[0])
+        self.net_hll.add_hash(ip_hashes[1])
+        self.ips = 0
+        self.nets = 0
         self.hits += hits
 
     def merge(self, other):
@@ -403,6 +437,11 @@ class suffix_detail_entry:
             success = False
         return success
 
+def suffix_details_key(item):
+    # Sort key with the same order as compare_suffix_details.
+    item.evaluate()
+    return (item.subs, item.nets, item.ips, item.hits, item.suffix)
+
 def compare_suffix_details(item, other):
     item.evaluate()
     other.evaluate()
@@ -436,36 +475,162 @@ def compare_suffix_details(item, other):
 # If this is just a second pass, the list of suffixes is preset by
 # a call to `init_suffixes`. If it is not, then all the prefixes
 # are loaded in memory, but only the top 10,000 will be stored.
+#
+# Keeping all the suffixes in memory is costly when the traffic contains
+# millions of random suffixes seen once, each with three hyperloglog
+# objects. If "max_entries" is set, the dynamic list is bounded with the
+# Space-Saving algorithm: each suffix has a count of the names added to
+# it, which bounds its number of subnames. When the list is full, the
+# suffix with the lowest count is removed, and the new suffix starts with
+# that count, recorded as its error. With K = max_entries entries and W
+# names added in total:
+#
+# * every suffix that received more than W/K names is in the list,
+# * the count of a suffix exceeds its true number of names by at most its
+#   error, and the error is at most W/K,
+# * the hits and hyperloglog data of a suffix only cover the names added
+#   since it last entered the list, so they are exact for the suffixes
+#   that were never removed, and lower bounds for the others.
+#
+# Setting K to a margin of several times the number of suffixes saved
+# keeps the frequent suffixes exact, in a fixed amount of memory. Only
+# the names added with add_name or add_to_suffix are counted; entries
+# parsed from files or merged are added without bound.
+#
+# With batch_size > 0, the subnames and address hashes added by add_name
+# or add_to_suffix are not added one by one: they are queued with their
+# entries, and once batch_size of them are queued, or before the entries
+# are read, e.g., by top_n, evaluate, merge or save, the subnames are
+# hashed together by hyperloglog_np.fnv1a64_many and the register indices
+# and ranks of all the hashes are computed with numpy. The registers are
+# the same as when adding the names one by one.
 
 class suffix_details_file:
-    def __init__(self, hll_k, max_suffix_parts):
+    def __init__(self, hll_k, max_suffix_parts, max_entries=0, batch_size=0):
         self.suffixes = dict()
+        self.batch_size = batch_size
+        self.pending_entries = []
+        self.pending_names = []
+        self.pending_ips = []
+        self.pending_nets = []
         self.hll_k = hll_k
         self.max_suffix_parts = max_suffix_parts
         self.dynamic_list = True
+        self.max_entries = max_entries
+        self.counts = dict()
+        self.errors = dict()
+        self.count_heap = []
+        self.ip_cache = dict()
 
     def init_suffixes(self, suffix_list):
         for suffix in suffix_list:
             self.suffixes[suffix] = suffix_detail_entry(suffix, self.hll_k)
         self.dynamic_list = False
 
-    def add_to_suffix(self, suffix, subname, hits, ip):
+    def ip_hashes(self, ip):
+        # The names of a file come from a limited number of resolvers, so
+        # the hashes of their addresses are kept in a small cache.
+        if not ip in self.ip_cache:
+            if len(self.ip_cache) >= 0x10000:
+                self.ip_cache = dict()
+            self.ip_cache[ip] = ip_net_hashes(ip)
+        return self.ip_cache[ip]
+
+    def add_to_suffix(self, suffix, subname, hits, ip, ip_hashes=None):
+        # Returns the hashes of the IP address, so that add_name computes
+        # them only once per name.
         if suffix in self.suffixes:
-            self.suffixes[suffix].add_subname(subname, hits, ip)
+            if ip_hashes is None:
+                ip_hashes = self.ip_hashes(ip)
+            self.add_to_entry(self.suffixes[suffix], subname, hits, ip_hashes)
+            if self.max_entries > 0 and suffix in self.counts:
+                self.counts[suffix] += 1
         elif self.dynamic_list:
+            if ip_hashes is None:
+                ip_hashes = self.ip_hashes(ip)
+            error = 0
+            if self.max_entries > 0 and len(self.suffixes) >= self.max_entries:
+                error = self.remove_min_count()
             self.suffixes[suffix] = suffix_detail_entry(suffix, self.hll_k)
-            self.suffixes[suffix].add_subname(subname, hits, ip)
+            self.add_to_entry(self.suffixes[suffix], subname, hits, ip_hashes)
+            if self.max_entries > 0:
+                self.counts[suffix] = error + 1
+                self.errors[suffix] = error
+                heapq.heappush(self.count_heap, (error + 1, suffix))
+        return ip_hashes
+
+    def add_to_entry(self, sde, subname, hits, ip_hashes):
+        if self.batch_size <= 0:
+            sde.add_hashes(subname_hash(subname), hits, ip_hashes)
+            return
+        sde.hits += hits
+        self.pending_entries.append(sde)
+        self.pending_names.append(subname)
+        self.pending_ips.append(ip_hashes[0])
+        self.pending_nets.append(ip_hashes[1])
+        if len(self.pending_entries) >= self.batch_size:
+            self.flush_subnames()
+
+    def registers_of(self, h):
+        # Register indices and ranks of an array of hashes.
+        k = np.uint64(self.hll_k)
+        return (h & np.uint64((1<<self.hll_k) - 1)).tolist(), hyperloglog_np.rho_many(h >> k).tolist()
+
+    def flush_subnames(self):
+        # Add the queued subnames and addresses to the registers of their
+        # entries. An entry removed from a bounded list since is updated
+        # in vain, as it would have been before its removal.
+        if len(self.pending_entries) == 0:
+            return
+        sub_ib, sub_zb = self.registers_of(hyperloglog_np.fnv1a64_many(self.pending_names))
+        ip_ib, ip_zb = self.registers_of(np.array(self.pending_ips, dtype=np.uint64))
+        net_ib, net_zb = self.registers_of(np.array(self.pending_nets, dtype=np.uint64))
+        for i, sde in enumerate(self.pending_entries):
+            if self.pending_names[i] != "":
+                sde.sub_hll.set_max(sub_ib[i], sub_zb[i])
+            sde.ip_hll.set_max(ip_ib[i], ip_zb[i])
+            sde.net_hll.set_max(net_ib[i], net_zb[i])
+            sde.subs = 0
+            sde.ips = 0
+            sde.nets = 0
+        self.pending_entries = []
+        self.pending_names = []
+        self.pending_ips = []
+        self.pending_nets = []
+
+    def remove_min_count(self):
+        # Remove the counted suffix with the lowest count, and return that
+        # count. The heap has one item per counted suffix, with the count
+        # it had when pushed; the counts only grow, so an item whose count
+        # is out of date is pushed again with the current count.
+        while len(self.count_heap) > 0:
+            count, suffix = heapq.heappop(self.count_heap)
+            if self.counts[suffix] != count:
+                heapq.heappush(self.count_heap, (self.counts[suffix], suffix))
+            else:
+                self.suffixes.pop(suffix)
+                self.counts.pop(suffix)
+                self.errors.pop(suffix)
+                return count
+        return 0
+
+    def count_bounds(self, suffix):
+        # Lower and upper bound of the number of names added to a counted
+        # suffix.
+        return self.counts[suffix] - self.errors[suffix], self.counts[suffix]
 
     def add_name(self, name, hits, ip):
         name_parts = name.split(".")
         np = len(name_parts)
         i_sfn = 0
         i_start = 0
+        # the IP hashes are computed when first needed
+        ip_hashes = None
 
         # if name is short, add an empty name, which means counting
         # just the IP and subnet hits.
         if np <= self.max_suffix_parts:
-            self.add_to_suffix(name, "", hits, ip)
+            ip_hashes = self.add_to_suffix(name, "", hits, ip)
 
         else:
             # trim name so it be at most max_suffix_parts + 1
@@ -476,19 +641,20 @@ class suffix_details_file:
         while i_start + 1 < np:
             i_sfn += len(name_parts[i_start])+1
             suffix = name[i_sfn:]
-            self.add_to_suffix(suffix, name_parts[i_start], hits, ip)
+            ip_hashes = self.add_to_suffix(suffix, name_parts[i_start], hits, ip, ip_hashes)
             i_start += 1
 
     def evaluate(self):
+        self.flush_subnames()
         for suffix in self.suffixes:
            self.suffixes[suffix].evaluate()
 
     def top_n(self, nb_top):
+        self.flush_subnames()
         suffix_list = list(self.suffixes.values())
-        suffix_list.sort(key=functools.cmp_to_key(compare_suffix_details), reverse=True)
-        if self.dynamic_list and len(suffix_list) > nb_top:
-            suffix_list = suffix_list[0:nb_top]
-        return suffix_list
+        if self.dynamic_list:
+            return ranking.top_n(suffix_list, suffix_details_key, nb_top)
+        return ranking.top_n(suffix_list, suffix_details_key)
 
     def trim(self, nb_top):
         if len(self.suffixes) > nb_top:
@@ -497,32 +663,127 @@ class suffix_details_file:
             for sde in suffix_list:
                 trimmed[sde.suffix] = sde
             self.suffixes = trimmed
+            if self.max_entries > 0:
+                self.counts = { x: self.counts[x] for x in trimmed if x in self.counts }
+                self.errors = { x: self.errors[x] for x in self.counts }
+                self.count_heap = [ (self.counts[x], x) for x in self.counts ]
+                heapq.heapify(self.count_heap)
 
-    def save(self, file_name):
+    def save(self, file_name, nb_top=10000):
         # start with sorting by relevance, then limit
-        # to a maximum size of 10,000
-        suffix_list = self.top_n(10000)
+        # to a maximum size of 10,000. Intermediate files that will be
+        # merged are saved with nb_top=0, i.e., not trimmed, because the
+        # top N of a merge is not the merge of the top N of its parts.
+        suffix_list = self.top_n(nb_top)
+        if suffix_binary.is_binary_file_name(file_name):
+            self.save_binary(file_name, suffix_list)
+            return
         with open(file_name , "wt", encoding="utf-8") as f:
             if len(suffix_list) > 0:
                 f.write(suffix_list[0].suffix_header() + "\n")
             for suffix in suffix_list:
                 f.write(suffix.to_text() + "\n")
 
+    def save_binary(self, file_name, suffix_list):
+        m = 1<<self.hll_k
+        regs = np.zeros((len(suffix_list), 3*m), dtype=np.uint8)
+        for i, sde in enumerate(suffix_list):
+            sde.evaluate()
+            regs[i, 0:m] = sde.sub_hll.registers()
+            regs[i, m:2*m] = sde.ip_hll.registers()
+            regs[i, 2*m:3*m] = sde.net_hll.registers()
+        suffix_binary.write_binary(file_name, self.hll_k, [sde.suffix for sde in suffix_list], \
+            [sde.hits for sde in suffix_list], [sde.subs for sde in suffix_list], \
+            [sde.ips for sde in suffix_list], [sde.nets for sde in suffix_list], regs)
+
+    def add_entry(self, sde):
+        if sde.suffix in self.suffixes:
+            self.suffixes[sde.suffix].merge(sde)
+        else:
+            self.suffixes[sde.suffix] = sde
+
+    def parse_binary(self, file_name):
+        sbf = suffix_binary.suffix_binary_file(file_name)
+        try:
+            m = sbf.m
+            columns = zip(sbf.names(), sbf.records['hits'].tolist(), sbf.records['subs'].tolist(), \
+                sbf.records['ips'].tolist(), sbf.records['nets'].tolist(), sbf.records['regs'].tolist())
+            for suffix, hits, subs, ips, nets, regs in columns:
+                sde = suffix_detail_entry(suffix, self.hll_k)
+                sde.hits = hits
+                sde.subs = subs
+                sde.ips = ips
+                sde.nets = nets
+                sde.sub_hll.merge_vector(regs[0:m])
+                sde.ip_hll.merge_vector(regs[m:2*m])
+                sde.net_hll.merge_vector(regs[2*m:3*m])
+                self.add_entry(sde)
+        finally:
+            sbf.close()
+
     def parse(self, file_name):
+        if suffix_binary.is_binary_file_name(file_name):
+            self.parse_binary(file_name)
+            return
         for line in open(file_name , "rt", encoding="utf-8"):
             sde = suffix_detail_entry("", self.hll_k)
             if sde.from_text(line):
-                if sde.suffix in self.suffixes:
-                    self.suffixes[sde.suffix].merge(sde)
-                else:
-                    self.suffixes[sde.suffix] = sde
+                self.add_entry(sde)
 
     def merge(self, other):
+        self.flush_subnames()
+        other.flush_subnames()
         for suffix in other.suffixes:
             if not suffix in self.suffixes:
                 self.suffixes[suffix] = suffix_detail_entry(suffix, self.hll_k)
             self.suffixes[suffix].merge(other.suffixes[suffix])
 
+    def load_contributions(self, file_name):
+        # Add the contributions written by a suffix_partition_file.
+        for line in open(file_name, "rt", encoding="utf-8"):
+            parts = line.rstrip("\n").split(",")
+            if len(parts) == 4:
+                self.add_to_suffix(parts[0], parts[1], int(parts[2]), parts[3])
+
+# Partitioned suffix details
+#
+# When many processes parse name files, each one would build the details
+# of all the suffixes that it sees, and the main process would then merge
+# all these tables. Instead, the parsers can write the contributions of
+# each name, (suffix, subname, hits, ip), in one file per partition of
+# the suffix space, chosen by a hash of the suffix. Each partition is
+# then loaded by a single process in a suffix_details_file, which holds
+# only the suffixes of that partition. Since the partitions are disjoint,
+# the final list is just the union of the partitions.
+
+def suffix_partition(suffix, nb_partitions):
+    # Unlike hash(), crc32 gives the same value in all processes.
+    return zlib.crc32(suffix.encode("utf-8")) % nb_partitions
+
+class suffix_partition_file(suffix_details_file):
+    def __init__(self, hll_k, max_suffix_parts, file_names):
+        suffix_details_file.__init__(self, hll_k, max_suffix_parts)
+        self.file_names = file_names
+        # The files are opened when first needed, so that the object can
+        # be pickled and sent to a worker process before.
+        self.files = None
+
+    def open_files(self):
+        if self.files is None:
+            self.files = [open(file_name, "wt", encoding="utf-8") for file_name in self.file_names]
+
+    def add_to_suffix(self, suffix, subname, hits, ip, ip_hashes=None):
+        self.open_files()
+        f = self.files[suffix_partition(suffix, len(self.files))]
+        f.write(suffix + "," + subname + "," + str(hits) + "," + ip + "\n")
+
+    def close(self):
+        # Also creates the files of the partitions that received nothing.
+        self.open_files()
+        for f in self.files:
+            f.close()
+        self.files = None
+
 
 # Prepare monthly per instance daily reports.
 #
@@ -562,20 +823,16 @@ class suffix_report:
                 self.city_list[city] = suffix_details_file(self.hll_k, self.max_suffix_parts)
 
     def compute_city_or_date_report(hll_k, max_suffix_parts, city, date, file_list, output_file):
-        details_file = suffix_details_file(hll_k, max_suffix_parts)
+        # The merge is done on register arrays, see suffix_binary.py. The
+        # result is the same as parsing all files in a suffix_details_file
+        # and saving it.
+        details_table = suffix_binary.suffix_details_table(hll_k)
         for file_name in file_list:
             f_date,f_city = suffix_report.get_city_date_from_file_name(file_name)
             if (city != "" and f_city == city) or (date != "" and f_date == date):
-                details_file.parse(file_name)
-        details_file.save(output_file)
+                details_table.add_file(file_name)
+        details_table.save(output_file)
    
-    def get_top_domains(self):
-        self.top_list = suffix_details_file(self.hll_k, self.max_suffix_parts)
-        for date in self.date_list:
-            print("Merging " + date)
-            self.top_list.merge(self.date_list[date])
-        self.top_list.trim(self.nb_top)
-
     def write_suffix_date(f, date, city, sde):
         sde.evaluate()
         f.write(sde.suffix + "," + date + "," + city + "," + str(sde.hits) \
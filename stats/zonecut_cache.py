@@ -0,0 +1,143 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Cache of the NS and DS answers used to find zone cuts.
+#
+# dnslook.get_ns finds the zone of a domain by querying NS for the domain
+# and then for each shorter suffix, and get_ds_algo queries DS for the
+# zone that was found. Sampled domains share many parents, e.g., all the
+# names in ".blogspot.com", so the same queries are repeated many times
+# in a run. The cache is keyed on the zone name and record type, and
+# holds the outcome of the query:
+#
+# * ANSWER, with the list of values (sanitized NS names or DS algorithms),
+# * NO_ANSWER, if the name exists but has no such record,
+# * ERROR, for NXDOMAIN and other failures that cause get_ns to try the
+#   next suffix.
+#
+# Timeouts are not cached. Entries expire after the TTL of the answer, or
+# after the negative TTL found in the SOA record of negative responses,
+# capped at max_ttl. If no TTL can be found, "negative_ttl" is used.
+#
+# The cache is kept in memory. If a file name is provided, the entries are
+# also stored in an SQLite database, which is shared by the processes
+# that run lookup buckets in parallel: a miss in memory is looked up in
+# the database before being counted as a miss. The expired entries are
+# deleted from the database when it is opened, and the file, with its WAL
+# and shared memory files, is removed by remove_db_files at the end of
+# the run.
+#
+# The counters "hits" and "lookups" are used to report the hit rate in
+# the lookup statistics.
+
+import sqlite3
+import os
+import time
+import json
+
+ANSWER = 0
+NO_ANSWER = 1
+ERROR = 2
+
+class zone_cut_cache:
+    def __init__(self, file_name=None, max_ttl=86400, negative_ttl=300):
+        self.file_name = file_name
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.entries = dict()
+        self.hits = 0
+        self.lookups = 0
+        self.db = None
+        if file_name is not None:
+            self.open_db()
+
+    def open_db(self):
+        self.db = sqlite3.connect(self.file_name, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=OFF")
+        self.db.execute("CREATE TABLE IF NOT EXISTS zone_cache (zone TEXT, rtype TEXT, status INTEGER, vals TEXT, expires REAL, PRIMARY KEY (zone, rtype))")
+        self.db.execute("DELETE FROM zone_cache WHERE expires < ?", (time.time(),))
+        self.db.commit()
+
+    def __getstate__(self):
+        # The database connection cannot be sent to another process,
+        # each process opens its own.
+        state = self.__dict__.copy()
+        state['db'] = None
+        state['entries'] = dict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.file_name is not None:
+            self.open_db()
+
+    def get(self, zone, rtype):
+        # Return the pair (status, values), or None if not in the cache.
+        self.lookups += 1
+        now = time.time()
+        key = (zone, rtype)
+        if key in self.entries:
+            status, values, expires = self.entries[key]
+            if expires > now:
+                self.hits += 1
+                return status, values
+            del self.entries[key]
+        if self.db is not None:
+            row = self.db.execute("SELECT status, vals, expires FROM zone_cache WHERE zone=? AND rtype=?", key).fetchone()
+            if row is not None and row[2] > now:
+                values = json.loads(row[1])
+                self.entries[key] = (row[0], values, row[2])
+                self.hits += 1
+                return row[0], values
+        return None
+
+    def put(self, zone, rtype, status, values, ttl=None):
+        if ttl is None:
+            ttl = self.negative_ttl
+        expires = time.time() + min(ttl, self.max_ttl)
+        self.entries[(zone, rtype)] = (status, values, expires)
+        if self.db is not None:
+            self.db.execute("INSERT OR REPLACE INTO zone_cache VALUES (?, ?, ?, ?, ?)", \
+                (zone, rtype, status, json.dumps(values), expires))
+            self.db.commit()
+
+    def hit_rate(self):
+        if self.lookups == 0:
+            return 0.0
+        return self.hits/self.lookups
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+def remove_db_files(file_name):
+    # Remove the database and the files that SQLite creates next to it in
+    # WAL mode. The caches using it must be closed.
+    for db_file in [ file_name, file_name + "-wal", file_name + "-shm" ]:
+        if os.path.isfile(db_file):
+            os.remove(db_file)
+
+def answer_ttl(answer):
+    try:
+        return answer.rrset.ttl
+    except Exception:
+        return None
+
+def negative_ttl(e):
+    # Find the negative TTL in the SOA record of the authority section,
+    # per RFC 2308: the minimum of the SOA TTL and of its MINIMUM field.
+    try:
+        if hasattr(e, "responses"):
+            responses = e.responses().values()
+        else:
+            responses = [e.kwargs['response']]
+        for response in responses:
+            for rrset in response.authority:
+                for rd in rrset:
+                    if hasattr(rd, "minimum"):
+                        return min(rrset.ttl, rd.minimum)
+    except Exception:
+        pass
+    return None
@@ -11,36 +11,50 @@
 import traceback
 import hyperloglog
 import gzip
-import functools
+import ranking
 import ipaddress
 import pubsuffix
+import zonescanner
 import os
 
 # partition a file, for exampel so that multiple threads can work on a big zone file.
-# partitions end at the closest domain transition.
+# partitions end at the closest domain transition. Positions are counted in bytes,
+# which is what the zone scanner expects, even if the file contains multi-byte
+# UTF-8 characters. For compressed files, positions are counted in uncompressed
+# bytes, and there are at most as many partitions as gzip members, since each
+# worker has to decompress from the start of a member.
 def compute_file_partitions(file_name, nb_parts):
-    # open file
-    file = open(file_name, "rt", encoding="utf-8")
-    # get the cursor positioned at end
-    file.seek(0, os.SEEK_END)
-    # get the current position of cursor
-    # this will be equivalent to size of file
-    file_size = file.tell()
+    gi = None
+    if zonescanner.is_gzip_file_name(file_name):
+        gi = zonescanner.load_gzip_index(file_name)
+        file_size = gi.u_size
+        nb_parts = max(1, min(nb_parts, len(gi.u_offsets)))
+    else:
+        # open file
+        file = open(file_name, "rb")
+        # get the cursor positioned at end
+        file.seek(0, os.SEEK_END)
+        # get the current position of cursor
+        # this will be equivalent to size of file
+        file_size = file.tell()
     # split the file in nb_parts
     file_part = [0]
     for x in range(1,nb_parts):
         b = int (x*file_size/nb_parts)
         if b > 512:
             b -= 512
-        file.seek(b)
+        if gi is None:
+            file.seek(b)
+        else:
+            file, f_raw = zonescanner.open_gzip_at(file_name, gi, b)
         first_line = True
         name_found = False
-        name = ""
+        name = b""
         for line in file:
             if first_line:
                 first_line = False
             else:
-                parts = line.split("\t")
+                parts = line.split(b"\t")
                 if len(parts) > 0:
                     name_part = parts[0].strip()
                     if name_found:
@@ -50,14 +64,32 @@ def compute_file_partitions(file_name, nb_parts):
                         name = name_part
                         name_found = True
             b += len(line)
-        file_part.append(b)
+        if gi is not None:
+            file.close()
+            f_raw.close()
+        if b > file_part[-1] and b < file_size:
+            file_part.append(b)
     file_part.append(file_size)
-    file.close()
+    if gi is None:
+        file.close()
     return file_part
 
 # Normalise the names of the name servers so we can tabulate them
 def extract_server_suffix(ns_name, ps, dups):
     x,is_suffix = ps.suffix(ns_name)
+    return server_suffix_from_match(ns_name, x, is_suffix, dups)
+
+# Batch version of extract_server_suffix, returns a dictionary
+# of name server names to server suffixes.
+def extract_server_suffixes(ns_names, ps, dups, nb_process=1):
+    ns_list = list(set(ns_names))
+    matches = ps.suffix_many(ns_list, nb_process=nb_process)
+    server_suffixes = dict()
+    for ns_name, match in zip(ns_list, matches):
+        server_suffixes[ns_name] = server_suffix_from_match(ns_name, match[0], match[1], dups)
+    return server_suffixes
+
+def server_suffix_from_match(ns_name, x, is_suffix, dups):
     if x == "":
         np = ns_name.split(".")
         l = len(np)
@@ -104,6 +136,10 @@ class service_entry:
         for x in range(0,5):
             self.nb_millions.append(0)
 
+def names_key(item):
+    # Sort key with the same order as compare_by_names.
+    return (item.name_count, item.hit_count, item.server)
+
 def compare_by_names(item, other):
     if item.name_count < other.name_count:
         return -1
@@ -149,8 +185,13 @@ class zone_parser2:
         rank = 0
         log_rank = 0
         next_limit = 100
+        million_hosts = []
         for line in open(file_name , "rt", encoding="utf-8"):
-            million_host = line.strip()
+            million_hosts.append(line.strip())
+        # Resolve the suffixes of all names that need it in one batch
+        suffixes = self.ps.suffix_many([h for h in million_hosts if len(h.split(".")) != 2])
+        i_suffix = 0
+        for million_host in million_hosts:
             rank += 1
             if rank > next_limit and next_limit < 1000000:
                 log_rank += 1
@@ -162,7 +203,8 @@ class zone_parser2:
                 x = p[0] + "." + p[1]
                 is_suffix = True
             else:
-                x,is_suffix = self.ps.suffix(million_host)
+                x,is_suffix = suffixes[i_suffix]
+                i_suffix += 1
             if x == "":
                 x = million_host
             if not x in self.millions:
@@ -202,30 +244,16 @@ class zone_parser2:
         return True
 
     def add_zone_file(self, file_name, p_start=0, p_end=0):
-        file = open(file_name , "rt", encoding="utf-8")
-        file_pos = 0
-        if p_start != 0:
-            file.seek(p_start)
-            file_pos = p_start
-        for line in file:
-            file_pos += len(line)
-            # parse the input line
-            parts = line.split("\t")
-            # if this is a "NS" record, submit.
-            if len(parts) == 5 and parts[2] == "in" and parts[3] == "ns":
-                ns_name = parts[4].strip()
-                if ns_name == "":
-                    print("Cannot add empty ns name from: <" + line.strip() + ">")
-                elif not self.add(ns_name, parts[0]):
-                    print("Error parsing " + line.strip())
-                    break
-            if p_end != 0 and file_pos >= p_end:
+        for fqdn, ns_name in zonescanner.scan_ns_records(file_name, p_start=p_start, p_end=p_end):
+            if ns_name == "":
+                print("Cannot add empty ns name for: <" + fqdn + ">")
+            elif not self.add(ns_name, fqdn):
+                print("Error parsing " + fqdn + " ns " + ns_name)
                 break
-        file.close()
 
     def save(self, file_name):
         flat = list(self.sf_dict.values())
-        flat.sort(key=functools.cmp_to_key(compare_by_names), reverse=True)
+        flat = ranking.top_n(flat, names_key)
         f = open(file_name , "wt", encoding="utf-8")
         f.write("table,server,nb_hits,nb_names," + self.approx_servers.header_full_text("h") + "\n");
         f.write("top,names," + str(self.hit_count) + "," + str(self.name_count) + "\n")
@@ -18,17 +18,24 @@
 # - Keep that sample with probability N/K.
 # - If it is kept, pick one of the selected samples at random and replace it.
 #
-# That works, but the zone file could be very large. It might have to be split
-# in a set of equal size partition. We could just pick an equal number of
-# samples from each partitions, but that would not give the same results as
-# picking at random from the whole set. Instead, we draw at random the number of
-# samples from each partition, using a simple process: if N samples are needed,
-# assign each of them uniformly at random to one of the partitions, thus obtaining
-# a randomized number of sample per partitions. There might be faster algorithms,
-# but this one is merely O(nb_samples), which is good enough for our purposes.
+# That works, but it draws a random number for each of the hundreds of millions
+# of names in the com zone. We use instead the "Algorithm L" of Li (1994), which
+# draws directly the number of names to skip before the next one that is kept.
+# The skips follow a geometric distribution whose parameter decreases as K
+# grows, so the number of random draws is O(N*log(K/N)) instead of O(K).
 #
-# Once the required number of samples have been drawn from each partition, we can
-# merge them in a single list, and then shuffle that list.
+# The zone file could be very large. It might have to be split in a set of
+# partitions. We could just pick an equal number of samples from each partition,
+# but that would not give the same results as picking at random from the whole
+# set. Instead, each partition keeps a reservoir of N samples of its own names,
+# together with the number K of names in the partition. Two reservoirs are
+# merged by drawing how many of the merged samples come from each of them,
+# following the hypergeometric distribution of N draws among K1 + K2 names,
+# and then picking that many samples at random in each reservoir. The result
+# is a uniform sample of the union, so the partitions can have any size and be
+# merged in any order.
+#
+# Once all the partitions are merged, we shuffle the list of samples.
 #
 # Of course, all this sampling requires computing small probabilities, such
 # as 1000/500,000,000 = 1/500,000. That means we need a good unbiased
@@ -49,6 +56,7 @@ import sys
 import math
 import dnslook
 import json
+import zonescanner
 
 class one_zone_sample:
     def __init__(self, name, ns_name):
@@ -89,85 +97,101 @@ class zone_sampler:
         self.K = 0
         self.is_full = False
         self.samples = []
-        self.previous = one_zone_sample("", "")
+        # The NS records of a name follow each other. "previous" is the
+        # sample of the last name, or None if that name was not kept.
+        self.previous_name = None
+        self.previous = None
+        self.W = 1.0
+        self.next_K = 0
         if seed == 0:
             seed = os.urandom(16)
         self.rand = random.Random(seed)
 
+    def random_open(self):
+        # uniform in (0, 1], so that the logarithm is defined.
+        return 1.0 - self.rand.random()
+
+    def next_skip(self):
+        # Algorithm L: W is distributed as the largest of N uniform keys
+        # among the names seen so far, and the rank of the next name kept
+        # is drawn from a geometric distribution of parameter W.
+        self.W *= math.exp(math.log(self.random_open())/self.N)
+        if self.W >= 1.0:
+            self.next_K = self.K + 1
+        else:
+            self.next_K = self.K + int(math.log(self.random_open())/math.log1p(-self.W)) + 1
+
     def propose(self, name, ns_name):
-        if self.previous.add_ns(name, ns_name):
+        if name == self.previous_name:
+            if self.previous is not None:
+                self.previous.add_ns(name, ns_name)
             return
-        new_name = one_zone_sample(name, ns_name)
-        self.previous = new_name
+        self.previous_name = name
+        self.previous = None
         self.K += 1
         if not self.is_full:
-            self.samples.append(new_name)
+            if self.N <= 0:
+                return
+            self.previous = one_zone_sample(name, ns_name)
+            self.samples.append(self.previous)
             self.is_full = len(self.samples) >= self.N
-            # print("Sample[" + str(self.K -1) + "]= " + name)
-        else:
-            r = self.rand.random()
-            if r <= self.N/self.K:
-                u = self.rand.randrange(0, self.N)
-                # old = self.samples[u]
-                # print("Sample[" + str(u) + "]= " + name + " instead of " + old)
-                self.samples[u] = new_name
+            if self.is_full:
+                self.W = 1.0
+                self.next_skip()
+        elif self.K == self.next_K:
+            u = self.rand.randrange(0, self.N)
+            self.previous = one_zone_sample(name, ns_name)
+            self.samples[u] = self.previous
+            self.next_skip()
+
+    def merge(self, other):
+        # Merge the reservoir of another partition: keep min(N, K1+K2)
+        # samples, of which the number taken from "other" follows the
+        # hypergeometric distribution.
+        nb_merged = min(self.N, self.K + other.K)
+        k_self = self.K
+        k_other = other.K
+        nb_other = 0
+        for i in range(0, nb_merged):
+            if self.rand.randrange(0, k_self + k_other) < k_other:
+                nb_other += 1
+                k_other -= 1
+            else:
+                k_self -= 1
+        self.samples = self.rand.sample(self.samples, nb_merged - nb_other) + \
+            self.rand.sample(other.samples, nb_other)
+        self.K += other.K
+        self.is_full = len(self.samples) >= self.N
+        self.previous_name = None
+        self.previous = None
 
     def save(self, file_name):
         with open(file_name, "wt") as file:
             for one_name in self.samples:
                 file.write(one_name.to_json() + "\n")
 
+    def save_partial_result(self, file_name):
+        # Same as save, preceded by the number of names in the partition.
+        with open(file_name, "wt") as file:
+            file.write("{\"population\":" + str(self.K) + "}\n")
+            for one_name in self.samples:
+                file.write(one_name.to_json() + "\n")
+
     def load_partial_result(self, result_file):
+        # Merge the reservoir saved by save_partial_result.
+        part = zone_sampler(self.N, seed=1)
         for line in open(result_file, "rt"):
+            if line.startswith("{\"population\":"):
+                part.K = json.loads(line)['population']
+                continue
             one_name = one_zone_sample("","")
             if one_name.from_json(line):
-                self.samples.append(one_name)
+                part.samples.append(one_name)
+        self.merge(part)
 
     def add_zone_file(self, file_name, p_start=0, p_end=0):
-        file = open(file_name , "rt", encoding="utf-8")
-        file_pos = 0
-        if p_start != 0:
-            file.seek(p_start)
-            file_pos = p_start
-        for line in file:
-            file_pos += len(line)
-            # parse the input line
-            parts = line.split("\t")
-            # if this is a "NS" record, submit the name.
-            if len(parts) == 5 and parts[2] == "in" and parts[3] == "ns":
-                self.propose(parts[0], parts[4].strip())
-            if p_end != 0 and file_pos >= p_end:
-                break
-        file.close()
+        for name, ns_name in zonescanner.scan_ns_records(file_name, p_start=p_start, p_end=p_end):
+            self.propose(name, ns_name)
 
     def shuffle(self):
         self.rand.shuffle(self.samples)
-
-    # compute the number of samples per bucket
-    def samples_per_bucket(self, nb_samples, n_p, seed = 0):  
-        ns_p = []
-        for i in range(0,n_p):
-            ns_p.append(0)
-
-        for i in range(0, nb_samples):
-            u = self.rand.randrange(0, n_p)
-            ns_p[u] += 1
-
-        return ns_p
-
-# simple test program
-def basic_test(nb_samples, n_p, zone_file, sample_file, partition_files):
-    zs = zone_sampler(12, 12345678901)
-    zs.add_zone_file(zone_file)
-    zs.shuffle()
-    zs.save(sample_file)
-
-    with open(partition_files, "wt") as file:
-        file.write("n_p, nb_samples, l_n_sp, n_sp_x\n")
-        n_sp = zs.samples_per_bucket(nb_samples, n_p, 0)
-        file.write(str(n_p) + "," + str(nb_samples) + "," + str(len(n_sp)) + "\n")
-        for i in range(0, len(n_sp)):
-            file.write(str(n_p) + "," + str(nb_samples) + "," + str(i) + "," + str(n_sp[i]) + "\n")
-
-# basic test
-# basic_test(10000, 50, sys.argv[1], sys.argv[2], sys.argv[3])
\ No newline at end of file
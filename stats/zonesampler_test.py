@@ -0,0 +1,102 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Unit test of the zone sampler.
+#
+# Each name of a small population is proposed with two NS records. Over
+# many trials with different seeds, each name must be sampled about N/K of
+# the time, both by a single sampler and when the population is split in
+# partitions of very different sizes, sampled separately and merged in
+# varying orders through the partial result files. The samples must keep
+# all the NS records of their names, and hold min(N, K) names.
+#
+# Expect this test to work:
+#
+# py .\zonesampler_test.py ..\tmp\
+
+import sys
+import os
+import zonesampler
+
+def propose_all(zs, names):
+    for name in names:
+        zs.propose(name, "ns1." + name)
+        zs.propose(name, "ns2." + name)
+
+def check_sample(label, zs, nb_expected, counts):
+    ret = True
+    if len(zs.samples) != nb_expected:
+        print(label + ": " + str(len(zs.samples)) + " samples instead of " + str(nb_expected))
+        ret = False
+    seen = set()
+    for sample in zs.samples:
+        if sample.domain in seen or sample.ns != [ "ns1." + sample.domain, "ns2." + sample.domain ]:
+            print(label + ": bad sample " + sample.to_json())
+            ret = False
+        seen.add(sample.domain)
+        counts[sample.domain] += 1
+    return ret
+
+def check_uniform(label, counts, nb_trials, p):
+    # accept deviations of 5 standard deviations from the expected count.
+    expected = nb_trials*p
+    sigma = (nb_trials*p*(1 - p))**0.5
+    for name in counts:
+        if abs(counts[name] - expected) > 5*sigma:
+            print(label + ": " + name + " sampled " + str(counts[name]) + " times, expected " + str(int(expected)))
+            return False
+    return True
+
+# main program
+
+if len(sys.argv) != 2:
+    print("Usage: " + sys.argv[0] + " tmp_dir")
+    exit(1)
+temp_prefix = os.path.join(sys.argv[1], "zonesampler_test_")
+
+ret = True
+N = 5
+names = [ "d" + str(i) + ".com" for i in range(0, 40) ]
+partitions = [ names[0:3], names[3:4], names[4:30], [], names[30:40] ]
+nb_trials = 2000
+
+counts = dict((name, 0) for name in names)
+for trial in range(0, nb_trials):
+    zs = zonesampler.zone_sampler(N, seed=trial + 1)
+    propose_all(zs, names)
+    ret &= check_sample("single", zs, N, counts)
+    if zs.K != len(names):
+        print("single: found " + str(zs.K) + " names instead of " + str(len(names)))
+        ret = False
+    if not ret:
+        break
+ret &= check_uniform("single", counts, nb_trials, N/len(names))
+
+counts = dict((name, 0) for name in names)
+for trial in range(0, nb_trials):
+    if not ret:
+        break
+    part_files = []
+    for i in range(0, len(partitions)):
+        part = zonesampler.zone_sampler(N, seed=1000000 + trial*len(partitions) + i)
+        propose_all(part, partitions[i])
+        part_file = temp_prefix + str(i) + ".txt"
+        part.save_partial_result(part_file)
+        part_files.append(part_file)
+    zs = zonesampler.zone_sampler(N, seed=trial + 1)
+    for i in range(0, len(part_files)):
+        zs.load_partial_result(part_files[(i + trial)%len(part_files)])
+    ret &= check_sample("merged", zs, N, counts)
+ret &= check_uniform("merged", counts, nb_trials, N/len(names))
+
+zs = zonesampler.zone_sampler(N, seed=1)
+for partition in partitions[0:2]:
+    part = zonesampler.zone_sampler(N, seed=2)
+    propose_all(part, partition)
+    zs.merge(part)
+ret &= check_sample("small", zs, 4, dict((name, 0) for name in names))
+
+if not ret:
+    exit(1)
+print("Zone samples are uniform over " + str(nb_trials) + " trials.")
+exit(0)
@@ -0,0 +1,277 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Scan the NS records of a zone file.
+#
+# Zone files such as the .com zone have hundreds of millions of lines, but
+# only the NS records matter for the zone parser and the zone sampler. The
+# scanner maps the file in memory and works on bytes: it looks for the
+# "\tin\tns\t" pattern with find, which skips the other lines without
+# creating any python object for them. The matching lines are then split
+# and checked exactly as in the text based parsers, i.e., 5 fields with
+# "in" and "ns" as third and fourth fields, and only the owner name and the
+# name server name are decoded.
+#
+# Partitions are expressed in bytes. A partition [p_start, p_end] covers
+# the lines that start at or after p_start and before p_end. If p_end is
+# 0, the partition extends to the end of the file. Partition boundaries
+# are expected to be at the beginning of a line, as computed by
+# zoneparser.compute_file_partitions.
+#
+# Compressed zone files, with names ending in ".gz", are also supported.
+# Partitions are then expressed in bytes of the uncompressed data. A
+# deflate stream cannot be restarted in the middle, but a gzip file can
+# be made of several independent members, each starting a new deflate
+# stream. This is the case of files produced by "bgzip", or by the
+# function write_blocked_gzip, which starts each member at an owner name
+# transition. The index of the members, i.e., the compressed and
+# uncompressed offsets at which each one starts, is computed by
+# decompressing the file once, and is cached in a file with the suffix
+# GZIP_INDEX_SUFFIX next to the zone file. A worker then starts
+# decompressing at the last member before its partition. A classic gzip
+# file has a single member, and thus a single partition. It can be
+# compressed again in members, once, with:
+#
+# python zonescanner.py blocked zone_file blocked_file.gz
+
+import sys
+import time
+import mmap
+import os
+import gzip
+import zlib
+import bisect
+
+NS_PATTERN = b"\tin\tns\t"
+GZIP_INDEX_SUFFIX = ".zidx"
+READ_CHUNK = 1<<20
+
+def is_gzip_file_name(file_name):
+    return file_name.endswith(".gz")
+
+def scan_ns_buffer(buf, p_start, p_end):
+    # Yield the pairs (owner, ns_name) found in the lines of "buf" that
+    # start in [p_start, p_end). Works on any buffer with find and rfind.
+    file_size = len(buf)
+    if p_end == 0 or p_end > file_size:
+        p_end = file_size
+    # Find the end of the line that contains the last byte of the partition.
+    if p_end > 0:
+        stop = buf.find(b"\n", p_end - 1)
+        if stop < 0:
+            stop = file_size
+        else:
+            stop += 1
+    else:
+        stop = 0
+    pos = p_start
+    while pos < stop:
+        x = buf.find(NS_PATTERN, pos, stop)
+        if x < 0:
+            break
+        line_start = buf.rfind(b"\n", p_start, x) + 1
+        if line_start == 0:
+            line_start = p_start
+        line_end = buf.find(b"\n", x, stop)
+        if line_end < 0:
+            line_end = stop
+        else:
+            line_end += 1
+        parts = buf[line_start:line_end].split(b"\t")
+        if len(parts) == 5 and parts[2] == b"in" and parts[3] == b"ns":
+            yield parts[0].decode("utf-8"), parts[4].decode("utf-8").strip()
+        pos = line_end
+
+def scan_ns_records(file_name, p_start=0, p_end=0):
+    # Yield the pairs (owner, ns_name) found in the partition.
+    if is_gzip_file_name(file_name):
+        yield from scan_gzip_ns_records(file_name, p_start=p_start, p_end=p_end)
+        return
+    with open(file_name, "rb") as file:
+        try:
+            mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files cannot be mapped
+            return
+        try:
+            yield from scan_ns_buffer(mm, p_start, p_end)
+        finally:
+            mm.close()
+
+class gzip_index:
+    # List of the members of a gzip file: compressed offset and
+    # uncompressed offset of each, plus the total uncompressed size.
+    def __init__(self):
+        self.c_offsets = []
+        self.u_offsets = []
+        self.u_size = 0
+
+    def build(self, file_name):
+        self.c_offsets = []
+        self.u_offsets = []
+        c_pos = 0
+        u_pos = 0
+        d = None
+        with open(file_name, "rb") as f:
+            while True:
+                data = f.read(READ_CHUNK)
+                if len(data) == 0:
+                    break
+                while len(data) > 0:
+                    if d is None:
+                        self.c_offsets.append(c_pos)
+                        self.u_offsets.append(u_pos)
+                        d = zlib.decompressobj(wbits=31)
+                    u_pos += len(d.decompress(data))
+                    if d.eof:
+                        rest = d.unused_data
+                        c_pos += len(data) - len(rest)
+                        data = rest
+                        d = None
+                    else:
+                        c_pos += len(data)
+                        data = b""
+        self.u_size = u_pos
+
+    def save(self, file_name):
+        with open(file_name, "wt", encoding="utf-8") as f:
+            f.write("c_offset,u_offset\n")
+            for c_off, u_off in zip(self.c_offsets, self.u_offsets):
+                f.write(str(c_off) + "," + str(u_off) + "\n")
+            f.write("end," + str(self.u_size) + "\n")
+
+    def load(self, file_name):
+        self.c_offsets = []
+        self.u_offsets = []
+        self.u_size = -1
+        for line in open(file_name, "rt", encoding="utf-8"):
+            parts = line.strip().split(",")
+            if len(parts) != 2 or parts[0] == "c_offset":
+                continue
+            if parts[0] == "end":
+                self.u_size = int(parts[1])
+            else:
+                self.c_offsets.append(int(parts[0]))
+                self.u_offsets.append(int(parts[1]))
+        # an index without end line was not completely written
+        return self.u_size >= 0
+
+    def member_for(self, u_pos):
+        # Index of the last member starting at or before u_pos
+        return max(0, bisect.bisect_right(self.u_offsets, u_pos) - 1)
+
+def load_gzip_index(file_name):
+    # Load the index of a gzip file, computing and caching it if needed.
+    index_name = file_name + GZIP_INDEX_SUFFIX
+    gi = gzip_index()
+    if os.path.isfile(index_name) and os.path.getmtime(index_name) >= os.path.getmtime(file_name) and \
+        gi.load(index_name):
+        return gi
+    gi.build(file_name)
+    try:
+        gi.save(index_name)
+    except OSError:
+        print("Cannot save the index of " + file_name + " in " + index_name)
+    return gi
+
+def open_gzip_at(file_name, gi, u_pos):
+    # Return a gzip stream positioned at the uncompressed offset u_pos.
+    i = gi.member_for(u_pos)
+    f = open(file_name, "rb")
+    f.seek(gi.c_offsets[i])
+    gz = gzip.GzipFile(fileobj=f, mode="rb")
+    skip = u_pos - gi.u_offsets[i]
+    while skip > 0:
+        data = gz.read(min(skip, READ_CHUNK))
+        if len(data) == 0:
+            break
+        skip -= len(data)
+    return gz, f
+
+def scan_gzip_ns_records(file_name, p_start=0, p_end=0):
+    gi = load_gzip_index(file_name)
+    if p_end == 0 or p_end > gi.u_size:
+        p_end = gi.u_size
+    if p_start >= p_end:
+        return
+    gz, f = open_gzip_at(file_name, gi, p_start)
+    try:
+        # u_pos is the uncompressed offset of the start of "carry".
+        u_pos = p_start
+        carry = b""
+        while u_pos < p_end:
+            data = gz.read(READ_CHUNK)
+            buf = carry + data
+            if len(data) == 0:
+                last = len(buf)
+            else:
+                last = buf.rfind(b"\n") + 1
+            if last > 0:
+                # buf[:last] only contains complete lines, the ones
+                # starting before p_end are in the partition.
+                yield from scan_ns_buffer(buf[:last], 0, min(last, p_end - u_pos))
+            carry = buf[last:]
+            u_pos += last
+            if len(data) == 0:
+                break
+    finally:
+        gz.close()
+        f.close()
+
+def write_blocked_gzip(zone_file, gz_file, block_size=1<<24):
+    # Compress a zone file as a series of gzip members of about block_size
+    # uncompressed bytes, each starting at an owner name transition, and
+    # write the corresponding index. The input can itself be compressed.
+    gi = gzip_index()
+    if is_gzip_file_name(zone_file):
+        fin = gzip.open(zone_file, "rb")
+    else:
+        fin = open(zone_file, "rb")
+    block = []
+    block_len = 0
+    previous_name = None
+    c_pos = 0
+    u_pos = 0
+    with fin, open(gz_file, "wb") as fout:
+        for line in fin:
+            name = line.split(b"\t", 1)[0].strip()
+            if block_len >= block_size and name != previous_name:
+                member = gzip.compress(b"".join(block), mtime=0)
+                gi.c_offsets.append(c_pos)
+                gi.u_offsets.append(u_pos)
+                fout.write(member)
+                c_pos += len(member)
+                u_pos += block_len
+                block = []
+                block_len = 0
+            block.append(line)
+            block_len += len(line)
+            previous_name = name
+        if block_len > 0 or len(gi.c_offsets) == 0:
+            member = gzip.compress(b"".join(block), mtime=0)
+            gi.c_offsets.append(c_pos)
+            gi.u_offsets.append(u_pos)
+            fout.write(member)
+            u_pos += block_len
+    gi.u_size = u_pos
+    gi.save(gz_file + GZIP_INDEX_SUFFIX)
+    return gi
+
+def usage(argv_0):
+    print("Usage:\n" + argv_0 + " blocked zone_file blocked_file")
+    print("    zone_file:    zone file, possibly compressed with gzip.")
+    print("    blocked_file: file compressed in gzip members, with a name ending in .gz,")
+    print("                  next to which the index " + GZIP_INDEX_SUFFIX + " is written.")
+
+# main loop
+def main():
+    if len(sys.argv) != 4 or sys.argv[1] != "blocked" or not is_gzip_file_name(sys.argv[3]):
+        usage(sys.argv[0])
+        exit(1)
+    start_time = time.time()
+    gi = write_blocked_gzip(sys.argv[2], sys.argv[3])
+    print("Wrote " + str(len(gi.c_offsets)) + " members, " + str(gi.u_size) + " bytes in " + str(time.time() - start_time))
+
+# actual main program, can be called by threads, etc.
+if __name__ == '__main__':
+    main()
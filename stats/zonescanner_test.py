@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# coding=utf-8
+#
+# Unit test of the zone scanner.
+#
+# The NS records of a plain zone file are scanned in one shot, and then
+# from compressed copies of the file, one partition at a time: a classic
+# gzip file with a single member, a file made of fixed size members that
+# split lines as "bgzip" would, and a file written by write_blocked_gzip.
+# In all cases, the records found in the partitions must match the one
+# shot scan, in the same order.
+#
+# Expect this test to work:
+#
+# py .\zonescanner_test.py ..\data\zone_test.txt ..\tmp\
+
+import sys
+import os
+import gzip
+import zonescanner
+import zoneparser
+
+def scan_partitions(file_name, nb_parts):
+    file_part = zoneparser.compute_file_partitions(file_name, nb_parts)
+    records = []
+    for x in range(0, len(file_part) - 1):
+        records += list(zonescanner.scan_ns_records(file_name, p_start=file_part[x], p_end=file_part[x+1]))
+    return records, file_part
+
+def check_file(label, file_name, reference, min_parts):
+    ret = True
+    for nb_parts in [1, 4, 7]:
+        records, file_part = scan_partitions(file_name, nb_parts)
+        expected_parts = min(nb_parts, min_parts)
+        if records != reference:
+            print(label + ", " + str(nb_parts) + " parts: got " + str(len(records)) + " records instead of " + str(len(reference)))
+            ret = False
+        elif len(file_part) - 1 < expected_parts:
+            print(label + ", " + str(nb_parts) + " parts: only " + str(len(file_part) - 1) + " partitions, " + str(file_part))
+            ret = False
+    if ret:
+        print(label + ": " + str(len(reference)) + " records found as expected.")
+    return ret
+
+# main program
+
+if len(sys.argv) != 3:
+    print("Usage: " + sys.argv[0] + " zone_file tmp_dir")
+    exit(1)
+zone_file = sys.argv[1]
+tmp_dir = sys.argv[2]
+
+reference = list(zonescanner.scan_ns_records(zone_file))
+zone_bytes = open(zone_file, "rb").read()
+
+single_gz = os.path.join(tmp_dir, "zone_single.txt.gz")
+with open(single_gz, "wb") as f:
+    f.write(gzip.compress(zone_bytes))
+
+members_gz = os.path.join(tmp_dir, "zone_members.txt.gz")
+with open(members_gz, "wb") as f:
+    for i in range(0, len(zone_bytes), 4000):
+        f.write(gzip.compress(zone_bytes[i:i+4000]))
+
+blocked_gz = os.path.join(tmp_dir, "zone_blocked.txt.gz")
+zonescanner.write_blocked_gzip(zone_file, blocked_gz, block_size=4000)
+
+# Remove stale indices, so they are computed again.
+for file_name in [single_gz, members_gz]:
+    if os.path.isfile(file_name + zonescanner.GZIP_INDEX_SUFFIX):
+        os.remove(file_name + zonescanner.GZIP_INDEX_SUFFIX)
+
+ret = check_file("plain", zone_file, reference, 4)
+ret &= check_file("single member", single_gz, reference, 1)
+ret &= check_file("fixed members", members_gz, reference, 4)
+ret &= check_file("blocked", blocked_gz, reference, 4)
+
+# The blocked file must decompress to the original.
+if gzip.open(blocked_gz, "rb").read() != zone_bytes:
+    print("Blocked file does not match " + zone_file)
+    ret = False
+
+if not ret:
+    exit(1)
+else:
+    exit(0)